@@ -7,24 +7,149 @@
 该脚本负责每日获取指数数据、处理数据、执行回测并导出结果。
 """
 
+import os
 import json
-import pickle
+import time
+import asyncio
 import pathlib
 import logging
+import argparse
 import pytz
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import pandas as pd
 import numpy as np
-from utils import retry, get_dates_ranges, query_json
+from utils import retry, async_retry, get_dates_ranges, query_json, AsyncLixingerClient
+from utils import configure_rate_limit, DEFAULT_RATE_LIMIT, DEFAULT_RATE_BURST, DEFAULT_LATENCY_TARGET
+from utils import configure_timeouts, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+from utils import configure_http_session
+from utils import set_deadline, deadline_remaining, DeadlineExceeded
+from utils import configure_response_cache, log_response_cache_stats, DEFAULT_RESPONSE_CACHE_BYTES
+from utils import DictIndex
+from modules.data_processor import rolling_percentile_rank, conform_index_frame, INDICATOR_DTYPE
+from modules.data_processor import INDICATOR_COLUMNS, SIGNAL_COLUMNS
+from modules.backtester import backtest_single_index, resume_backtest, sweep_single_index, aggregate_sweep
+from modules.config_manager import load_config
+from modules.run_manifest import RunManifest
+from modules.data_exporter import (
+    write_index_files,
+    write_company_table,
+    remove_stale_outputs,
+    write_if_changed,
+    configure_precompress,
+    code_version,
+    export_digest,
+    index_outputs_exist,
+    load_export_manifest,
+    save_export_manifest
+)
+from modules.data_manager import (
+    index_data_path,
+    index_data_digest,
+    load_index_data,
+    load_index_frame,
+    load_index_meta,
+    load_records,
+    iter_records,
+    save_index_data,
+    configure_cache,
+    RUN_CACHE,
+    migrate_pickles
+)
 
 SHANGHAI_TZ = pytz.timezone("Asia/Shanghai")
 BASE_DIR = pathlib.Path(__file__).parent
 DATA_DIR = BASE_DIR.joinpath("data")
 OUTPUT_DIR = BASE_DIR.joinpath("output")
+OUTPUT_INDEX_DIR = OUTPUT_DIR.joinpath("index")
+# 筛选后的指数列表，由 weekly.py 生成；各阶段通过 load_records 读取，本次运行中只解析一次
+CN_INDEX_FILE = BASE_DIR.joinpath("cn_index_filtered.json")
 if not DATA_DIR.exists():
     DATA_DIR.mkdir()
 
+# 加载配置文件，如果不存在则使用空字典
+config = load_config(BASE_DIR.joinpath("config.json"), {})
+
+# 导出时生成的预压缩格式（gz，可选 br）和需要预压缩的最小文件大小，在模块级设置，各工作进程导入时都会生效
+configure_precompress(config.get("precompress", ["gz"]), int(config.get("precompress_min_kb", 128) * 1024))
+# 运行期缓存的内存上限，各阶段在同一进程中读取同一个指数时直接使用缓存，0 表示不缓存
+configure_cache(int(config.get("cache_budget_mb", 512) * 2 ** 20))
+
+# 增量抓取时与已保存数据重叠的交易日数，用于检测缺口和历史修订
+INCREMENTAL_OVERLAP_ROWS = 5
+
+# 计算指标所需的最长窗口（估值百分位的500个交易日），增量计算时从新数据之前这么多行开始重算
+INDICATOR_WINDOW = 500
+
+# 理杏仁接口的响应缓存目录，与 data/ 一起缓存，已封闭的历史区间不再重复请求
+RESPONSE_CACHE_DIR = DATA_DIR.joinpath("http_cache")
+
+# 导出清单，记录上次导出时每个指数的导出哈希，与 data/ 一起缓存
+EXPORT_MANIFEST_FILE = DATA_DIR.joinpath("export_manifest.json")
+# 上次导出的哈希，工作进程中由 use_export_digests 设置
+previous_export_digests = {}
+
+# 运行清单，记录每个指数在每个阶段的状态、数据哈希和耗时，--resume / --retry-failed 据此跳过已完成的工作
+RUN_MANIFEST_FILE = DATA_DIR.joinpath("run_manifest.json")
+# 分阶段模式下抓取阶段的默认截止时间（秒）；融合模式下截止时间覆盖整个处理流程，默认不限制
+DEFAULT_FETCH_DEADLINE = 1800
+# 两种模式各自的阶段，按执行顺序排列
+STAGES = ("fetch", "calculate", "backtest", "export")
+FUSED_STAGES = ("process",)
+# 本次运行的清单，只在主进程中由 use_run_manifest 设置
+run_manifest = None
+# 抓取单个指数时同时请求的日期区间数；融合模式的工作进程中由 init_fused_worker 设置
+fetch_threads = 1
+
+# 接口字段到中文列名的映射
+FETCH_COLUMN_MAPPING = {
+    'date': '日期',
+    'volume': '成交量',
+    'open': '开盘价',
+    'high': '最高价',
+    'low': '最低价',
+    'close': '收盘价',
+    'change': '涨跌幅',
+    'amount': '成交额',
+    'pe_ttm.mcw': '市盈率',
+    'pb.mcw': '市净率',
+    'dyr.mcw': '股息率',
+    'stockCode': '股票代码'
+}
+
+# 导出时中文列名到英文列名的映射
+EXPORT_COLUMN_MAPPING = {
+    '日期': 'date',
+    '开盘价': 'open',
+    '收盘价': 'close',
+    '最低价': 'low',
+    '最高价': 'high',
+    '成交量': 'volume',
+    '涨跌幅': 'change',
+    '成交额': 'amount',
+    '市盈率': 'pe_ttm',
+    '市净率': 'pb',
+    '股息率': 'dyr',
+    '股票代码': 'stockCode',
+    '5日均线': 'ma5',
+    '10日均线': 'ma10',
+    '20日均线': 'ma20',
+    '30日均线': 'ma30',
+    '60日均线': 'ma60',
+    '120日均线': 'ma120',
+    '250日均线': 'ma250',
+    '布林线中轨': 'bb_middle',
+    '布林线上轨': 'bb_upper',
+    '布林线下轨': 'bb_lower',
+    '布林线位置': 'bb_position',
+    '市盈率百分位': 'pe_percentile',
+    '市净率百分位': 'pb_percentile',
+    '股息率收益率': 'dyr_percentile',
+    '估值百分位': 'valuation_percentile'
+}
+
 
 # 设置pandas显示选项
 # 设置最大行数显示（None 表示无限制）
@@ -76,23 +201,40 @@ def filter_consecutive_missing_data(df):
     return df.iloc[first_valid_index:].copy()
 
 
-@retry(max_attempts=5, delay=2)
-def fetch_index_candlestick(index):
+def candlestick_query(index, start, end):
+    return {
+        "stockCode": index["stockCode"],
+        "type": "normal",
+        "startDate": start,
+        "endDate": end,
+    }
+
+
+def fundamental_query(stock_codes, start, end):
+    return {
+        "stockCodes": list(stock_codes),
+        "startDate": start,
+        "endDate": end,
+        "metricsList": [
+            "pe_ttm.mcw",  # 滚动市盈率(市值加权)
+            "pb.mcw",  # 市净率(市值加权)
+            "dyr.mcw",  # 股息率(市值加权)
+        ]
+    }
+
+
+def fetch_date_ranges(index, start_datetime=None):
     end_datetime = datetime.now(SHANGHAI_TZ)
-    launch_datetime = datetime.fromisoformat(index["launchDate"])
+    # 未指定开始日期时从指数发布日开始全量抓取
+    if start_datetime is None:
+        start_datetime = datetime.fromisoformat(index["launchDate"])
+    # 将日期分组
+    return get_dates_ranges(start_datetime, end_datetime)
 
+
+def records_to_frame(fetches):
     result = []
-    # 将日期分组
-    date_ranges = get_dates_ranges(launch_datetime, end_datetime)
-
-    for start, end in date_ranges:
-        fetch = query_json(url_suffix="cn/index/candlestick",
-                           query_params={
-                               "stockCode": index["stockCode"],
-                               "type": "normal",
-                               "startDate": start,
-                               "endDate": end,
-                           })
+    for fetch in fetches:
         if fetch['message'] != "success":
             raise Exception
         result.extend(fetch["data"])
@@ -105,571 +247,1079 @@ def fetch_index_candlestick(index):
 
 
 @retry(max_attempts=5, delay=2)
-def fetch_index_fundamental(index: dict):
-    end_datetime = datetime.now(SHANGHAI_TZ)
-    launch_datetime = datetime.fromisoformat(index["launchDate"])
+def query_chunk(url_suffix, query_params, refresh=False):
+    """
+    请求一个日期区间的数据，失败时只重试这一个区间，已成功的区间不会重复请求
 
-    result = []
-    date_ranges = get_dates_ranges(launch_datetime, end_datetime)
-
-    for start, end in date_ranges:
-        fetch = query_json(url_suffix="cn/index/fundamental",
-                           query_params={
-                               "stockCodes": [index["stockCode"], ],
-                               "startDate": start,
-                               "endDate": end,
-                               "metricsList": [
-                                   "pe_ttm.mcw",  # 滚动市盈率(市值加权)
-                                   "pb.mcw",  # 市净率(市值加权)
-                                   "dyr.mcw",  # 股息率(市值加权)
-                               ]
-                           })
-        if fetch['message'] != "success":
-            raise Exception
-        result.extend(fetch["data"])
+    refresh 为 True 时不使用响应缓存，已封闭区间的缓存永不过期，历史数据被修订后必须重新请求
+    """
+    fetch = query_json(url_suffix=url_suffix, query_params=query_params, refresh=refresh)
+    if fetch['message'] != "success":
+        raise Exception(f"请求 {url_suffix} 失败: {fetch['message']}")
+    return fetch
 
-    for item in result:
-        item["date"] = datetime.fromisoformat(item["date"]).strftime("%Y-%m-%d")
 
-    df = pd.DataFrame(result)
+@async_retry(max_attempts=5, delay=2)
+async def query_chunk_async(client, url_suffix, query_params, refresh=False):
+    """query_chunk 的异步版本"""
+    fetch = await client.query_json(url_suffix, query_params, refresh)
+    if fetch['message'] != "success":
+        raise Exception(f"请求 {url_suffix} 失败: {fetch['message']}")
+    return fetch
 
-    return df
 
-def fetch_index(index):
-    candlestick = fetch_index_candlestick(index)
-    fundamental = fetch_index_fundamental(index)
+def query_chunks(chunks, refresh=False):
+    """
+    依次请求多个日期区间，fetch_threads 大于1时用线程并发请求
+
+    Args:
+        chunks (list): (接口路径, 请求参数) 的列表
+        refresh (bool): 不使用响应缓存
+
+    Returns:
+        list: 与 chunks 顺序一致的返回结果
+    """
+    if fetch_threads <= 1 or len(chunks) <= 1:
+        return [query_chunk(url_suffix, query_params, refresh) for url_suffix, query_params in chunks]
+    with ThreadPoolExecutor(max_workers=min(fetch_threads, len(chunks))) as executor:
+        return list(executor.map(lambda chunk: query_chunk(*chunk, refresh), chunks))
+
+
+def fetch_index_frames(index, start_datetime=None, fundamental=None, refresh=False):
+    """
+    抓取指数的K线数据，以及 fundamental 为None时的估值数据，两者的各个日期区间一起请求
+
+    Returns:
+        tuple: (K线数据DataFrame, 估值数据DataFrame)
+    """
+    date_ranges = fetch_date_ranges(index, start_datetime)
+    chunks = [("cn/index/candlestick", candlestick_query(index, start, end)) for start, end in date_ranges]
+    if fundamental is None:
+        chunks += [("cn/index/fundamental", fundamental_query([index["stockCode"]], start, end))
+                   for start, end in date_ranges]
+    fetches = query_chunks(chunks, refresh)
+    if fundamental is None:
+        fundamental = records_to_frame(fetches[len(date_ranges):])
+    return records_to_frame(fetches[:len(date_ranges)]), fundamental
+
+
+async def fetch_index_candlestick_async(client, index, start_datetime=None, refresh=False):
+    """异步抓取K线数据，各日期区间并发请求"""
+    fetches = await asyncio.gather(*(
+        query_chunk_async(client, "cn/index/candlestick", candlestick_query(index, start, end), refresh)
+        for start, end in fetch_date_ranges(index, start_datetime)
+    ))
+    return records_to_frame(fetches)
+
+
+async def fetch_index_fundamental_async(client, index, start_datetime=None, refresh=False):
+    """异步抓取估值数据，各日期区间并发请求"""
+    fetches = await asyncio.gather(*(
+        query_chunk_async(client, "cn/index/fundamental", fundamental_query([index["stockCode"]], start, end),
+                          refresh)
+        for start, end in fetch_date_ranges(index, start_datetime)
+    ))
+    return records_to_frame(fetches)
+
+
+def split_fundamental_batch(indices, fetches):
+    """
+    将一次批量请求返回的估值数据按 stockCode 拆分到各个指数
+
+    Args:
+        indices (list): 本批次的指数
+        fetches (list): 各日期区间的接口返回结果
+
+    Returns:
+        dict: stockCode -> 估值数据DataFrame；接口报错时为空字典，缺少数据的指数不在其中
+    """
+    if any(fetch.get('message') != "success" for fetch in fetches):
+        logging.warning(f"批量抓取估值数据失败，改为逐个抓取: {[fetch.get('message') for fetch in fetches]}")
+        return {}
+    df = records_to_frame(fetches)
+    if df.empty or 'stockCode' not in df.columns:
+        return {}
+
+    result = {}
+    for stockCode, group in df.groupby('stockCode', sort=False):
+        # 单独请求时接口不返回全为空的指标，拆分后去掉这些列以保持字段一致
+        result[stockCode] = group.dropna(axis=1, how='all').reset_index(drop=True)
+    missing = [index["stockCode"] for index in indices if index["stockCode"] not in result]
+    if missing:
+        logging.info(f"批量抓取估值数据缺少 {missing}，这些指数改为逐个抓取")
+    return result
+
+
+def fetch_fundamental_batch(indices, start_datetime=None, refresh=False):
+    """
+    一次请求同一日期区间内多个指数的估值数据
+
+    请求失败时不重试，返回空字典，由调用方对各指数逐个抓取。
+
+    Args:
+        indices (list): 抓取日期区间相同的指数
+        start_datetime: 开始日期，None 表示从发布日开始
+        refresh (bool): 不使用响应缓存
+
+    Returns:
+        dict: stockCode -> 估值数据DataFrame
+    """
+    stock_codes = [index["stockCode"] for index in indices]
+    try:
+        fetches = [query_json(url_suffix="cn/index/fundamental", query_params=fundamental_query(stock_codes, start, end),
+                              refresh=refresh)
+                   for start, end in fetch_date_ranges(indices[0], start_datetime)]
+        return split_fundamental_batch(indices, fetches)
+    except Exception as e:
+        logging.warning(f"批量抓取估值数据 {stock_codes} 出错，改为逐个抓取: {e}")
+        return {}
+
+
+async def fetch_fundamental_batch_async(client, indices, start_datetime=None, refresh=False):
+    """fetch_fundamental_batch 的异步版本"""
+    stock_codes = [index["stockCode"] for index in indices]
+    try:
+        fetches = await asyncio.gather(*(
+            client.query_json("cn/index/fundamental", fundamental_query(stock_codes, start, end), refresh)
+            for start, end in fetch_date_ranges(indices[0], start_datetime)
+        ))
+        return split_fundamental_batch(indices, fetches)
+    except Exception as e:
+        logging.warning(f"批量抓取估值数据 {stock_codes} 出错，改为逐个抓取: {e}")
+        return {}
+
+
+def merge_index_frames(candlestick, fundamental):
+    """
+    合并K线与估值数据，并按日期排序
+
+    Args:
+        candlestick (pandas.DataFrame): K线数据
+        fundamental (pandas.DataFrame): 估值数据
 
+    Returns:
+        pandas.DataFrame: 合并后的DataFrame
+    """
     df = pd.merge(candlestick, fundamental, on='date', how='left')
     df = df.sort_values(by='date')
     df.reset_index(drop=True, inplace=True)
-    
+    return df
+
+
+def rename_index_columns(df):
+    df.rename(columns=FETCH_COLUMN_MAPPING, inplace=True)
+    return df
+
+
+def load_stored_dataframe(stockCode):
+    """
+    读取上次保存的指数数据，不存在或无法读取时返回None
+    """
+    try:
+        if index_data_path(DATA_DIR, stockCode).exists():
+            df = load_index_frame(stockCode, DATA_DIR)
+        else:
+            # 兼容迁移前的旧版 pickle
+            df = load_index_data(stockCode, DATA_DIR)["dataframe"]
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"读取 {stockCode} 历史数据失败，改为全量抓取: {e}")
+        return None
+    if df is None or len(df) <= INCREMENTAL_OVERLAP_ROWS:
+        return None
+    try:
+        # 兼容日期为字符串、带股票代码列的旧数据
+        return conform_index_frame(df, stockCode)
+    except ValueError as e:
+        logging.warning(f"{stockCode} 历史数据校验失败，改为全量抓取: {e}")
+        return None
+
+
+def incremental_start(stored_df):
+    """增量抓取的开始日期：已保存数据的倒数第 INCREMENTAL_OVERLAP_ROWS 个交易日"""
+    start_date = stored_df['日期'].iloc[-INCREMENTAL_OVERLAP_ROWS]
+    return SHANGHAI_TZ.localize(start_date.to_pydatetime())
+
+
+def splice_incremental(index, stored_df, candlestick, fundamental):
+    """
+    将增量抓取的数据拼接到已保存数据之后
+
+    用重叠的 INCREMENTAL_OVERLAP_ROWS 个交易日校验历史数据是否有缺口或被修订（如除权等调整）。
+
+    Args:
+        index (dict): 指数信息
+        stored_df (pandas.DataFrame): 上次保存的数据
+        candlestick (pandas.DataFrame): 从 incremental_start 开始抓取的K线数据
+        fundamental (pandas.DataFrame): 从 incremental_start 开始抓取的估值数据
+
+    Returns:
+        pandas.DataFrame: 拼接后的数据；检测到缺口或修订时返回None，由调用方回退到全量抓取
+    """
+    overlap = stored_df.iloc[-INCREMENTAL_OVERLAP_ROWS:]
+    if candlestick.empty or fundamental.empty:
+        logging.info(f"{index['stockCode']} 增量数据为空")
+        return None
+
+    fresh = conform_index_frame(rename_index_columns(merge_index_frames(candlestick, fundamental)), index["stockCode"])
+
+    # 新数据与已保存数据的原始字段必须一致，否则接口字段有变化
+    stored_columns = [col for col in stored_df.columns
+                      if col in fresh.columns or col in FETCH_COLUMN_MAPPING.values()]
+    missing_columns = set(fresh.columns).symmetric_difference(stored_columns)
+    if missing_columns:
+        logging.info(f"{index['stockCode']} 增量数据字段变化: {missing_columns}")
+        return None
+
+    # 重叠区间内的每个交易日都必须出现在新数据中
+    fresh_overlap = fresh[fresh['日期'] <= overlap['日期'].iloc[-1]]
+    if fresh_overlap['日期'].tolist() != overlap['日期'].tolist():
+        logging.info(f"{index['stockCode']} 增量数据与历史数据存在缺口")
+        return None
+
+    # 已有的值必须一致；历史中为空、后来补齐的估值数据不视为修订
+    for column in ['开盘价', '收盘价', '最高价', '最低价', '市盈率', '市净率', '股息率']:
+        if column not in fresh.columns:
+            continue
+        stored_values = overlap[column].to_numpy(dtype=float)
+        fresh_values = fresh_overlap[column].to_numpy(dtype=float)
+        known = ~np.isnan(stored_values)
+        if not np.allclose(stored_values[known], fresh_values[known], rtol=1e-9, atol=0, equal_nan=True):
+            logging.info(f"{index['stockCode']} 历史数据 {column} 被修订")
+            return None
+
+    # 重叠区间使用新抓取的数据，以便补齐之前缺失的估值；
+    # 历史部分保留已计算的指标，新数据的指标为空，由 calculate_indicators 增量计算
+    indicator_columns = [col for col in INDICATOR_COLUMNS + SIGNAL_COLUMNS if col in stored_df.columns]
+    history = stored_df.iloc[:-INCREMENTAL_OVERLAP_ROWS][list(fresh.columns) + indicator_columns]
+    df = pd.concat([history, fresh], ignore_index=True)
+    return df
+
+
+def spliced_indicator_rows(stockCode, stored_df):
+    """
+    增量抓取拼接后，开头指标仍然有效的行数
+
+    不超过上次保存时记录的 indicator_rows（上次计算可能失败），也不包括被新数据替换的重叠区间。
+    """
+    try:
+        stored_rows = load_index_meta(stockCode, DATA_DIR).get("indicator_rows", 0)
+    except Exception:
+        stored_rows = 0
+    return max(min(stored_rows, len(stored_df) - INCREMENTAL_OVERLAP_ROWS), 0)
+
+
+def carry_backtest_checkpoint(index):
+    """
+    将上次保存的回测检查点和回测日志带入本次抓取的指数信息，回测时只需推进新的交易日
+
+    检查点自带数据哈希，抓取到的历史数据有变化时回测阶段会自动从头回放。
+    """
+    try:
+        meta = load_index_meta(index["stockCode"], DATA_DIR)
+    except Exception:
+        return
+    if meta.get("backtest_checkpoint") is not None:
+        index["backtest_log"] = meta.get("backtest_log")
+        index["backtest_checkpoint"] = meta["backtest_checkpoint"]
+
+
+def fetch_index_incremental(index, stored_df, fundamental=None):
+    """
+    增量抓取指数数据，检测到缺口或修订时返回None
+
+    fundamental 为批量预先抓取的同一区间估值数据，为None时单独抓取
+    """
+    candlestick, fundamental = fetch_index_frames(index, incremental_start(stored_df), fundamental)
+    return splice_incremental(index, stored_df, candlestick, fundamental)
+
+
+def fetch_index_full(index, fundamental=None, refresh=False):
+    """
+    从发布日全量抓取指数数据
+
+    refresh 为 True 时不使用响应缓存，用于增量抓取检测到历史数据被修订后的回退
+    """
+    candlestick, fundamental = fetch_index_frames(index, fundamental=fundamental, refresh=refresh)
+    return build_full_frame(candlestick, fundamental)
+
+
+def build_full_frame(candlestick, fundamental):
+    df = merge_index_frames(candlestick, fundamental)
+
     # 应用过滤函数去除开头连续缺失的数据
     df = filter_consecutive_missing_data(df)
 
-    df.rename(columns={
-        'date': '日期',
-        'volume': '成交量',
-        'open': '开盘价',
-        'high': '最高价',
-        'low': '最低价',
-        'close': '收盘价',
-        'change': '涨跌幅',
-        'amount': '成交额',
-        'pe_ttm.mcw': '市盈率',
-        'pb.mcw': '市净率',
-        'dyr.mcw': '股息率',
-        'stockCode': '股票代码'
-    }, inplace=True)
-
-    index["dataframe"] = df
-
-    with open(DATA_DIR.joinpath(f"{index['stockCode']}.pickle"), "wb") as f:
-        pickle.dump(index, f)
+    return rename_index_columns(df)
+
+
+def fetch_index_dataframe(index, incremental=True, fundamental=None):
+    """
+    抓取单个指数的数据
+
+    Args:
+        index (dict): 指数信息
+        incremental (bool): 是否在已保存数据的基础上增量抓取
+        fundamental (pandas.DataFrame): 批量预先抓取的估值数据，区间与 fetch_start 一致；None 时单独抓取
 
+    同时在 index["indicator_rows"] 中记录开头指标仍然有效的行数，全量抓取时为0；
+    抓取成功后带入上次保存的回测检查点和回测日志。
+    """
+    df = None
+    # 强制全量抓取（--full-fetch）通常是因为怀疑已保存的历史数据有误，不使用缓存的旧响应
+    refresh = not incremental
+    index["indicator_rows"] = 0
+    if incremental:
+        stored_df = load_stored_dataframe(index["stockCode"])
+        if stored_df is None and index_data_path(DATA_DIR, index["stockCode"]).exists():
+            # 历史数据无法使用，预先抓取的估值数据是按其日期列的增量区间抓取的，不能用于全量抓取
+            fundamental = None
+        if stored_df is not None:
+            df = fetch_index_incremental(index, stored_df, fundamental)
+            # 预先抓取的估值数据只覆盖增量区间，回退到全量抓取时不能再用
+            fundamental = None
+            if df is None:
+                # 缓存中已封闭区间的响应是修订前的数据，全量抓取时重新请求
+                refresh = True
+                logging.info(f"{index['stockCode']} 回退到全量抓取，不使用响应缓存")
+            else:
+                index["indicator_rows"] = spliced_indicator_rows(index["stockCode"], stored_df)
+
+    if df is None:
+        df = fetch_index_full(index, fundamental, refresh)
+
+    # 抓取成功后再带入回测检查点，避免抓取失败重试时把回测日志写入错误日志
+    carry_backtest_checkpoint(index)
+    # 入库前转换为紧凑的列类型并校验
+    return conform_index_frame(df, index["stockCode"])
+
+
+async def fetch_index_dataframe_async(client, index, incremental=True, fundamental=None):
+    """fetch_index_dataframe 的异步版本"""
+
+    async def fetch_fundamental(start_datetime=None, refresh=False):
+        if fundamental is not None:
+            return fundamental
+        return await fetch_index_fundamental_async(client, index, start_datetime, refresh)
+
+    refresh = not incremental
+    index["indicator_rows"] = 0
+    if incremental:
+        stored_df = load_stored_dataframe(index["stockCode"])
+        if stored_df is None and index_data_path(DATA_DIR, index["stockCode"]).exists():
+            fundamental = None
+        if stored_df is not None:
+            start_datetime = incremental_start(stored_df)
+            candlestick, fresh_fundamental = await asyncio.gather(
+                fetch_index_candlestick_async(client, index, start_datetime),
+                fetch_fundamental(start_datetime),
+            )
+            df = splice_incremental(index, stored_df, candlestick, fresh_fundamental)
+            if df is not None:
+                index["indicator_rows"] = spliced_indicator_rows(index["stockCode"], stored_df)
+                carry_backtest_checkpoint(index)
+                return conform_index_frame(df, index["stockCode"])
+            fundamental = None
+            refresh = True
+            logging.info(f"{index['stockCode']} 回退到全量抓取，不使用响应缓存")
+
+    candlestick, fresh_fundamental = await asyncio.gather(
+        fetch_index_candlestick_async(client, index, refresh=refresh),
+        fetch_fundamental(refresh=refresh),
+    )
+    carry_backtest_checkpoint(index)
+    return conform_index_frame(build_full_frame(candlestick, fresh_fundamental), index["stockCode"])
+
+
+def fetch_index(index, incremental=True, fundamental=None):
+    index["dataframe"] = fetch_index_dataframe(index, incremental, fundamental)
+    save_index_info(index)
     return index
 
 
-def fetch_data():
-    cn_index = json.load(BASE_DIR.joinpath("cn_index_filtered.json").open(encoding="utf-8"))
+def fetch_start(index, incremental=True):
+    """
+    本次抓取的开始日期：增量抓取时为已保存数据的重叠区间起点，否则为None（从发布日开始）
+
+    只读取日期列，分组时不必读取和校验每个指数的全部历史数据；
+    历史数据校验失败时抓取会回退到全量抓取，并放弃按这里的日期预先抓取的估值数据。
+    """
+    if not incremental:
+        return None
+    stockCode = index["stockCode"]
+    if not index_data_path(DATA_DIR, stockCode).exists():
+        # 旧版 pickle 无法只读取一列
+        stored_df = load_stored_dataframe(stockCode)
+        return None if stored_df is None else incremental_start(stored_df)
+    try:
+        dates = load_index_frame(stockCode, DATA_DIR, columns=['日期'])
+    except Exception:
+        return None
+    if len(dates) <= INCREMENTAL_OVERLAP_ROWS:
+        return None
+    # 兼容日期为字符串的旧数据
+    return incremental_start(pd.DataFrame({'日期': pd.to_datetime(dates['日期'])}))
+
+
+def fundamental_batches(cn_index, incremental=True, batch_size=10):
+    """
+    将抓取日期区间完全相同的指数分组，每组不超过 batch_size 个
+
+    每日增量抓取时绝大多数指数的开始日期相同，可以合并为少量请求。
+
+    Returns:
+        list: (指数列表, 开始日期) 的列表；batch_size 小于2时为空
+    """
+    if batch_size < 2:
+        return []
+    groups = {}
+    for index in cn_index:
+        start_datetime = fetch_start(index, incremental)
+        key = tuple(fetch_date_ranges(index, start_datetime))
+        groups.setdefault(key, (start_datetime, []))[1].append(index)
+
+    batches = []
+    for start_datetime, indices in groups.values():
+        # 只有一个指数的组与逐个抓取相同，不必批量请求
+        if len(indices) < 2:
+            continue
+        for i in range(0, len(indices), batch_size):
+            batches.append((indices[i:i + batch_size], start_datetime))
+    return batches
+
+
+def prefetch_fundamentals(cn_index, incremental=True, batch_size=10, max_workers=12):
+    """
+    批量预先抓取估值数据
+
+    Returns:
+        dict: stockCode -> 估值数据DataFrame，未能批量抓取的指数不在其中
+    """
+    batches = fundamental_batches(cn_index, incremental, batch_size)
+    prefetched = {}
+    if not batches:
+        return prefetched
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # 全量抓取时不使用缓存的旧响应，与 fetch_index_dataframe 一致
+        for result in executor.map(lambda batch: fetch_fundamental_batch(*batch, refresh=not incremental), batches):
+            prefetched.update(result)
+    logging.info(f"批量抓取估值数据: {len(batches)} 次请求覆盖 {len(prefetched)}/{len(cn_index)} 个指数")
+    return prefetched
+
+
+def report_stragglers(indices):
+    """记录超过抓取截止时间仍未完成的指数"""
+    logging.error(f"超过抓取截止时间，{len(indices)} 个指数未完成抓取，将使用上次保存的数据: "
+                  f"{[index['stockCode'] for index in indices]}")
+
+
+def fetch_data(incremental=True, max_workers=12, batch_size=10):
+    cn_index, digests = plan_stage(load_records(CN_INDEX_FILE), "fetch")
     total_count = len(cn_index)
     completed_count = 0
+    prefetched = prefetch_fundamentals(cn_index, incremental, batch_size, max_workers)
 
-    # 使用线程池并发执行，最大并发数20
-    with ThreadPoolExecutor(max_workers=12) as executor:
+    def report(index, outcome):
+        nonlocal completed_count
+        success, value, seconds = outcome
+        completed_count += 1
+        record_stage("fetch", index, success, seconds, digests, value)
+
+        if success:
+            # 打印进度信息
+            logging.info(f"进度: {completed_count}/{total_count} ({completed_count/total_count*100:.1f}%) "
+                         f"抓取指数信息 {index['stockCode']} - {index['name']}")
+        else:
+            logging.error(f"处理 {index['stockCode']} 时出错: {value}")
+
+    # 使用线程池并发执行
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
         # 提交所有任务
         future_to_index = {
-            executor.submit(fetch_index, index): index
+            executor.submit(run_guarded, partial(fetch_index, incremental=incremental,
+                                                 fundamental=prefetched.pop(index["stockCode"], None)), index): index
             for index in cn_index
         }
 
-        # 处理完成的任务
-        for future in as_completed(future_to_index):
-            index = future_to_index[future]
-            try:
-                # 为每个任务设置30秒超时时间
-                future.result(timeout=30)
-                completed_count += 1
+        # 处理完成的任务；每个请求有连接和读取超时，整个阶段另有截止时间
+        try:
+            for future in as_completed(future_to_index, timeout=deadline_remaining()):
+                report(future_to_index[future], future.result())
+        except FutureTimeoutError:
+            stragglers = [future for future in future_to_index if not future.done()]
+            report_stragglers([future_to_index[future] for future in stragglers])
+            running = []
+            for future in stragglers:
+                if future.cancel():
+                    report(future_to_index[future], (False, "超过抓取截止时间，未开始抓取", None))
+                else:
+                    running.append(future)
+            # 正在抓取的指数不再发出新的请求，在途请求的读取超时也不超过截止时间，很快就会结束
+            for future in as_completed(running):
+                report(future_to_index[future], future.result())
 
-                # 打印进度信息
-                logging.info(f"进度: {completed_count}/{total_count} ({completed_count/total_count*100:.1f}%) "
-                             f"抓取指数信息 {index['stockCode']} - {index['name']}")
 
-            except Exception as e:
-                completed_count += 1
-                logging.error(f"处理 {index['stockCode']} 时出错: {e}")
+def load_index_info(stockCode, columns=None, tail=None):
+    return load_index_data(stockCode, DATA_DIR, columns, tail)
 
 
-def calculate_index():
-    cn_index = json.load(BASE_DIR.joinpath("cn_index_filtered.json").open(encoding="utf-8"))
-    total_count = len(cn_index)
-    completed_count = 0
-    for index in cn_index:
-        # 计算进度和时间信息
-        completed_count += 1
-        # 打印进度信息
-        logging.info(f"进度: {completed_count}/{total_count} ({completed_count / total_count * 100:.1f}%) "
-                     f"计算指数信息 {index['stockCode']} - {index['name']}")
+def save_index_info(index_info):
+    save_index_data(index_info, DATA_DIR)
 
-        try:
-            with open(DATA_DIR.joinpath(f"{index['stockCode']}.pickle"), "rb") as f:
-                index_info = pickle.load(f)
-
-            df = index_info["dataframe"]
-
-            # 计算移动平均线
-            ma_periods = [5, 10, 20, 30, 60, 120, 250]
-            for period in ma_periods:
-                df[f'{period}日均线'] = df['收盘价'].rolling(window=period).mean()
-
-            bb_period = 20
-            df['布林线中轨'] = df['收盘价'].rolling(window=bb_period).mean()
-            bb_std = df['收盘价'].rolling(window=bb_period).std()
-            df['布林线上轨'] = df['布林线中轨'] + 2 * bb_std
-            df['布林线下轨'] = df['布林线中轨'] - 2 * bb_std
-
-            # 计算收盘价在布林线中的位置
-            df['布林线位置'] = (df['收盘价'] - df['布林线下轨']) / (df['布林线上轨'] - df['布林线下轨'])
-
-            df['市盈率百分位'] = df['市盈率'].rolling(window=500, min_periods=1).apply(lambda x: x.rank(method='min', pct=True).iloc[-1])
-            df['市净率百分位'] = df['市净率'].rolling(window=500, min_periods=1).apply(lambda x: x.rank(method='min', pct=True).iloc[-1])
-            # 股息率需要反向处理，因为股息率越高表示估值越低，为了与市盈率和市净率保持一致，需要1-排名百分位
-            df['股息率收益率'] = df['股息率'].rolling(window=500, min_periods=1).apply(lambda x: 1 - x.rank(method='min', pct=True).iloc[-1])
-
-            # 估值百分位
-            df['估值百分位'] = (df['市盈率百分位'] + df['市净率百分位'] + df['股息率收益率']) / 3
-
-            # 将计算后的数据更新到index_info中
-            index_info["dataframe"] = df
-
-            # 保存更新后的数据
-            with open(DATA_DIR.joinpath(f"{index['stockCode']}.pickle"), "wb") as f:
-                pickle.dump(index_info, f)
-        except Exception as e:
-            logging.error(f"处理 {index['stockCode']} 时出错: {e}")
-
-
-def backtest_single_index(index_info):
-    df = index_info["dataframe"].copy()
-    # 确保日期列是datetime类型
-    df['日期'] = pd.to_datetime(df['日期'])
-
-    # 设置回测开始时间：2016年1月1日之后，并且至少是第250个交易日
-    start_date = datetime(2016, 1, 1)
-    if len(df) <= 250:
-        logging.info(f"  数据不足，跳过 {index_info['stockCode']}")
-        return [], []
-
-    # 找到2016年1月1日之后的数据
-    df_filtered = df[df['日期'] >= start_date]
-    if len(df_filtered) <= 250:
-        logging.info(f"  2016年后数据不足250个交易日，跳过 {index_info['stockCode']}")
-        return [], []
-
-    # 从第250个交易日开始回测
-    df_test = df_filtered.iloc[250:].reset_index(drop=True)
-
-    if len(df_test) == 0:
-        logging.info(f"  回测数据为空，跳过 {index_info['stockCode']}")
-        return [], []
-
-    # 初始化5个份额的策略参数
-    strategies = [
-        {'buy_threshold': 0.10, 'sell_threshold': 0.40, 'name': '10-40估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.10, 'sell_threshold': 0.50, 'name': '10-50估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.15, 'sell_threshold': 0.45, 'name': '15-45估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.15, 'sell_threshold': 0.55, 'name': '15-55估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.20, 'sell_threshold': 0.50, 'name': '20-50估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.20, 'sell_threshold': 0.60, 'name': '20-60估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.25, 'sell_threshold': 0.55, 'name': '25-55估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.25, 'sell_threshold': 0.65, 'name': '25-65估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.30, 'sell_threshold': 0.60, 'name': '30-60估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.30, 'sell_threshold': 0.70, 'name': '30-70估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.35, 'sell_threshold': 0.65, 'name': '35-65估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.35, 'sell_threshold': 0.75, 'name': '35-75估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.40, 'sell_threshold': 0.70, 'name': '40-70估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.40, 'sell_threshold': 0.80, 'name': '40-80估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.45, 'sell_threshold': 0.75, 'name': '45-75估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.45, 'sell_threshold': 0.85, 'name': '45-85估值线', "mode": "fundamental"},
-        # {'buy_threshold': 0.50, 'sell_threshold': 0.80, 'name': '50-80估值线', "mode": "fundamental"},
-        # {'buy_threshold': 0.50, 'sell_threshold': 0.90, 'name': '50-90估值线', "mode": "fundamental"},
-        # {'buy_threshold': 0.55, 'sell_threshold': 0.85, 'name': '55-85估值线', "mode": "fundamental"},
-        # {'buy_threshold': 0.55, 'sell_threshold': 0.95, 'name': '55-95估值线', "mode": "fundamental"},
-
-        {'buy_threshold': 0.10, 'sell_threshold': 0.40, 'name': '10-40布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.10, 'sell_threshold': 0.50, 'name': '10-50布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.15, 'sell_threshold': 0.45, 'name': '15-45布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.15, 'sell_threshold': 0.55, 'name': '15-55布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.20, 'sell_threshold': 0.50, 'name': '20-50布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.20, 'sell_threshold': 0.60, 'name': '20-60布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.25, 'sell_threshold': 0.55, 'name': '25-55布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.25, 'sell_threshold': 0.65, 'name': '25-65布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.30, 'sell_threshold': 0.60, 'name': '30-60布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.30, 'sell_threshold': 0.70, 'name': '30-70布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.35, 'sell_threshold': 0.65, 'name': '35-65布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.35, 'sell_threshold': 0.75, 'name': '35-75布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.40, 'sell_threshold': 0.70, 'name': '40-70布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.40, 'sell_threshold': 0.80, 'name': '40-80布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.45, 'sell_threshold': 0.75, 'name': '45-75布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.45, 'sell_threshold': 0.85, 'name': '45-85布林线', "mode": "bollinger"},
-        # {'buy_threshold': 0.50, 'sell_threshold': 0.80, 'name': '50-80布林线', "mode": "bollinger"},
-        # {'buy_threshold': 0.50, 'sell_threshold': 0.90, 'name': '50-90布林线', "mode": "bollinger"},
-        # {'buy_threshold': 0.55, 'sell_threshold': 0.85, 'name': '55-85布林线', "mode": "bollinger"},
-        # {'buy_threshold': 0.55, 'sell_threshold': 0.95, 'name': '55-95布林线', "mode": "bollinger"},
-    ]
-
-    # 为每个策略初始化状态
-    for strategy in strategies:
-        strategy['position'] = False  # 是否持仓
-        strategy['position_date'] = None  # 持仓开始日期
-        strategy['buy_price'] = 0  # 买入价格
-        strategy['capital'] = 100000  # 每份资金10万元
-        strategy['shares'] = 0  # 持有份额
-        strategy['total_holding_days'] = 0  # 总持仓天数
-        strategy['total_return'] = 0  # 累计收益
-        strategy['date_start'] = None
-        strategy['date_end'] = None
-
-
-    # 添加前一天的估值百分位和布林线位置用于判断上穿
-    df_test['prev_估值百分位'] = df_test['估值百分位'].shift(1)
-    df_test['prev_布林线位置'] = df_test['布林线位置'].shift(1)
-
-    # 添加下一天的开盘价用于交易执行
-    df_test['next_开盘价'] = df_test['开盘价'].shift(-1)
-
-    # 初始化日志列表
-    log = []
-    stat = []
-    # 开始回测
-    for i, row in df_test.iterrows():
-        if pd.isna(row['prev_估值百分位']) or pd.isna(row['next_开盘价']):
-            continue
-        date = row['日期']
-        next_open_price = row['next_开盘价']  # 下一日开盘价用于交易
-        pe_percentile = row['估值百分位']
-        prev_pe_percentile = row['prev_估值百分位']  # 前一日估值百分位
-        bollinger_position = row['布林线位置']
-        prev_bollinger_position = row['prev_布林线位置']
-
-        # 遍历每个策略
-        for strategy in strategies:
-            if strategy['date_start'] is None:
-                strategy['date_start'] = date
-            strategy['date_end'] = date
-
-            # 根据策略模式选择不同的买卖信号判断方法
-            if strategy['mode'] == "fundamental":
-                # 模式1：使用估值百分位作为买卖信号
-                buy_signal = (not strategy['position']) and (prev_pe_percentile < strategy['buy_threshold'] <= pe_percentile)
-                sell_signal = strategy['position'] and strategy['capital'] > 0 and (prev_pe_percentile < strategy['sell_threshold'] <= pe_percentile)
-            elif strategy['mode'] == "bollinger":
-                # 模式2：使用布林线位置作为买卖信号
-                buy_signal = (not strategy['position']) and (prev_bollinger_position < strategy['buy_threshold'] <= bollinger_position)
-                sell_signal = strategy['position'] and strategy['capital'] > 0 and (prev_bollinger_position < strategy['sell_threshold'] <= bollinger_position)
-
-            # 买入条件
-            if buy_signal:
-                strategy['position'] = True
-                strategy['position_date'] = date
-                strategy['buy_price'] = next_open_price
-                strategy['shares'] = strategy['capital'] / next_open_price
-                # 添加买入日志
-                buy_log = {
-                    'date': date.strftime('%Y-%m-%d'),
-                    'strategy_name': strategy['name'],
-                    'direction': 'buy',
-                    'amount': strategy['capital'],
-                    'price': next_open_price,
-                    'cash': strategy['capital']
-                }
-                log.append(buy_log)
-                # logging.info(f"买入 - 日期:{buy_log['日期']}, 策略:{buy_log['策略名称']}, 价格:{buy_log['价格']:.4f}")
-
-            # 检查是否需要卖出（止盈或止损）
-            elif strategy['position'] and strategy['capital'] > 0:
-                # 计算当前收益率
-                current_return = (next_open_price - strategy['buy_price']) / strategy['buy_price'] if strategy['buy_price'] != 0 else 0
-
-                # 止损条件：下跌超过15%
-                stop_loss = current_return <= -0.15
-
-                # 止盈条件：根据策略模式决定
-                if strategy['mode'] == "fundamental":
-                    # 模式1：估值百分位上穿卖出阈值
-                    take_profit = (prev_pe_percentile < strategy['sell_threshold'] <= pe_percentile)
-                elif strategy['mode'] == "bollinger":
-                    # 模式2：布林线位置上穿卖出阈值
-                    take_profit = (prev_bollinger_position < strategy['sell_threshold'] <= bollinger_position)
-
-                # 如果触发止损或止盈
-                if stop_loss or take_profit:
-                    # 计算持有天数
-                    holding_days = (date - strategy['position_date']).days
-
-                    # 计算卖出后的资金
-                    sell_capital = strategy['shares'] * next_open_price
-
-                    # 累计总持仓天数
-                    strategy['total_holding_days'] += holding_days
-
-                    sell_type = "stop_loss" if stop_loss else "take_profit"
-                    # 添加卖出日志
-                    sell_log = {
-                        'date': date.strftime('%Y-%m-%d'),
-                        'strategy_name': strategy['name'],
-                        'direction': sell_type + '_sell',
-                        'amount': sell_capital,
-                        'price': next_open_price,
-                        'cash': sell_capital
-                    }
-                    log.append(sell_log)
-                    # logging.info(f"{sell_type}卖出 - 日期:{sell_log['日期']}, 策略:{sell_log['策略名称']}, 价格:{sell_log['价格']:.4f}, 收益率:{trade_return*100:.2f}%")
-
-                    # 重置状态
-                    strategy['position'] = False
-                    strategy['position_date'] = None
-                    strategy['buy_price'] = 0
-                    strategy['shares'] = 0
-                    strategy['capital'] = sell_capital
-
-    # 处理仍持仓的策略（已买入但从未卖出的情况）
-    for strategy in strategies:
-        if strategy['position']:
-            # 使用最后一日的下一日开盘价强制卖出
-            last_row = df_test.iloc[-1]
-            sell_price = last_row['next_开盘价']  # 使用下一日开盘价作为卖出价格
-
-            # 如果没有下一日开盘价，则使用当日收盘价
-            if pd.isna(sell_price):
-                sell_price = last_row['收盘价']
-
-            # 计算卖出后的资金
-            sell_capital = strategy['shares'] * sell_price
-
-            # 计算持有天数
-            holding_days = (last_row['日期'] - strategy['position_date']).days
-
-            strategy['total_holding_days'] += holding_days
-
-            # 添加强制卖出日志
-            force_sell_log = {
-                'date': last_row['日期'].strftime('%Y-%m-%d'),
-                'strategy_name': strategy['name'],
-                'direction': 'force_sell',
-                'amount': sell_capital,
-                'price': sell_price,
-                'cash': sell_capital
-            }
-            log.append(force_sell_log)
-
-            # 重置状态
-            strategy['position'] = False
-            strategy['position_date'] = None
-            strategy['buy_price'] = 0
-            strategy['shares'] = 0
-            strategy['capital'] = sell_capital
-
-    # 计算每个策略的最终年化收益率
-    for strategy in strategies:
-        # 计算总收益：最终资本减去本金（100000）
-        total_return = strategy['capital'] - 100000
-
-        # 总收益率 = 总收益 / 本金
-        total_rate = total_return / 100000
-
-
-
-        if (strategy['date_start'] is not None) and (strategy['date_end'] is not None) :
-            strategy_duration = (strategy['date_end'] - strategy['date_start']).days
-        else:
-            strategy_duration = 0
-        # 综策略持续时间计算收益率。
-        if strategy_duration > 0:
-            strategy_duration_rate = total_rate/(strategy_duration/365)
-        else:
-            strategy_duration_rate = 0
 
+def compute_indicators(df):
+    """
+    计算均线、布林线和估值百分位
 
-        # 按持仓时间计算收益率
-        annual_return = 0
-        if strategy['total_holding_days'] > 0:
+    Args:
+        df (pandas.DataFrame): 指数数据
 
-            # 年化收益率 = (1 + 总收益率) ^ (365 / 持仓天数) - 1
-            base = 1 + total_rate
-            if base > 0:  # 只有当base为正数时才计算幂
-                annual_return = np.power(base, 365 / strategy['total_holding_days']) - 1
-            else:
-                annual_return = 0  # 如果base为负数或零，则年化收益设为0
-
-        # 策略持仓率
-        position_rate = strategy['total_holding_days'] / strategy_duration
-
-        strategy_stat = {
-            'mode':strategy['mode'],
-            'strategy_name': strategy['name'],
-            'buy_threshold': strategy['buy_threshold'],
-            'sell_threshold': strategy['sell_threshold'],
-            'holding_days': strategy['total_holding_days'],
-            'capital': strategy['capital'],
-            'total_return': total_return,
-            'total_rate':total_rate,
-            'annual_return': annual_return,
-            'strategy_duration': strategy_duration,
-            'strategy_duration_rate':strategy_duration_rate,
-            'position_rate':position_rate
-        }
+    Returns:
+        dict: 列名 -> 与 df 等长的指标序列，按写入 DataFrame 的列顺序排列
+    """
+    close = df['收盘价']
+    indicators = {}
 
-        stat.append(strategy_stat)
+    # 计算移动平均线，均线只用于展示，以 float32 保存
+    ma_periods = [5, 10, 20, 30, 60, 120, 250]
+    for period in ma_periods:
+        indicators[f'{period}日均线'] = close.rolling(window=period).mean().astype(INDICATOR_DTYPE)
 
-    # 按年化收益从高到低排序
-    stat.sort(key=lambda x: x['strategy_duration_rate'], reverse=True)
+    bb_period = 20
+    bb_middle = close.rolling(window=bb_period).mean()
+    bb_std = close.rolling(window=bb_period).std()
+    bb_upper = bb_middle + 2 * bb_std
+    bb_lower = bb_middle - 2 * bb_std
+    indicators['布林线中轨'] = bb_middle.astype(INDICATOR_DTYPE)
+    indicators['布林线上轨'] = bb_upper.astype(INDICATOR_DTYPE)
+    indicators['布林线下轨'] = bb_lower.astype(INDICATOR_DTYPE)
 
-    return log, stat
+    # 计算收盘价在布林线中的位置，使用 float64 的上下轨，回测信号不受展示精度影响
+    indicators['布林线位置'] = (close - bb_lower) / (bb_upper - bb_lower)
 
+    indicators['市盈率百分位'] = rolling_percentile_rank(df['市盈率'], window=INDICATOR_WINDOW, min_periods=1)
+    indicators['市净率百分位'] = rolling_percentile_rank(df['市净率'], window=INDICATOR_WINDOW, min_periods=1)
+    # 股息率需要反向处理，因为股息率越高表示估值越低，为了与市盈率和市净率保持一致，需要1-排名百分位
+    indicators['股息率收益率'] = 1 - rolling_percentile_rank(df['股息率'], window=INDICATOR_WINDOW, min_periods=1)
 
-def backtest_index():
-    cn_index = json.load(BASE_DIR.joinpath("cn_index_filtered.json").open(encoding="utf-8"))
-    total_count = len(cn_index)
-    completed_count = 0
-    for index in cn_index:
+    # 估值百分位
+    indicators['估值百分位'] = (indicators['市盈率百分位'] + indicators['市净率百分位'] + indicators['股息率收益率']) / 3
+    return indicators
 
-        # 计算进度和时间信息
-        completed_count += 1
-        # 打印进度信息
-        logging.info(f"进度: {completed_count}/{total_count} ({completed_count / total_count * 100:.1f}%) "
-                     f"回测指数信息 {index['stockCode']} - {index['name']}")
 
-        try:
-            with open(DATA_DIR.joinpath(f"{index['stockCode']}.pickle"), "rb") as f:
-                index_info = pickle.load(f)
-            backtest_log, backtest_stat = backtest_single_index(index_info)
-            index_info["backtest_log"] = backtest_log
-            index_info["backtest_stat"] = backtest_stat
-
-            # 保存更新后的数据
-            with open(DATA_DIR.joinpath(f"{index['stockCode']}.pickle"), "wb") as f:
-                pickle.dump(index_info, f)
-        except Exception as e:
-            logging.error(f"回测处理 {index['stockCode']} 时出错: {e}")
-
-
-
-def export_to_js():
-    # 定义中文列名到英文列名的映射
-    column_mapping = {
-        '日期': 'date',
-        '开盘价': 'open',
-        '收盘价': 'close',
-        '最低价': 'low',
-        '最高价': 'high',
-        '成交量': 'volume',
-        '涨跌幅': 'change',
-        '成交额': 'amount',
-        '市盈率': 'pe_ttm',
-        '市净率': 'pb',
-        '股息率': 'dyr',
-        '股票代码': 'stockCode',
-        '5日均线': 'ma5',
-        '10日均线': 'ma10',
-        '20日均线': 'ma20',
-        '30日均线': 'ma30',
-        '60日均线': 'ma60',
-        '120日均线': 'ma120',
-        '250日均线': 'ma250',
-        '布林线中轨': 'bb_middle',
-        '布林线上轨': 'bb_upper',
-        '布林线下轨': 'bb_lower',
-        '布林线位置': 'bb_position',
-        '市盈率百分位': 'pe_percentile',
-        '市净率百分位': 'pb_percentile',
-        '股息率收益率': 'dyr_percentile',
-        '估值百分位': 'valuation_percentile'
-    }
+def verify_indicators(stockCode, df):
+    """
+    与全量计算的结果比较，float64 列的相对误差不超过1e-9，float32 列不超过1e-6
 
-    cn_index = json.load(BASE_DIR.joinpath("cn_index_filtered.json").open(encoding="utf-8"))
+    Returns:
+        bool: 是否一致
+    """
+    consistent = True
+    for column, expected in compute_indicators(df).items():
+        actual = df[column].to_numpy(dtype=float)
+        expected = expected.to_numpy(dtype=float)
+        rtol = 1e-6 if df[column].dtype == INDICATOR_DTYPE else 1e-9
+        mismatch = ~np.isclose(actual, expected, rtol=rtol, atol=0, equal_nan=True)
+        if mismatch.any():
+            logging.error(f"{stockCode} 增量计算的 {column} 与全量计算不一致: {mismatch.sum()} 行，"
+                          f"首个不一致的行 {np.flatnonzero(mismatch)[0]}")
+            consistent = False
+    return consistent
+
+
+def calculate_indicators(index_info, verify=False):
+    """
+    计算指标，开头 indicator_rows 行的指标有效时只重算之后的行
 
-    # index_dir = data_path.joinpath("index_info")
-    # output_path = output_path.joinpath("index")
-    OUTPUT_INDEX_DIR = OUTPUT_DIR.joinpath("index")
-    if not OUTPUT_INDEX_DIR.exists():
-        OUTPUT_INDEX_DIR.mkdir()
+    滚动窗口最长为 INDICATOR_WINDOW，从第一个需要重算的行之前 INDICATOR_WINDOW-1 行开始计算，
+    得到的新行与全量计算一致，再拼接到已有的指标之后。
 
-    total_count = len(cn_index)
-    completed_count = 0
-    for index in cn_index:
-        completed_count += 1
-        logging.info(f"进度: {completed_count}/{total_count} ({completed_count / total_count * 100:.1f}%) "
-                     f"导出到js指数信息 {index['stockCode']} - {index['name']}")
-        with open(DATA_DIR.joinpath(f"{index['stockCode']}.pickle"), "rb") as f:
-            index_info = pickle.load(f)
+    Args:
+        index_info (dict): 指数信息
+        verify (bool): 增量计算后再全量计算一次并比较，不一致时记录错误并使用全量计算的结果
+    """
+    stockCode = index_info["stockCode"]
+    # 抓取失败时使用的上次数据可能是旧格式，先转换列类型
+    df = conform_index_frame(index_info["dataframe"], stockCode)
+
+    valid_rows = min(index_info.get("indicator_rows", 0), len(df))
+    if not all(column in df.columns for column in INDICATOR_COLUMNS + SIGNAL_COLUMNS):
+        valid_rows = 0
+
+    if valid_rows == 0:
+        df = df.assign(**compute_indicators(df))
+    elif valid_rows < len(df):
+        start = max(valid_rows - (INDICATOR_WINDOW - 1), 0)
+        tail = compute_indicators(df.iloc[start:])
+        df = df.copy()
+        for column, values in tail.items():
+            df.iloc[valid_rows:, df.columns.get_loc(column)] = values.to_numpy()[valid_rows - start:]
+        logging.debug(f"{stockCode} 增量计算 {len(df) - valid_rows} 行指标")
+
+    if verify and valid_rows > 0 and not verify_indicators(stockCode, df):
+        df = df.assign(**compute_indicators(df))
+
+    # 将计算后的数据更新到index_info中
+    index_info["dataframe"] = df
+    index_info["indicator_rows"] = len(df)
+    return index_info
+
+
+def compare_full_backtest(index_info, backtest_log, backtest_stat):
+    """
+    从头回放一次并与从检查点继续的结果比较
+
+    Returns:
+        tuple: (是否一致, 从头回放的日志, 从头回放的统计结果)
+    """
+    full_log, full_stat = backtest_single_index(index_info)
+    consistent = full_log == backtest_log and full_stat == backtest_stat
+    if not consistent:
+        logging.error(f"{index_info['stockCode']} 从检查点继续的回测结果与从头回放不一致")
+    return consistent, full_log, full_stat
 
-        # 创建一个副本以避免修改原始数据
-        df = index_info["dataframe"].copy()
 
-        # 重命名列名为英文
-        df.rename(columns=column_mapping, inplace=True)
+def run_backtest(index_info, full_backtest=False, verify=False):
+    """
+    回测单个指数，默认从上次保存的检查点继续，只推进新的交易日
 
-        # 导出为JSON格式
-        index_info["dataframe"] = json.loads(df.to_json(orient="records", indent=4))
-        with open(OUTPUT_INDEX_DIR.joinpath(f"{index['stockCode']}.json"), "w", encoding="utf-8") as f:
-            json.dump(index_info, f, ensure_ascii=False, indent=4)
-    logging.info("所有指数导出完成")
+    Args:
+        index_info (dict): 指数信息
+        full_backtest (bool): 忽略检查点，从头回放
+        verify (bool): 从检查点继续后再从头回放一次并比较，不一致时记录错误并使用从头回放的结果
+    """
+    checkpoint = None if full_backtest else index_info.get("backtest_checkpoint")
+    backtest_log, backtest_stat, checkpoint = resume_backtest(index_info, checkpoint, index_info.get("backtest_log"))
+    if verify and not full_backtest:
+        consistent, full_log, full_stat = compare_full_backtest(index_info, backtest_log, backtest_stat)
+        if not consistent:
+            backtest_log, backtest_stat = full_log, full_stat
+    index_info["backtest_log"] = backtest_log
+    index_info["backtest_stat"] = backtest_stat
+    index_info["backtest_checkpoint"] = checkpoint
 
+    # 配置了 backtest_sweep 时对买卖阈值做参数扫描，结果供首页汇总
+    sweep_config = config.get("backtest_sweep")
+    if sweep_config:
+        index_info["backtest_sweep"] = sweep_single_index(index_info, **sweep_config)
+    else:
+        index_info.pop("backtest_sweep", None)
+    return index_info
 
-def export_home():
-    cn_index = json.load(BASE_DIR.joinpath("cn_index_filtered.json").open(encoding="utf-8"))
 
-    OUTPUT_INDEX_DIR = OUTPUT_DIR.joinpath("index")
+def write_index_json(index_info):
+    # 浅拷贝，导出时删除的字段不影响内存中的数据
+    export_info = dict(index_info)
 
-    result = []
+    # 参数扫描结果只用于首页汇总，增量计算的行数和回测检查点只在内部使用，都不导出到单个指数页面
+    export_info.pop("backtest_sweep", None)
+    export_info.pop("indicator_rows", None)
+    export_info.pop("backtest_checkpoint", None)
 
-    for index in cn_index:
-        with open(DATA_DIR.joinpath(f"{index['stockCode']}.pickle"), "rb") as f:
-            index_info = pickle.load(f)
+    # 重命名列名为英文，rename 返回新的DataFrame，不修改原始数据
+    df = index_info["dataframe"].rename(columns=EXPORT_COLUMN_MAPPING)
+
+    write_index_files(export_info, df, OUTPUT_INDEX_DIR)
+
+
+def home_entry(index_info):
+    df = index_info["dataframe"]
+    entry = df.to_dict('records')[-1]
+    # 首页按字符串显示日期和链接股票代码
+    entry["日期"] = pd.Timestamp(entry["日期"]).strftime("%Y-%m-%d")
+    entry["股票代码"] = index_info["stockCode"]
+
+    entry["tracking_fund_count"] = len(index_info["tracking_fund"])
+    entry["name"] = index_info["name"]
+
+    backtest_stat = index_info["backtest_stat"]
+
+    # 分类策略状态
+    fundamental_stat  = [stat for stat in backtest_stat if stat["mode"] == "fundamental"]
+    bollinger_stat = [stat for stat in backtest_stat if stat["mode"] == "bollinger"]
+
+
+    # 求2种估值的年化收益中位数，去掉持仓小于15%的。
+    fundamental_rate = [stat["strategy_duration_rate"] for stat in fundamental_stat if stat["position_rate"] > 0.15]
+    bollinger_rate = [stat["strategy_duration_rate"] for stat in bollinger_stat if stat["position_rate"] > 0.15]
+    fundamental_rate_median = mean_with_default(fundamental_rate)
+    bollinger_rate_median = mean_with_default(bollinger_rate)
+
+    # 过滤出收益大于中位数的策略
+    high_fundamental_stat = [stat for stat in fundamental_stat if stat["strategy_duration_rate"] > fundamental_rate_median]
+    high_bollinger_stat = [stat for stat in bollinger_stat if stat["strategy_duration_rate"] > bollinger_rate_median]
+
+    # 求这些策略的平均买入、卖出价格
+    high_fundamental_buy_price = mean_with_default([stat["buy_threshold"] for stat in high_fundamental_stat])
+    high_fundamental_sell_price = mean_with_default([stat["sell_threshold"] for stat in high_fundamental_stat])
+    high_bollinger_buy_price = mean_with_default([stat["buy_threshold"] for stat in high_bollinger_stat])
+    high_bollinger_sell_price = mean_with_default([stat["sell_threshold"] for stat in high_bollinger_stat])
 
-        df = index_info["dataframe"]
-        entry = df.to_dict('records')[-1]
+    # 平均收益率
+    high_fundamental_rate_mean = mean_with_default([stat["strategy_duration_rate"] for stat in high_fundamental_stat])
+    high_bollinger_rate_mean = mean_with_default([stat["strategy_duration_rate"] for stat in high_bollinger_stat])
 
-        entry["tracking_fund_count"] = len(index_info["tracking_fund"])
-        entry["name"] = index_info["name"]
 
-        backtest_stat = index_info["backtest_stat"]
+    entry["fundamental_rate"] = high_fundamental_rate_mean
+    entry["bollinger_rate"] = high_bollinger_rate_mean
+    entry["fundamental_buy_price"] = high_fundamental_buy_price
+    entry["fundamental_sell_price"] = high_fundamental_sell_price
+    entry["bollinger_buy_price"] = high_bollinger_buy_price
+    entry["bollinger_sell_price"] = high_bollinger_sell_price
 
-        # 分类策略状态
-        fundamental_stat  = [stat for stat in backtest_stat if stat["mode"] == "fundamental"]
-        bollinger_stat = [stat for stat in backtest_stat if stat["mode"] == "bollinger"]
+    if index_info.get("backtest_sweep"):
+        entry.update(aggregate_sweep(index_info["backtest_sweep"]))
 
+    return entry
 
-        # 求2种估值的年化收益中位数，去掉持仓小于15%的。
-        fundamental_rate = [stat["strategy_duration_rate"] for stat in fundamental_stat if stat["position_rate"] > 0.15]
-        bollinger_rate = [stat["strategy_duration_rate"] for stat in bollinger_stat if stat["position_rate"] > 0.15]
-        fundamental_rate_median = mean_with_default(fundamental_rate)
-        bollinger_rate_median = mean_with_default(bollinger_rate)
 
-        # 过滤出收益大于中位数的策略
-        high_fundamental_stat = [stat for stat in fundamental_stat if stat["strategy_duration_rate"] > fundamental_rate_median]
-        high_bollinger_stat = [stat for stat in bollinger_stat if stat["strategy_duration_rate"] > bollinger_rate_median]
+# 导出代码版本：除 data_exporter 外，write_index_json 和 home_entry 也决定导出的内容，修改后所有指数重新导出
+EXPORT_CODE_VERSION = code_version(write_index_json, home_entry)
 
-        # 求这些策略的平均买入、卖出价格
-        high_fundamental_buy_price = mean_with_default([stat["buy_threshold"] for stat in high_fundamental_stat])
-        high_fundamental_sell_price = mean_with_default([stat["sell_threshold"] for stat in high_fundamental_stat])
-        high_bollinger_buy_price = mean_with_default([stat["buy_threshold"] for stat in high_bollinger_stat])
-        high_bollinger_sell_price = mean_with_default([stat["sell_threshold"] for stat in high_bollinger_stat])
 
-        # 平均收益率
-        high_fundamental_rate_mean = mean_with_default([stat["strategy_duration_rate"] for stat in high_fundamental_stat])
-        high_bollinger_rate_mean = mean_with_default([stat["strategy_duration_rate"] for stat in high_bollinger_stat])
+def calculate_single_index(index, verify=False):
+    # 保存更新后的数据
+    save_index_info(calculate_indicators(load_index_info(index["stockCode"]), verify))
 
 
-        entry["fundamental_rate"] = high_fundamental_rate_mean
-        entry["bollinger_rate"] = high_bollinger_rate_mean
-        entry["fundamental_buy_price"] = high_fundamental_buy_price
-        entry["fundamental_sell_price"] = high_fundamental_sell_price
-        entry["bollinger_buy_price"] = high_bollinger_buy_price
-        entry["bollinger_sell_price"] = high_bollinger_sell_price
+def backtest_single_index_file(index, full_backtest=False, verify=False):
+    save_index_info(run_backtest(load_index_info(index["stockCode"]), full_backtest, verify))
+
+
+def use_export_digests(digests):
+    global previous_export_digests
+    previous_export_digests = digests
+
+
+def export_if_changed(stockCode, load):
+    """
+    已保存的数据和导出代码都未变化、且输出文件齐全时跳过导出
+
+    Args:
+        stockCode (str): 指数代码
+        load: 返回指数信息的函数，只在需要导出时调用
+
+    Returns:
+        str: 本次的导出哈希
+    """
+    digest = export_digest(stockCode, DATA_DIR, EXPORT_COLUMN_MAPPING, EXPORT_CODE_VERSION)
+    if previous_export_digests.get(stockCode) == digest and index_outputs_exist(stockCode, OUTPUT_INDEX_DIR):
+        logging.debug(f"{stockCode} 数据未变化，跳过导出")
+        return digest
+    write_index_json(load())
+    return digest
+
+
+def export_single_index(index):
+    stockCode = index["stockCode"]
+    return export_if_changed(stockCode, lambda: load_index_info(stockCode))
+
+
+def build_home_entry(index):
+    # 首页只需要最后一行数据
+    return home_entry(load_index_info(index["stockCode"], tail=1))
+
+
+def skipped_export(index):
+    # 运行清单中已完成导出的指数，输出文件已是最新，只需计算导出哈希
+    return export_digest(index["stockCode"], DATA_DIR, EXPORT_COLUMN_MAPPING, EXPORT_CODE_VERSION)
+
+
+def skipped_process(index):
+    # 融合模式下已完成的指数，首页条目从保存的数据生成
+    return build_home_entry(index), skipped_export(index), None
+
+
+def fetch_failure(result):
+    # 融合模式下抓取失败的指数仍然生成首页条目和导出，但在运行清单中记录为失败，--retry-failed 时重新执行
+    return result[2]
+
+
+def process_index(index, incremental=True, verify=False, full_backtest=False, verify_backtest=False,
+                  fundamental=None):
+    """
+    在内存中完成单个指数的抓取、计算、回测和导出，只保存一次数据
+
+    抓取失败时与分阶段模式一致，使用上次保存的数据继续计算和导出，并返回抓取的错误信息。
+
+    Args:
+        index (dict): 指数信息
+        incremental (bool): 是否增量抓取
+        verify (bool): 是否将增量计算的指标与全量计算比较
+        full_backtest (bool): 是否忽略回测检查点，从头回放
+        verify_backtest (bool): 是否将从检查点继续的回测与从头回放比较
+        fundamental (pandas.DataFrame): 主进程批量预先抓取的估值数据，None 时单独抓取
+
+    Returns:
+        tuple: (首页条目, 导出哈希, 抓取的错误信息)，抓取成功时错误信息为None
+    """
+    fetch_error = None
+    try:
+        index["dataframe"] = fetch_index_dataframe(index, incremental, fundamental)
+        index_info = index
+    except DeadlineExceeded:
+        logging.error(f"超过抓取截止时间，{index['stockCode']} 未完成抓取，使用上次保存的数据")
+        fetch_error = "超过抓取截止时间，未完成抓取"
+        index_info = load_index_info(index["stockCode"])
+    except Exception as e:
+        logging.error(f"抓取 {index['stockCode']} 时出错，使用上次保存的数据: {e}")
+        fetch_error = f"抓取失败: {e}"
+        index_info = load_index_info(index["stockCode"])
+
+    index_info = run_backtest(calculate_indicators(index_info, verify), full_backtest, verify_backtest)
+    save_index_info(index_info)
+    digest = export_if_changed(index_info["stockCode"], lambda: index_info)
+    return home_entry(index_info), digest, fetch_error
+
+
+def run_guarded(func, index, kwargs=None):
+    """
+    执行单个指数的处理函数，异常在工作进程内捕获，避免一个指数失败影响其它指数
+
+    Args:
+        func: 处理单个指数的函数
+        index (dict): 指数信息
+        kwargs (dict): 只属于这个指数的其它参数
+
+    Returns:
+        tuple: (是否成功, 返回值或错误信息, 耗时秒数)
+    """
+    start = time.perf_counter()
+    try:
+        return True, func(index, **(kwargs or {})), time.perf_counter() - start
+    except Exception as e:
+        return False, str(e), time.perf_counter() - start
+
 
+def use_run_manifest(manifest):
+    global run_manifest
+    run_manifest = manifest
 
-        result.append(entry)
+
+def stored_digest(stockCode):
+    """已保存数据的哈希，还没有数据时为None"""
+    try:
+        return index_data_digest(stockCode, DATA_DIR)
+    except FileNotFoundError:
+        return None
+
+
+def plan_stage(cn_index, stage):
+    """
+    按运行清单筛选一个阶段需要执行的指数
+
+    Args:
+        cn_index (list): 指数列表
+        stage (str): 阶段名称，为None时不使用运行清单
+
+    Returns:
+        tuple: (需要执行的指数列表, stockCode -> 执行前已保存数据的哈希)
+    """
+    if run_manifest is None or stage is None:
+        return cn_index, {}
+    digests = {index["stockCode"]: stored_digest(index["stockCode"]) for index in cn_index}
+    selected = [index for index in cn_index
+                if run_manifest.should_run(index["stockCode"], stage, digests[index["stockCode"]])]
+    if len(selected) < len(cn_index):
+        logging.info(f"根据运行清单，{stage} 阶段跳过 {len(cn_index) - len(selected)} 个指数，"
+                     f"执行 {len(selected)} 个指数")
+    return selected, digests
+
+
+def record_stage(stage, index, success, seconds, digests, error=None):
+    """在运行清单中记录一个指数在一个阶段的执行结果"""
+    if run_manifest is None or stage is None:
+        return
+    stockCode = index["stockCode"]
+    run_manifest.record(stockCode, stage, success, digests.get(stockCode), stored_digest(stockCode), seconds,
+                        None if success else error)
+
+
+def init_pool_worker(initializer=None, initargs=()):
+    # 进程池中的每个任务读写不同的指数，缓存的指数数据不会被再次读取
+    configure_cache(RUN_CACHE.max_bytes, frames=False)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def run_stage(func, cn_index, description, error_prefix="处理", workers=1, initializer=None, initargs=(),
+              stage=None, skipped=None, prepare=None, failure=None):
+    """
+    对所有指数执行一个CPU密集的处理阶段
+
+    workers 大于1时使用进程池并行执行。无论是否并行，返回结果都与 cn_index 的顺序一致，
+    失败的指数记录错误日志，对应结果为None。指定 stage 时每个指数的结果记录到运行清单，
+    并按运行清单跳过已完成的指数。
+
+    Args:
+        func: 处理单个指数的函数，必须是模块级函数以便在进程间传递
+        cn_index (list): 指数列表
+        description (str): 进度日志中的阶段描述
+        error_prefix (str): 错误日志的前缀
+        workers (int): 进程数
+        initializer: 每个工作进程启动时调用的函数，顺序执行时在当前进程中调用
+        initargs (tuple): initializer 的参数
+        stage (str): 运行清单中的阶段名称
+        skipped: 被运行清单跳过的指数的结果，在当前进程中调用，默认结果为None
+        prepare: 分发任务前在当前进程中调用，参数为需要执行的指数列表，
+            返回 stockCode -> 传给 func 的其它参数（如批量预先抓取的数据）
+        failure: 参数为处理结果，返回部分失败的错误信息或None；
+            部分失败的指数保留处理结果，但在运行清单中记录为失败
+
+    Returns:
+        list: 每个指数的处理结果
+    """
+    selected, digests = plan_stage(cn_index, stage)
+    selected_codes = {index["stockCode"] for index in selected}
+    positions = [position for position, index in enumerate(cn_index) if index["stockCode"] in selected_codes]
+    total_count = len(positions)
+    results = [None] * len(cn_index)
+    arguments = prepare(selected) if prepare is not None else {}
+
+    if skipped is not None:
+        for position, index in enumerate(cn_index):
+            if index["stockCode"] not in selected_codes:
+                results[position] = skipped(index)
+
+    def report(position, completed_count, outcome):
+        index = cn_index[position]
+        logging.info(f"进度: {completed_count}/{total_count} ({completed_count / total_count * 100:.1f}%) "
+                     f"{description} {index['stockCode']} - {index['name']}")
+        success, value, seconds = outcome
+        error = value
+        if success:
+            results[position] = value
+            error = failure(value) if failure is not None else None
+            success = error is None
+        else:
+            logging.error(f"{error_prefix} {index['stockCode']} 时出错: {value}")
+        record_stage(stage, index, success, seconds, digests, error)
+
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for completed_count, position in enumerate(positions, 1):
+            index = cn_index[position]
+            report(position, completed_count, run_guarded(func, index, arguments.get(index["stockCode"])))
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_pool_worker,
+                             initargs=(initializer, initargs)) as executor:
+        future_to_position = {
+            executor.submit(run_guarded, func, cn_index[position],
+                            arguments.get(cn_index[position]["stockCode"])): position
+            for position in positions
+        }
+        for completed_count, future in enumerate(as_completed(future_to_position), 1):
+            position = future_to_position[future]
+            try:
+                outcome = future.result()
+            except Exception as e:
+                # 工作进程异常退出等无法在进程内捕获的错误
+                outcome = (False, str(e), None)
+            report(position, completed_count, outcome)
+    return results
+
+
+def fetch_data_async(incremental=True, max_concurrency=64, batch_size=10):
+    """
+    使用异步客户端抓取所有指数数据
+
+    所有指数的请求共用一个连接池，同时在途的请求数不超过 max_concurrency。
+    估值数据先按 batch_size 个指数一组批量抓取。
+    """
+    cn_index, digests = plan_stage(load_records(CN_INDEX_FILE), "fetch")
+    total_count = len(cn_index)
+
+    async def fetch_all():
+        async with AsyncLixingerClient(max_concurrency=max_concurrency,
+                                       latency_target=config.get("latency_target", DEFAULT_LATENCY_TARGET)) as client:
+
+            batches = fundamental_batches(cn_index, incremental, batch_size)
+            prefetched = {}
+            for result in await asyncio.gather(*(
+                    fetch_fundamental_batch_async(client, indices, start_datetime, not incremental)
+                    for indices, start_datetime in batches)):
+                prefetched.update(result)
+            if batches:
+                logging.info(f"批量抓取估值数据: {len(batches)} 次请求覆盖 {len(prefetched)}/{total_count} 个指数")
+
+            async def fetch_one(index):
+                start = time.perf_counter()
+                try:
+                    index["dataframe"] = await fetch_index_dataframe_async(
+                        client, index, incremental, prefetched.pop(index["stockCode"], None))
+                    save_index_info(index)
+                    return index, None, time.perf_counter() - start
+                except Exception as e:
+                    return index, e, time.perf_counter() - start
+
+            completed_count = 0
+            tasks = {asyncio.ensure_future(fetch_one(index)): index for index in cn_index}
+            try:
+                for future in asyncio.as_completed(tasks, timeout=deadline_remaining()):
+                    index, error, seconds = await future
+                    completed_count += 1
+                    record_stage("fetch", index, error is None, seconds, digests, str(error))
+                    if error is None:
+                        logging.info(f"进度: {completed_count}/{total_count} ({completed_count/total_count*100:.1f}%) "
+                                     f"抓取指数信息 {index['stockCode']} - {index['name']}")
+                    else:
+                        logging.error(f"处理 {index['stockCode']} 时出错: {error}")
+            except asyncio.TimeoutError:
+                # 超过截止时间，取消所有未完成的抓取
+                stragglers = [task for task in tasks if not task.done()]
+                report_stragglers([tasks[task] for task in stragglers])
+                for task in stragglers:
+                    task.cancel()
+                await asyncio.gather(*stragglers, return_exceptions=True)
+                for task in stragglers:
+                    record_stage("fetch", tasks[task], False, None, digests, "超过抓取截止时间，已取消")
+
+    asyncio.run(fetch_all())
+
+
+def calculate_index(workers=1, verify=False):
+    cn_index = load_records(CN_INDEX_FILE)
+    run_stage(partial(calculate_single_index, verify=verify), cn_index, "计算指数信息", workers=workers,
+              stage="calculate")
+
+
+def backtest_index(workers=1, full_backtest=False, verify=False):
+    cn_index = load_records(CN_INDEX_FILE)
+    run_stage(partial(backtest_single_index_file, full_backtest=full_backtest, verify=verify), cn_index,
+              "回测指数信息", "回测处理", workers=workers, stage="backtest")
+
+
+def export_to_js(workers=1):
+    cn_index = load_records(CN_INDEX_FILE)
+
+    if not OUTPUT_INDEX_DIR.exists():
+        OUTPUT_INDEX_DIR.mkdir()
+
+    previous = load_export_manifest(EXPORT_MANIFEST_FILE)
+    digests = run_stage(export_single_index, cn_index, "导出到js指数信息", "导出", workers=workers,
+                        initializer=use_export_digests, initargs=(previous,), stage="export", skipped=skipped_export)
+    save_export_digests(cn_index, previous, digests)
+    remove_stale_outputs([index["stockCode"] for index in cn_index], OUTPUT_INDEX_DIR)
+    export_companies(cn_index)
+    logging.info("所有指数导出完成")
+
+
+def export_companies(cn_index):
+    """导出成分股公司信息表，公司字段由配置 company_fields 指定"""
+    cn_company_file = BASE_DIR.joinpath("cn_company.json")
+    if not cn_company_file.exists() and not cn_company_file.with_suffix(".jsonl").exists():
+        logging.warning(f"{cn_company_file} 不存在，跳过导出公司信息")
+        return
+    # 逐条读取，只保留投影后的字段
+    company_index = DictIndex(iter_records(cn_company_file), "stockCode", config.get("company_fields", ["name"]))
+    write_company_table(cn_index, company_index, OUTPUT_INDEX_DIR)
+
+
+def write_home(entries):
+    result = [entry for entry in entries if entry is not None]
 
     # 处理NaN值，避免JSON序列化错误
     for item in result:
@@ -677,15 +1327,214 @@ def export_home():
             if isinstance(value, float) and np.isnan(value):
                 item[key] = None
 
-    with open(OUTPUT_INDEX_DIR.joinpath("home.json"), "w", encoding="utf-8") as f:
-        json.dump(result, f, ensure_ascii=False, indent=4)
+    write_if_changed(OUTPUT_INDEX_DIR.joinpath("home.json"),
+                     lambda f: json.dump(result, f, ensure_ascii=False, indent=4), compress=True)
+
+
+def export_home(workers=1):
+    cn_index = load_records(CN_INDEX_FILE)
+
+    entries = run_stage(build_home_entry, cn_index, "导出首页指数信息", "导出首页", workers=workers)
+    write_home(entries)
+
+
+def configure_requests(share=1, max_concurrency=1, deadline=None, offline=False):
+    """
+    按配置文件设置请求限速（rate_limit、rate_burst、latency_target）、超时（connect_timeout、read_timeout）
+    和响应缓存（response_cache、response_cache_mb）
+
+    Args:
+        share (int): 同时发出请求的进程数，每个进程分得 1/share 的速率
+        max_concurrency (int): 本进程内的最大并发请求数，也是共用连接池的大小
+        deadline (float): 抓取截止时间（time.time() 的时间戳），None 表示没有截止时间
+        offline (bool): 只从响应缓存读取，不发出请求
+    """
+    configure_rate_limit(config.get("rate_limit", DEFAULT_RATE_LIMIT) / share,
+                         config.get("rate_burst", DEFAULT_RATE_BURST) // share,
+                         max_concurrency,
+                         config.get("latency_target", DEFAULT_LATENCY_TARGET))
+    configure_timeouts(config.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT),
+                       config.get("read_timeout", DEFAULT_READ_TIMEOUT))
+    # 每个进程重新创建连接池，同时发出请求的线程各用一个长连接
+    configure_http_session(max_concurrency)
+    set_deadline(deadline)
+    # 离线模式总是使用响应缓存
+    use_cache = offline or config.get("response_cache", True)
+    configure_response_cache(RESPONSE_CACHE_DIR if use_cache else None,
+                             int(config.get("response_cache_mb", DEFAULT_RESPONSE_CACHE_BYTES / 2 ** 20) * 2 ** 20),
+                             offline)
+
+
+def fetch_deadline_at(seconds):
+    """抓取阶段的截止时间戳，seconds 不大于0时没有截止时间"""
+    return time.time() + seconds if seconds and seconds > 0 else None
+
+
+def save_export_digests(cn_index, previous, digests):
+    """
+    保存本次的导出清单，导出失败的指数不记录，下次重新导出
+
+    Args:
+        cn_index (list): 指数列表
+        previous (dict): 上次的导出哈希
+        digests (list): 与 cn_index 顺序一致的本次导出哈希，失败为None
+    """
+    current = {index["stockCode"]: digest for index, digest in zip(cn_index, digests) if digest is not None}
+    unchanged = sum(1 for stockCode, digest in current.items() if previous.get(stockCode) == digest)
+    logging.info(f"{len(current) - unchanged} 个指数的数据有变化，{unchanged} 个指数的数据未变化")
+    save_export_manifest(EXPORT_MANIFEST_FILE, current, EXPORT_CODE_VERSION)
+
+
+def fused_processes(workers):
+    """融合模式的进程数：每个进程都导入 pandas 和 pyarrow，不超过CPU核数，以免占用过多内存"""
+    return max(1, min(workers, os.cpu_count() or 1))
+
 
-def main():
-    fetch_data()
-    calculate_index()
-    backtest_index()
-    export_to_js()
-    export_home()
+def init_fused_worker(share, threads, digests, deadline=None, offline=False):
+    global fetch_threads
+    fetch_threads = threads
+    configure_requests(share, threads, deadline, offline)
+    use_export_digests(digests)
+
+
+def run_fused(workers=1, fetch_workers=12, incremental=True, verify=False, full_backtest=False,
+              verify_backtest=False, fetch_deadline=0, offline=False, batch_size=10):
+    """
+    融合模式：每个指数在一个进程内依次完成抓取、计算、回测和导出
+
+    进程数不超过CPU核数（见 fused_processes），抓取并发数 fetch_workers 只用于线程：
+    分发任务前先在主进程中用 fetch_workers 个线程按 batch_size 个指数一组批量抓取估值数据，
+    每个指数只传递自己的部分；工作进程中按进程数平分 fetch_workers，用线程并发请求一个指数的各个日期区间。
+
+    超过截止时间（开始后 fetch_deadline 秒）后不再抓取，其余指数使用上次保存的数据继续处理，
+    并在运行清单中记录为失败。截止时间从开始处理时计算，包括其它指数的计算、回测和导出时间。
+    """
+    cn_index = load_records(CN_INDEX_FILE)
+
+    if not OUTPUT_INDEX_DIR.exists():
+        OUTPUT_INDEX_DIR.mkdir()
+
+    deadline = fetch_deadline_at(fetch_deadline)
+    processes = fused_processes(workers)
+    threads = max(1, -(-fetch_workers // processes))
+
+    def prefetch(selected):
+        # 批量请求在主进程中发出，此时工作进程还未启动，使用全部速率
+        configure_requests(1, fetch_workers, deadline, offline)
+        prefetched = prefetch_fundamentals(selected, incremental, batch_size, fetch_workers)
+        return {stockCode: {"fundamental": fundamental} for stockCode, fundamental in prefetched.items()}
+
+    # 每个工作进程各有一个限速器，按进程数平分总速率
+    previous = load_export_manifest(EXPORT_MANIFEST_FILE)
+    results = run_stage(partial(process_index, incremental=incremental, verify=verify, full_backtest=full_backtest,
+                                verify_backtest=verify_backtest), cn_index, "处理指数",
+                        workers=processes, initializer=init_fused_worker,
+                        initargs=(processes, threads, previous, deadline, offline),
+                        stage="process", skipped=skipped_process, prepare=prefetch, failure=fetch_failure)
+    set_deadline(None)
+    write_home([result[0] if result else None for result in results])
+    save_export_digests(cn_index, previous, [result[1] if result else None for result in results])
+    remove_stale_outputs([index["stockCode"] for index in cn_index], OUTPUT_INDEX_DIR)
+    export_companies(cn_index)
+    logging.info("所有指数导出完成")
+    RUN_CACHE.log_stats()
+
+
+def run_stages(workers=1, fetch_workers=12, incremental=True, async_fetch=False, max_concurrency=64, batch_size=10,
+               verify=False, full_backtest=False, verify_backtest=False, fetch_deadline=0, offline=False):
+    """
+    分阶段模式：所有指数完成一个阶段后再进入下一个阶段，每个阶段读写一次数据文件，便于调试
+
+    抓取阶段开始 fetch_deadline 秒后取消未完成的抓取，这些指数使用上次保存的数据继续后面的阶段。
+    """
+    deadline = fetch_deadline_at(fetch_deadline)
+    if async_fetch:
+        configure_requests(deadline=deadline, offline=offline)
+        fetch_data_async(incremental, max_concurrency, batch_size)
+    else:
+        configure_requests(max_concurrency=fetch_workers, deadline=deadline, offline=offline)
+        fetch_data(incremental, fetch_workers, batch_size)
+    set_deadline(None)
+    log_response_cache_stats()
+    calculate_index(workers, verify)
+    backtest_index(workers, full_backtest, verify_backtest)
+    export_to_js(workers)
+    export_home(workers)
+    # 多进程执行的阶段在工作进程中读取数据，这里只统计当前进程的缓存
+    RUN_CACHE.log_stats()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="每日获取指数数据、处理数据、执行回测并导出结果")
+    parser.add_argument("--mode", choices=["fused", "stages"], default="fused",
+                        help="fused: 每个指数在内存中完成全部流程；stages: 按阶段执行，便于调试")
+    parser.add_argument("--workers", type=int, default=config.get("workers", os.cpu_count() or 1),
+                        help="计算、回测和导出阶段的进程数，1表示在当前进程中顺序执行（只有此时各阶段共用缓存的指数数据）；"
+                             "融合模式下不超过CPU核数")
+    parser.add_argument("--fetch-workers", type=int, default=config.get("fetch_workers", 12),
+                        help="抓取数据的并发线程数，融合模式下由各工作进程平分")
+    parser.add_argument("--async-fetch", action="store_true", default=config.get("async_fetch", False),
+                        help="使用共享连接池的异步客户端抓取数据，此时抓取阶段独立执行（隐含 --mode stages）")
+    parser.add_argument("--max-concurrency", type=int, default=config.get("max_concurrency", 64),
+                        help="异步抓取时同时在途的最大请求数")
+    parser.add_argument("--batch-size", type=int, default=config.get("fundamental_batch_size", 10),
+                        help="每次估值数据请求合并的指数个数，1表示不合并")
+    parser.add_argument("--fetch-deadline", type=float, default=config.get("fetch_deadline"),
+                        help="抓取的截止时间（秒），超过后取消未完成的抓取并使用上次保存的数据，0表示不限制；"
+                             f"分阶段模式默认 {DEFAULT_FETCH_DEADLINE} 秒，融合模式下从开始处理时计算、"
+                             "包括计算和导出时间，默认不限制")
+    parser.add_argument("--offline", action="store_true", default=config.get("offline", False),
+                        help="只从响应缓存读取接口数据，不发出请求，缓存中没有的请求视为抓取失败")
+    parser.add_argument("--full-fetch", action="store_true",
+                        help="忽略已保存的数据和响应缓存，从指数发布日全量抓取")
+    parser.add_argument("--verify-indicators", action="store_true", default=config.get("verify_indicators", False),
+                        help="增量计算指标后再全量计算一次并比较，不一致时记录错误并使用全量计算的结果")
+    parser.add_argument("--full-backtest", action="store_true",
+                        help="忽略保存的回测检查点，从头回放全部交易日（修改策略后会自动从头回放）")
+    parser.add_argument("--verify-backtest", action="store_true", default=config.get("verify_backtest", False),
+                        help="从检查点继续回测后再从头回放一次并比较，不一致时记录错误并使用从头回放的结果")
+    parser.add_argument("--resume", action="store_true",
+                        help="继续上次未完成的运行，跳过运行清单中已完成且数据未被改动的指数和阶段")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="只重新执行上次运行中有阶段失败的指数")
+    parser.add_argument("--migrate-pickles", action="store_true",
+                        help="将 data/ 中旧版的 pickle 数据转换为列式存储后退出")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.migrate_pickles:
+        migrate_pickles(DATA_DIR)
+        return
+
+    incremental = not args.full_fetch
+    staged = args.mode == "stages" or args.async_fetch
+    if (args.workers if staged else fused_processes(args.workers)) > 1:
+        # 各阶段在进程池中执行，当前进程保存的指数数据不会被再次读取，只缓存记录列表
+        configure_cache(RUN_CACHE.max_bytes, frames=False)
+    stages = STAGES if staged else FUSED_STAGES
+    fetch_deadline = args.fetch_deadline
+    if fetch_deadline is None:
+        fetch_deadline = DEFAULT_FETCH_DEADLINE if staged else 0
+    if args.retry_failed or args.resume:
+        manifest = RunManifest.load(RUN_MANIFEST_FILE, stages, "retry_failed" if args.retry_failed else "resume")
+    else:
+        manifest = RunManifest(RUN_MANIFEST_FILE, stages)
+    use_run_manifest(manifest)
+
+    try:
+        if staged:
+            run_stages(args.workers, args.fetch_workers, incremental, args.async_fetch, args.max_concurrency,
+                       args.batch_size, args.verify_indicators, args.full_backtest, args.verify_backtest,
+                       fetch_deadline, args.offline)
+        else:
+            run_fused(args.workers, args.fetch_workers, incremental, args.verify_indicators,
+                      args.full_backtest, args.verify_backtest, fetch_deadline, args.offline, args.batch_size)
+    finally:
+        # 中途退出时也保存已完成的记录，下次可以用 --resume 继续
+        manifest.save()
+    manifest.finish()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -9,11 +9,70 @@
 3. 结果统计
 """
 
+import json
+import hashlib
 import logging
 from datetime import datetime
 import pandas as pd
 import numpy as np
 
+# 每个策略的初始资金
+INITIAL_CAPITAL = 100000
+
+# 默认止损线：相对买入价下跌超过15%
+STOP_LOSS = 0.15
+
+# 最后若干个信号交易日的数据可能在下次抓取时被修订，不计入检查点，每次都在检查点之后重新推进
+PENDING_ROWS = 10
+
+# 不记录日志且策略数超过该值时按交易日批量推进，所有策略的状态每天只做一次数组运算
+BATCHED_MIN_STRATEGIES = 256
+
+# 策略参数
+STRATEGIES = [
+    {'buy_threshold': 0.10, 'sell_threshold': 0.40, 'name': '10-40估值线', "mode": "fundamental"},
+    {'buy_threshold': 0.10, 'sell_threshold': 0.50, 'name': '10-50估值线', "mode": "fundamental"},
+    {'buy_threshold': 0.15, 'sell_threshold': 0.45, 'name': '15-45估值线', "mode": "fundamental"},
+    {'buy_threshold': 0.15, 'sell_threshold': 0.55, 'name': '15-55估值线', "mode": "fundamental"},
+    {'buy_threshold': 0.20, 'sell_threshold': 0.50, 'name': '20-50估值线', "mode": "fundamental"},
+    {'buy_threshold': 0.20, 'sell_threshold': 0.60, 'name': '20-60估值线', "mode": "fundamental"},
+    {'buy_threshold': 0.25, 'sell_threshold': 0.55, 'name': '25-55估值线', "mode": "fundamental"},
+    {'buy_threshold': 0.25, 'sell_threshold': 0.65, 'name': '25-65估值线', "mode": "fundamental"},
+    {'buy_threshold': 0.30, 'sell_threshold': 0.60, 'name': '30-60估值线', "mode": "fundamental"},
+    {'buy_threshold': 0.30, 'sell_threshold': 0.70, 'name': '30-70估值线', "mode": "fundamental"},
+    {'buy_threshold': 0.35, 'sell_threshold': 0.65, 'name': '35-65估值线', "mode": "fundamental"},
+    {'buy_threshold': 0.35, 'sell_threshold': 0.75, 'name': '35-75估值线', "mode": "fundamental"},
+    {'buy_threshold': 0.40, 'sell_threshold': 0.70, 'name': '40-70估值线', "mode": "fundamental"},
+    {'buy_threshold': 0.40, 'sell_threshold': 0.80, 'name': '40-80估值线', "mode": "fundamental"},
+    {'buy_threshold': 0.45, 'sell_threshold': 0.75, 'name': '45-75估值线', "mode": "fundamental"},
+    {'buy_threshold': 0.45, 'sell_threshold': 0.85, 'name': '45-85估值线', "mode": "fundamental"},
+    # {'buy_threshold': 0.50, 'sell_threshold': 0.80, 'name': '50-80估值线', "mode": "fundamental"},
+    # {'buy_threshold': 0.50, 'sell_threshold': 0.90, 'name': '50-90估值线', "mode": "fundamental"},
+    # {'buy_threshold': 0.55, 'sell_threshold': 0.85, 'name': '55-85估值线', "mode": "fundamental"},
+    # {'buy_threshold': 0.55, 'sell_threshold': 0.95, 'name': '55-95估值线', "mode": "fundamental"},
+
+    {'buy_threshold': 0.10, 'sell_threshold': 0.40, 'name': '10-40布林线', "mode": "bollinger"},
+    {'buy_threshold': 0.10, 'sell_threshold': 0.50, 'name': '10-50布林线', "mode": "bollinger"},
+    {'buy_threshold': 0.15, 'sell_threshold': 0.45, 'name': '15-45布林线', "mode": "bollinger"},
+    {'buy_threshold': 0.15, 'sell_threshold': 0.55, 'name': '15-55布林线', "mode": "bollinger"},
+    {'buy_threshold': 0.20, 'sell_threshold': 0.50, 'name': '20-50布林线', "mode": "bollinger"},
+    {'buy_threshold': 0.20, 'sell_threshold': 0.60, 'name': '20-60布林线', "mode": "bollinger"},
+    {'buy_threshold': 0.25, 'sell_threshold': 0.55, 'name': '25-55布林线', "mode": "bollinger"},
+    {'buy_threshold': 0.25, 'sell_threshold': 0.65, 'name': '25-65布林线', "mode": "bollinger"},
+    {'buy_threshold': 0.30, 'sell_threshold': 0.60, 'name': '30-60布林线', "mode": "bollinger"},
+    {'buy_threshold': 0.30, 'sell_threshold': 0.70, 'name': '30-70布林线', "mode": "bollinger"},
+    {'buy_threshold': 0.35, 'sell_threshold': 0.65, 'name': '35-65布林线', "mode": "bollinger"},
+    {'buy_threshold': 0.35, 'sell_threshold': 0.75, 'name': '35-75布林线', "mode": "bollinger"},
+    {'buy_threshold': 0.40, 'sell_threshold': 0.70, 'name': '40-70布林线', "mode": "bollinger"},
+    {'buy_threshold': 0.40, 'sell_threshold': 0.80, 'name': '40-80布林线', "mode": "bollinger"},
+    {'buy_threshold': 0.45, 'sell_threshold': 0.75, 'name': '45-75布林线', "mode": "bollinger"},
+    {'buy_threshold': 0.45, 'sell_threshold': 0.85, 'name': '45-85布林线', "mode": "bollinger"},
+    # {'buy_threshold': 0.50, 'sell_threshold': 0.80, 'name': '50-80布林线', "mode": "bollinger"},
+    # {'buy_threshold': 0.50, 'sell_threshold': 0.90, 'name': '50-90布林线', "mode": "bollinger"},
+    # {'buy_threshold': 0.55, 'sell_threshold': 0.85, 'name': '55-85布林线', "mode": "bollinger"},
+    # {'buy_threshold': 0.55, 'sell_threshold': 0.95, 'name': '55-95布林线', "mode": "bollinger"},
+]
+
 
 def mean_with_default(arr, default_value=0):
     """
@@ -32,38 +91,39 @@ def mean_with_default(arr, default_value=0):
     return mean_value if not np.isnan(mean_value) else default_value
 
 
-def backtest_single_index(index_info):
+def prepare_backtest_frame(index_info):
     """
-    对单个指数进行回测
-    
+    截取回测区间：2016年1月1日之后，并且从第250个交易日开始
+
     Args:
         index_info (dict): 包含指数信息的字典
-        
+
     Returns:
-        tuple: (回测日志, 统计结果)
+        pandas.DataFrame: 回测区间的数据，数据不足时返回None
     """
-    df = index_info["dataframe"].copy()
-    # 确保日期列是datetime类型
-    df['日期'] = pd.to_datetime(df['日期'])
+    df = index_info["dataframe"]
+    # 日期在入库时已转换为datetime类型，旧数据仍为字符串时才需要解析
+    if not pd.api.types.is_datetime64_dtype(df['日期']):
+        df = df.assign(日期=pd.to_datetime(df['日期']))
 
     # 设置回测开始时间：2016年1月1日之后，并且至少是第250个交易日
     start_date = datetime(2016, 1, 1)
     if len(df) <= 250:
         logging.info(f"  数据不足，跳过 {index_info['stockCode']}")
-        return [], []
+        return None
 
     # 找到2016年1月1日之后的数据
     df_filtered = df[df['日期'] >= start_date]
     if len(df_filtered) <= 250:
         logging.info(f"  2016年后数据不足250个交易日，跳过 {index_info['stockCode']}")
-        return [], []
+        return None
 
     # 从第250个交易日开始回测
     df_test = df_filtered.iloc[250:].reset_index(drop=True)
 
     if len(df_test) == 0:
         logging.info(f"  回测数据为空，跳过 {index_info['stockCode']}")
-        return [], []
+        return None
 
     # 检查必要的列是否存在
     required_columns = ['估值百分位', '布林线位置', '开盘价']
@@ -71,214 +131,344 @@ def backtest_single_index(index_info):
     if missing_columns:
         raise KeyError(f"缺少必要的列: {missing_columns}")
 
-    # 初始化策略参数
-    strategies = [
-        {'buy_threshold': 0.10, 'sell_threshold': 0.40, 'name': '10-40估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.10, 'sell_threshold': 0.50, 'name': '10-50估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.15, 'sell_threshold': 0.45, 'name': '15-45估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.15, 'sell_threshold': 0.55, 'name': '15-55估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.20, 'sell_threshold': 0.50, 'name': '20-50估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.20, 'sell_threshold': 0.60, 'name': '20-60估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.25, 'sell_threshold': 0.55, 'name': '25-55估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.25, 'sell_threshold': 0.65, 'name': '25-65估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.30, 'sell_threshold': 0.60, 'name': '30-60估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.30, 'sell_threshold': 0.70, 'name': '30-70估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.35, 'sell_threshold': 0.65, 'name': '35-65估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.35, 'sell_threshold': 0.75, 'name': '35-75估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.40, 'sell_threshold': 0.70, 'name': '40-70估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.40, 'sell_threshold': 0.80, 'name': '40-80估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.45, 'sell_threshold': 0.75, 'name': '45-75估值线', "mode": "fundamental"},
-        {'buy_threshold': 0.45, 'sell_threshold': 0.85, 'name': '45-85估值线', "mode": "fundamental"},
-        # {'buy_threshold': 0.50, 'sell_threshold': 0.80, 'name': '50-80估值线', "mode": "fundamental"},
-        # {'buy_threshold': 0.50, 'sell_threshold': 0.90, 'name': '50-90估值线', "mode": "fundamental"},
-        # {'buy_threshold': 0.55, 'sell_threshold': 0.85, 'name': '55-85估值线', "mode": "fundamental"},
-        # {'buy_threshold': 0.55, 'sell_threshold': 0.95, 'name': '55-95估值线', "mode": "fundamental"},
-
-        {'buy_threshold': 0.10, 'sell_threshold': 0.40, 'name': '10-40布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.10, 'sell_threshold': 0.50, 'name': '10-50布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.15, 'sell_threshold': 0.45, 'name': '15-45布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.15, 'sell_threshold': 0.55, 'name': '15-55布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.20, 'sell_threshold': 0.50, 'name': '20-50布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.20, 'sell_threshold': 0.60, 'name': '20-60布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.25, 'sell_threshold': 0.55, 'name': '25-55布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.25, 'sell_threshold': 0.65, 'name': '25-65布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.30, 'sell_threshold': 0.60, 'name': '30-60布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.30, 'sell_threshold': 0.70, 'name': '30-70布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.35, 'sell_threshold': 0.65, 'name': '35-65布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.35, 'sell_threshold': 0.75, 'name': '35-75布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.40, 'sell_threshold': 0.70, 'name': '40-70布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.40, 'sell_threshold': 0.80, 'name': '40-80布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.45, 'sell_threshold': 0.75, 'name': '45-75布林线', "mode": "bollinger"},
-        {'buy_threshold': 0.45, 'sell_threshold': 0.85, 'name': '45-85布林线', "mode": "bollinger"},
-        # {'buy_threshold': 0.50, 'sell_threshold': 0.80, 'name': '50-80布林线', "mode": "bollinger"},
-        # {'buy_threshold': 0.50, 'sell_threshold': 0.90, 'name': '50-90布林线', "mode": "bollinger"},
-        # {'buy_threshold': 0.55, 'sell_threshold': 0.85, 'name': '55-85布林线', "mode": "bollinger"},
-        # {'buy_threshold': 0.55, 'sell_threshold': 0.95, 'name': '55-95布林线', "mode": "bollinger"},
-    ]
-
-    # 为每个策略初始化状态
-    for strategy in strategies:
-        strategy['position'] = False  # 是否持仓
-        strategy['position_date'] = None  # 持仓开始日期
-        strategy['buy_price'] = 0  # 买入价格
-        strategy['capital'] = 100000  # 每份资金10万元
-        strategy['shares'] = 0  # 持有份额
-        strategy['total_holding_days'] = 0  # 总持仓天数
-        strategy['total_return'] = 0  # 累计收益
-        strategy['date_start'] = None
-        strategy['date_end'] = None
-
-    # 添加前一天的估值百分位和布林线位置用于判断上穿
-    df_test['prev_估值百分位'] = df_test['估值百分位'].shift(1)
-    df_test['prev_布林线位置'] = df_test['布林线位置'].shift(1)
-
-    # 添加下一天的开盘价用于交易执行
-    df_test['next_开盘价'] = df_test['开盘价'].shift(-1)
+    return df_test
 
-    # 初始化日志列表
-    log = []
-    stat = []
-    # 开始回测
-    for i, row in df_test.iterrows():
-        if pd.isna(row['prev_估值百分位']) or pd.isna(row['next_开盘价']):
+
+def build_signal_rows(df_test):
+    """
+    将回测区间转换为按交易日排列的信号数组
+
+    只保留前一日估值百分位和下一日开盘价都存在的交易日，这些交易日才会触发交易。
+
+    Args:
+        df_test (pandas.DataFrame): 回测区间的数据
+
+    Returns:
+        dict: 日期（datetime64[D]）、两种模式的当日/前一日信号和下一日开盘价
+    """
+    fundamental = df_test['估值百分位'].to_numpy(dtype=float)
+    bollinger = df_test['布林线位置'].to_numpy(dtype=float)
+    # 前一天的估值百分位和布林线位置用于判断上穿
+    prev_fundamental = df_test['估值百分位'].shift(1).to_numpy(dtype=float)
+    prev_bollinger = df_test['布林线位置'].shift(1).to_numpy(dtype=float)
+    # 下一天的开盘价用于交易执行
+    next_open = df_test['开盘价'].shift(-1).to_numpy(dtype=float)
+
+    valid = ~np.isnan(prev_fundamental) & ~np.isnan(next_open)
+    return {
+        'date': df_test['日期'].to_numpy().astype('datetime64[D]')[valid],
+        'fundamental': fundamental[valid],
+        'prev_fundamental': prev_fundamental[valid],
+        'bollinger': bollinger[valid],
+        'prev_bollinger': prev_bollinger[valid],
+        'next_open': next_open[valid],
+    }
+
+
+def new_strategy_state(strategies):
+    """
+    为一组策略初始化回测状态，每个字段是长度为策略数的数组
+
+    Args:
+        strategies (list): 策略参数列表
+
+    Returns:
+        dict: 回测状态
+    """
+    count = len(strategies)
+    return {
+        'position': np.zeros(count, dtype=bool),  # 是否持仓
+        'position_date': np.zeros(count, dtype='datetime64[D]'),  # 持仓开始日期
+        'buy_price': np.zeros(count),  # 买入价格
+        'capital': np.full(count, float(INITIAL_CAPITAL)),  # 每份资金10万元
+        'shares': np.zeros(count),  # 持有份额
+        'total_holding_days': np.zeros(count, dtype=np.int64),  # 总持仓天数
+        'settled': np.zeros(count, dtype=bool),  # 是否卖出过，未卖出时资金仍为初始整数
+        'date_start': None,
+        'date_end': None,
+    }
+
+
+def _copy_state(state):
+    return {key: value.copy() if isinstance(value, np.ndarray) else value for key, value in state.items()}
+
+
+def _strategy_arrays(strategies):
+    is_fundamental = np.array([strategy['mode'] == "fundamental" for strategy in strategies], dtype=bool)
+    buy_threshold = np.array([strategy['buy_threshold'] for strategy in strategies], dtype=float)
+    sell_threshold = np.array([strategy['sell_threshold'] for strategy in strategies], dtype=float)
+    stop_loss = np.array([strategy.get('stop_loss', STOP_LOSS) for strategy in strategies], dtype=float)
+    return is_fundamental, buy_threshold, sell_threshold, stop_loss
+
+
+def _next_crossing(rows, is_fundamental, thresholds):
+    """
+    计算每个交易日之后（含当日）信号第一次上穿阈值（前一日 < 阈值 <= 当日）的交易日
+
+    相同模式、相同阈值的策略共用一列，结果多出一行，取值为交易日总数，表示之后不再上穿。
+
+    Returns:
+        tuple: (下一个上穿日矩阵, 每个策略对应的列号)
+    """
+    keys, columns = np.unique(np.column_stack([is_fundamental, thresholds]), axis=0, return_inverse=True)
+    columns = columns.reshape(-1)
+    row_count = len(rows['date'])
+
+    crossing = np.zeros((row_count, len(keys)), dtype=bool)
+    for mode, flag in (("fundamental", 1), ("bollinger", 0)):
+        mask = keys[:, 0] == flag
+        if not mask.any():
             continue
-        date = row['日期']
-        next_open_price = row['next_开盘价']  # 下一日开盘价用于交易
-        pe_percentile = row['估值百分位']
-        prev_pe_percentile = row['prev_估值百分位']  # 前一日估值百分位
-        bollinger_position = row['布林线位置']
-        prev_bollinger_position = row['prev_布林线位置']
-
-        # 遍历每个策略
-        for strategy in strategies:
-            if strategy['date_start'] is None:
-                strategy['date_start'] = date
-            strategy['date_end'] = date
-
-            # 根据策略模式选择不同的买卖信号判断方法
-            if strategy['mode'] == "fundamental":
-                # 模式1：使用估值百分位作为买卖信号
-                buy_signal = (not strategy['position']) and (prev_pe_percentile < strategy['buy_threshold'] <= pe_percentile)
-                sell_signal = strategy['position'] and strategy['capital'] > 0 and (prev_pe_percentile < strategy['sell_threshold'] <= pe_percentile)
-            elif strategy['mode'] == "bollinger":
-                # 模式2：使用布林线位置作为买卖信号
-                buy_signal = (not strategy['position']) and (prev_bollinger_position < strategy['buy_threshold'] <= bollinger_position)
-                sell_signal = strategy['position'] and strategy['capital'] > 0 and (prev_bollinger_position < strategy['sell_threshold'] <= bollinger_position)
-
-            # 买入条件
-            if buy_signal:
-                strategy['position'] = True
-                strategy['position_date'] = date
-                strategy['buy_price'] = next_open_price
-                strategy['shares'] = strategy['capital'] / next_open_price
-                # 添加买入日志
-                buy_log = {
-                    'date': date.strftime('%Y-%m-%d'),
-                    'strategy_name': strategy['name'],
-                    'direction': 'buy',
-                    'amount': strategy['capital'],
-                    'price': next_open_price,
-                    'cash': strategy['capital']
-                }
-                log.append(buy_log)
-                # logging.info(f"买入 - 日期:{buy_log['日期']}, 策略:{buy_log['策略名称']}, 价格:{buy_log['价格']:.4f}")
-
-            # 检查是否需要卖出（止盈或止损）
-            elif strategy['position'] and strategy['capital'] > 0:
-                # 计算当前收益率
-                current_return = (next_open_price - strategy['buy_price']) / strategy['buy_price'] if strategy['buy_price'] != 0 else 0
-
-                # 止损条件：下跌超过15%
-                stop_loss = current_return <= -0.15
-
-                # 止盈条件：根据策略模式决定
-                if strategy['mode'] == "fundamental":
-                    # 模式1：估值百分位上穿卖出阈值
-                    take_profit = (prev_pe_percentile < strategy['sell_threshold'] <= pe_percentile)
-                elif strategy['mode'] == "bollinger":
-                    # 模式2：布林线位置上穿卖出阈值
-                    take_profit = (prev_bollinger_position < strategy['sell_threshold'] <= bollinger_position)
-
-                # 如果触发止损或止盈
-                if stop_loss or take_profit:
-                    # 计算持有天数
-                    holding_days = (date - strategy['position_date']).days
-
-                    # 计算卖出后的资金
-                    sell_capital = strategy['shares'] * next_open_price
-
-                    # 累计总持仓天数
-                    strategy['total_holding_days'] += holding_days
-
-                    sell_type = "stop_loss" if stop_loss else "take_profit"
-                    # 添加卖出日志
-                    sell_log = {
-                        'date': date.strftime('%Y-%m-%d'),
-                        'strategy_name': strategy['name'],
-                        'direction': sell_type + '_sell',
-                        'amount': sell_capital,
-                        'price': next_open_price,
-                        'cash': sell_capital
-                    }
-                    log.append(sell_log)
-                    # logging.info(f"{sell_type}卖出 - 日期:{sell_log['日期']}, 策略:{sell_log['策略名称']}, 价格:{sell_log['价格']:.4f}, 收益率:{trade_return*100:.2f}%")
-
-                    # 重置状态
-                    strategy['position'] = False
-                    strategy['position_date'] = None
-                    strategy['buy_price'] = 0
-                    strategy['shares'] = 0
-                    strategy['capital'] = sell_capital
-
-    # 处理仍持仓的策略（已买入但从未卖出的情况）
-    for strategy in strategies:
-        if strategy['position']:
-            # 使用最后一日的下一日开盘价强制卖出
-            last_row = df_test.iloc[-1]
-            sell_price = last_row['next_开盘价']  # 使用下一日开盘价作为卖出价格
-
-            # 如果没有下一日开盘价，则使用当日收盘价
-            if pd.isna(sell_price):
-                sell_price = last_row['收盘价']
+        prev_value = rows[f'prev_{mode}'][:, None]
+        value = rows[mode][:, None]
+        threshold = keys[mask, 1][None, :]
+        crossing[:, mask] = (prev_value < threshold) & (threshold <= value)
 
+    next_rows = np.where(crossing, np.arange(row_count, dtype=np.int32)[:, None], row_count)
+    next_rows = np.vstack([next_rows, np.full((1, len(keys)), row_count)])
+    return np.minimum.accumulate(next_rows[::-1], axis=0)[::-1], columns
+
+
+def _capital_value(state, k):
+    # 从未卖出过的策略资金仍是初始整数，保持日志与统计中的数值类型不变
+    return float(state['capital'][k]) if state['settled'][k] else INITIAL_CAPITAL
+
+
+def advance_strategies(strategies, state, rows, log=None):
+    """
+    按交易日推进所有策略的回测状态
+
+    先对所有策略一次性计算买入、卖出阈值的上穿矩阵，再求出每个交易日之后的
+    下一个上穿日；每个策略只需在买入、卖出事件之间跳转，止损只在持仓区间内
+    用数组判断，不再逐日逐策略循环。
+
+    Args:
+        strategies (list): 策略参数列表
+        state (dict): 回测状态，会被原地更新
+        rows (dict): build_signal_rows 返回的信号数组
+        log (list): 交易日志，为None时不记录日志
+    """
+    dates = rows['date']
+    next_open = rows['next_open']
+    row_count = len(dates)
+    if row_count == 0:
+        return
+
+    if state['date_start'] is None:
+        state['date_start'] = dates[0]
+    state['date_end'] = dates[-1]
+
+    is_fundamental, buy_threshold, sell_threshold, stop_loss = _strategy_arrays(strategies)
+    next_buy, buy_columns = _next_crossing(rows, is_fundamental, buy_threshold)
+    next_sell, sell_columns = _next_crossing(rows, is_fundamental, sell_threshold)
+
+    if log is None and len(strategies) > BATCHED_MIN_STRATEGIES:
+        _advance_by_row(state, rows, next_buy, buy_columns, next_sell, sell_columns, stop_loss)
+        return
+
+    position = state['position']
+    position_date = state['position_date']
+    buy_price = state['buy_price']
+    capital = state['capital']
+    shares = state['shares']
+    total_holding_days = state['total_holding_days']
+    settled = state['settled']
+
+    # (交易日, 策略序号, 日志)，最后按交易日和策略顺序排序，与逐日遍历的顺序一致
+    events = []
+    for k in range(len(strategies)):
+        buy_column = buy_columns[k]
+        sell_column = sell_columns[k]
+        t = 0
+        while t < row_count:
+            if not position[k]:
+                # 买入条件：信号上穿买入阈值
+                t = next_buy[t, buy_column]
+                if t >= row_count:
+                    break
+                next_open_price = next_open[t]  # 下一日开盘价用于交易
+                amount = _capital_value(state, k)
+                position[k] = True
+                position_date[k] = dates[t]
+                buy_price[k] = next_open_price
+                shares[k] = capital[k] / next_open_price
+                if log is not None:
+                    events.append((t, k, {
+                        'date': str(dates[t]),
+                        'strategy_name': strategies[k]['name'],
+                        'direction': 'buy',
+                        'amount': amount,
+                        'price': float(next_open_price),
+                        'cash': amount
+                    }))
+                t += 1
+                continue
+
+            if capital[k] <= 0:
+                break
+
+            # 止盈条件：信号上穿卖出阈值
+            take_profit_row = next_sell[t, sell_column]
+            # 止损条件：在止盈前的持仓区间内下跌超过止损线
+            stop_loss_row = row_count
+            if buy_price[k] != 0:
+                window = next_open[t:min(take_profit_row, row_count - 1) + 1]
+                current_return = (window - buy_price[k]) / buy_price[k]
+                hits = np.flatnonzero(current_return <= -stop_loss[k])
+                if hits.size:
+                    stop_loss_row = t + hits[0]
+            t = min(take_profit_row, stop_loss_row)
+            if t >= row_count:
+                break
+
+            next_open_price = next_open[t]
             # 计算卖出后的资金
-            sell_capital = strategy['shares'] * sell_price
+            sell_capital = float(shares[k] * next_open_price)
+            # 累计总持仓天数
+            total_holding_days[k] += (dates[t] - position_date[k]).astype(np.int64)
+            sell_type = "stop_loss" if t == stop_loss_row else "take_profit"
+            if log is not None:
+                events.append((t, k, {
+                    'date': str(dates[t]),
+                    'strategy_name': strategies[k]['name'],
+                    'direction': sell_type + '_sell',
+                    'amount': sell_capital,
+                    'price': float(next_open_price),
+                    'cash': sell_capital
+                }))
+
+            # 重置状态
+            position[k] = False
+            buy_price[k] = 0
+            shares[k] = 0
+            capital[k] = sell_capital
+            settled[k] = True
+            t += 1
+
+    if log is not None:
+        events.sort(key=lambda event: (event[0], event[1]))
+        log.extend(event[2] for event in events)
+
+
+def _advance_by_row(state, rows, next_buy, buy_columns, next_sell, sell_columns, stop_loss):
+    """
+    逐个交易日对全部策略做一次数组运算，用于策略数很多、不需要日志的参数扫描
+
+    判断口径与 advance_strategies 的逐策略跳转完全一致。
+    """
+    dates = rows['date']
+    next_open = rows['next_open']
+    position = state['position']
+    position_date = state['position_date']
+    buy_price = state['buy_price']
+    capital = state['capital']
+    shares = state['shares']
+    total_holding_days = state['total_holding_days']
+    settled = state['settled']
+
+    for t in range(len(dates)):
+        # 下一个上穿日等于当日，即当日上穿
+        buy_signal = ~position & (next_buy[t] == t)[buy_columns]
+        holding = position & (capital > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            current_return = np.where(buy_price != 0, (next_open[t] - buy_price) / buy_price, 0)
+        stop_loss_signal = holding & (current_return <= -stop_loss)
+        sell_signal = stop_loss_signal | (holding & (next_sell[t] == t)[sell_columns])
+
+        if buy_signal.any():
+            position[buy_signal] = True
+            position_date[buy_signal] = dates[t]
+            buy_price[buy_signal] = next_open[t]
+            shares[buy_signal] = capital[buy_signal] / next_open[t]
+
+        if sell_signal.any():
+            total_holding_days[sell_signal] += (dates[t] - position_date[sell_signal]).astype(np.int64)
+            capital[sell_signal] = shares[sell_signal] * next_open[t]
+            position[sell_signal] = False
+            buy_price[sell_signal] = 0
+            shares[sell_signal] = 0
+            settled[sell_signal] = True
+
+
+def close_positions(strategies, state, last_row, log=None):
+    """
+    对仍持仓的策略按最后一个交易日强制卖出
 
-            # 计算持有天数
-            holding_days = (last_row['日期'] - strategy['position_date']).days
+    不修改传入的状态，返回强制卖出后的状态副本，便于在持续推进的状态上计算当前结果。
 
-            strategy['total_holding_days'] += holding_days
+    Args:
+        strategies (list): 策略参数列表
+        state (dict): 回测状态
+        last_row (pandas.Series): 回测区间最后一行
+        log (list): 交易日志，为None时不记录日志
 
+    Returns:
+        dict: 强制卖出后的状态
+    """
+    closed = _copy_state(state)
+    if not closed['position'].any():
+        return closed
+
+    # 使用最后一日的下一日开盘价强制卖出，如果没有下一日开盘价，则使用当日收盘价
+    sell_price = last_row['next_开盘价'] if 'next_开盘价' in last_row else np.nan
+    if pd.isna(sell_price):
+        sell_price = last_row['收盘价']
+    last_date = np.datetime64(last_row['日期'], 'D')
+
+    for k in np.flatnonzero(closed['position']):
+        # 计算卖出后的资金
+        sell_capital = closed['shares'][k] * sell_price
+        # 计算持有天数
+        closed['total_holding_days'][k] += (last_date - closed['position_date'][k]).astype(np.int64)
+
+        if log is not None:
             # 添加强制卖出日志
-            force_sell_log = {
-                'date': last_row['日期'].strftime('%Y-%m-%d'),
-                'strategy_name': strategy['name'],
+            log.append({
+                'date': str(last_date),
+                'strategy_name': strategies[k]['name'],
                 'direction': 'force_sell',
                 'amount': sell_capital,
                 'price': sell_price,
                 'cash': sell_capital
-            }
-            log.append(force_sell_log)
+            })
+
+        # 重置状态
+        closed['position'][k] = False
+        closed['buy_price'][k] = 0
+        closed['shares'][k] = 0
+        closed['capital'][k] = sell_capital
+        closed['settled'][k] = True
+
+    return closed
+
+
+def summarize_strategies(strategies, state):
+    """
+    计算每个策略的统计结果，按策略收益率从高到低排序
+
+    Args:
+        strategies (list): 策略参数列表
+        state (dict): 强制卖出后的回测状态
+
+    Returns:
+        list: 统计结果
+    """
+    stat = []
+    if state['date_start'] is not None and state['date_end'] is not None:
+        strategy_duration = int((state['date_end'] - state['date_start']).astype(np.int64))
+    else:
+        strategy_duration = 0
+
+    for k, strategy in enumerate(strategies):
+        capital = _capital_value(state, k)
+        holding_days = int(state['total_holding_days'][k])
 
-            # 重置状态
-            strategy['position'] = False
-            strategy['position_date'] = None
-            strategy['buy_price'] = 0
-            strategy['shares'] = 0
-            strategy['capital'] = sell_capital
-
-    # 计算每个策略的最终年化收益率
-    for strategy in strategies:
         # 计算总收益：最终资本减去本金（100000）
-        total_return = strategy['capital'] - 100000
+        total_return = capital - INITIAL_CAPITAL
 
         # 总收益率 = 总收益 / 本金
-        total_rate = total_return / 100000
+        total_rate = total_return / INITIAL_CAPITAL
 
-        if (strategy['date_start'] is not None) and (strategy['date_end'] is not None) :
-            strategy_duration = (strategy['date_end'] - strategy['date_start']).days
-        else:
-            strategy_duration = 0
         # 综策略持续时间计算收益率。
         if strategy_duration > 0:
             strategy_duration_rate = total_rate/(strategy_duration/365)
@@ -287,24 +477,24 @@ def backtest_single_index(index_info):
 
         # 按持仓时间计算收益率
         annual_return = 0
-        if strategy['total_holding_days'] > 0:
+        if holding_days > 0:
             # 年化收益率 = (1 + 总收益率) ^ (365 / 持仓天数) - 1
             base = 1 + total_rate
             if base > 0:  # 只有当base为正数时才计算幂
-                annual_return = np.power(base, 365 / strategy['total_holding_days']) - 1
+                annual_return = np.power(base, 365 / holding_days) - 1
             else:
                 annual_return = 0  # 如果base为负数或零，则年化收益设为0
 
         # 策略持仓率
-        position_rate = strategy['total_holding_days'] / strategy_duration
+        position_rate = holding_days / strategy_duration
 
         strategy_stat = {
             'mode':strategy['mode'],
             'strategy_name': strategy['name'],
             'buy_threshold': strategy['buy_threshold'],
             'sell_threshold': strategy['sell_threshold'],
-            'holding_days': strategy['total_holding_days'],
-            'capital': strategy['capital'],
+            'holding_days': holding_days,
+            'capital': capital,
             'total_return': total_return,
             'total_rate':total_rate,
             'annual_return': annual_return,
@@ -318,4 +508,277 @@ def backtest_single_index(index_info):
     # 按年化收益从高到低排序
     stat.sort(key=lambda x: x['strategy_duration_rate'], reverse=True)
 
-    return log, stat
\ No newline at end of file
+    return stat
+
+
+def backtest_single_index(index_info, strategies=None):
+    """
+    对单个指数进行回测
+    
+    Args:
+        index_info (dict): 包含指数信息的字典
+        strategies (list): 策略参数列表，默认为 STRATEGIES
+        
+    Returns:
+        tuple: (回测日志, 统计结果)
+    """
+    log, stat, _ = resume_backtest(index_info, strategies=strategies)
+    return log, stat
+
+
+def strategies_signature(strategies):
+    """策略参数的哈希，策略或初始资金、默认止损线变化时检查点失效"""
+    text = json.dumps([INITIAL_CAPITAL, STOP_LOSS, strategies], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _slice_rows(rows, start, stop=None):
+    return {key: values[start:stop] for key, values in rows.items()}
+
+
+def _rows_digest(rows, count):
+    """前 count 个信号交易日的哈希，用于判断检查点之前的数据是否变化"""
+    digest = hashlib.sha256()
+    for key in sorted(rows):
+        digest.update(key.encode("utf-8"))
+        digest.update(np.ascontiguousarray(rows[key][:count]).tobytes())
+    return digest.hexdigest()
+
+
+def _valid_checkpoint(checkpoint, log, signature, rows, settled_rows):
+    if not checkpoint or checkpoint.get('signature') != signature:
+        return False
+    if checkpoint['rows'] > settled_rows or log is None or len(log) < checkpoint['log_rows']:
+        return False
+    return checkpoint['digest'] == _rows_digest(rows, checkpoint['rows'])
+
+
+def resume_backtest(index_info, checkpoint=None, log=None, strategies=None, pending_rows=PENDING_ROWS):
+    """
+    从检查点继续回测，只推进检查点之后的交易日
+
+    检查点保存推进到某个信号交易日为止的策略状态（持仓、份额、资金、持仓天数）和日志游标，
+    日志游标是当时交易日志的条数，检查点之前的日志就是上次返回的日志的开头部分。
+    最后 pending_rows 个信号交易日和强制卖出只在状态副本上计算，不写入检查点，
+    因此结果与从头回放完全一致。策略参数或检查点之前的数据变化时从头回放。
+
+    Args:
+        index_info (dict): 包含指数信息的字典
+        checkpoint (dict): 上次返回的检查点，为None时从头回放
+        log (list): 上次返回的回测日志，与 checkpoint 一起使用
+        strategies (list): 策略参数列表，默认为 STRATEGIES
+        pending_rows (int): 不计入检查点的最后信号交易日数
+
+    Returns:
+        tuple: (回测日志, 统计结果, 新的检查点)，数据不足时检查点为None
+    """
+    if strategies is None:
+        strategies = STRATEGIES
+
+    df_test = prepare_backtest_frame(index_info)
+    if df_test is None:
+        return [], [], None
+
+    df_test['next_开盘价'] = df_test['开盘价'].shift(-1)
+    rows = build_signal_rows(df_test)
+    signature = strategies_signature(strategies)
+    settled_rows = max(len(rows['date']) - pending_rows, 0)
+
+    if _valid_checkpoint(checkpoint, log, signature, rows, settled_rows):
+        start = checkpoint['rows']
+        state = _copy_state(checkpoint['state'])
+        log = log[:checkpoint['log_rows']]
+        logging.debug(f"{index_info['stockCode']} 从 {checkpoint['date']} 继续回测")
+    else:
+        start = 0
+        state = new_strategy_state(strategies)
+        log = []
+
+    advance_strategies(strategies, state, _slice_rows(rows, start, settled_rows), log)
+    checkpoint = {
+        'signature': signature,
+        'rows': settled_rows,
+        'digest': _rows_digest(rows, settled_rows),
+        'date': str(rows['date'][settled_rows - 1]) if settled_rows else None,
+        'state': state,
+        'log_rows': len(log),
+    }
+
+    # 最后几个交易日和仍持仓的策略（已买入但从未卖出的情况）只在副本上处理
+    view = _copy_state(state)
+    view_log = list(log)
+    advance_strategies(strategies, view, _slice_rows(rows, settled_rows), view_log)
+    closed = close_positions(strategies, view, df_test.iloc[-1], view_log)
+
+    stat = summarize_strategies(strategies, closed)
+    return view_log, stat, checkpoint
+
+
+# 参数扫描中各模式对应的策略名称后缀
+MODE_SUFFIX = {"fundamental": "估值线", "bollinger": "布林线"}
+
+
+def build_sweep_strategies(buy_range, sell_range, step, stop_losses=(STOP_LOSS,), modes=("fundamental", "bollinger")):
+    """
+    生成参数扫描的策略组合
+
+    买入、卖出阈值按步长在区间内（含两端）取值，只保留卖出阈值大于买入阈值的组合。
+    有多条止损线时策略名称带上止损线（如 20-80-sl15），名称在组合之间唯一。
+
+    Args:
+        buy_range (tuple): 买入阈值区间 (最小值, 最大值)
+        sell_range (tuple): 卖出阈值区间 (最小值, 最大值)
+        step (float): 阈值步长，例如0.01
+        stop_losses (tuple): 止损线列表
+        modes (tuple): 回测模式，fundamental 和/或 bollinger
+
+    Returns:
+        list: 策略参数列表
+    """
+    unknown_modes = [mode for mode in modes if mode not in MODE_SUFFIX]
+    if unknown_modes:
+        raise ValueError(f"未知的回测模式: {unknown_modes}")
+    if step <= 0:
+        raise ValueError("步长必须大于0")
+
+    # 阈值四舍五入，避免浮点累加误差产生 0.15000000000000002 之类的阈值
+    buy_values = np.round(np.arange(buy_range[0], buy_range[1] + step / 2, step), 6)
+    sell_values = np.round(np.arange(sell_range[0], sell_range[1] + step / 2, step), 6)
+
+    strategies = []
+    for mode in modes:
+        for stop_loss in stop_losses:
+            stop_loss_suffix = f"-sl{stop_loss * 100:g}" if len(stop_losses) > 1 else ""
+            for buy_threshold in buy_values:
+                for sell_threshold in sell_values[sell_values > buy_threshold]:
+                    strategies.append({
+                        'buy_threshold': float(buy_threshold),
+                        'sell_threshold': float(sell_threshold),
+                        'stop_loss': float(stop_loss),
+                        'name': f"{buy_threshold * 100:g}-{sell_threshold * 100:g}{stop_loss_suffix}{MODE_SUFFIX[mode]}",
+                        'mode': mode,
+                    })
+    return strategies
+
+
+def summarize_sweep(strategies, state):
+    """
+    以数组形式计算参数扫描结果，口径与 summarize_strategies 相同
+
+    Args:
+        strategies (list): 策略参数列表
+        state (dict): 强制卖出后的回测状态
+
+    Returns:
+        dict: 结果矩阵，每个键对应一列，行与策略一一对应
+    """
+    is_fundamental, buy_threshold, sell_threshold, stop_loss = _strategy_arrays(strategies)
+    strategy_duration = int((state['date_end'] - state['date_start']).astype(np.int64))
+    holding_days = state['total_holding_days']
+    total_rate = (state['capital'] - INITIAL_CAPITAL) / INITIAL_CAPITAL
+
+    if strategy_duration > 0:
+        strategy_duration_rate = total_rate / (strategy_duration / 365)
+        position_rate = holding_days / strategy_duration
+    else:
+        strategy_duration_rate = np.zeros(len(strategies))
+        position_rate = np.zeros(len(strategies))
+
+    base = 1 + total_rate
+    valid = (holding_days > 0) & (base > 0)
+    annual_return = np.zeros(len(strategies))
+    annual_return[valid] = np.power(base[valid], 365 / holding_days[valid]) - 1
+
+    return {
+        'mode': np.where(is_fundamental, "fundamental", "bollinger"),
+        'buy_threshold': buy_threshold.astype(np.float32),
+        'sell_threshold': sell_threshold.astype(np.float32),
+        'stop_loss': stop_loss.astype(np.float32),
+        'holding_days': holding_days.astype(np.int32),
+        'capital': state['capital'].astype(np.float32),
+        'annual_return': annual_return.astype(np.float32),
+        'strategy_duration': strategy_duration,
+        'strategy_duration_rate': strategy_duration_rate.astype(np.float32),
+        'position_rate': position_rate.astype(np.float32),
+    }
+
+
+def sweep_single_index(index_info, buy_range=(0.05, 0.50), sell_range=(0.30, 0.95), step=0.01,
+                       stop_losses=(STOP_LOSS,), modes=("fundamental", "bollinger")):
+    """
+    对单个指数做买卖阈值的参数扫描
+
+    信号只计算一次，所有阈值组合在同一个回测引擎中批量推进，不记录交易日志。
+
+    Args:
+        index_info (dict): 包含指数信息的字典
+        buy_range (tuple): 买入阈值区间
+        sell_range (tuple): 卖出阈值区间
+        step (float): 阈值步长
+        stop_losses (tuple): 止损线列表
+        modes (tuple): 回测模式
+
+    Returns:
+        dict: summarize_sweep 返回的结果矩阵，数据不足时返回None
+    """
+    strategies = build_sweep_strategies(buy_range, sell_range, step, stop_losses, modes)
+
+    df_test = prepare_backtest_frame(index_info)
+    if df_test is None or not strategies:
+        return None
+
+    df_test['next_开盘价'] = df_test['开盘价'].shift(-1)
+    rows = build_signal_rows(df_test)
+    if len(rows['date']) == 0:
+        return None
+
+    state = new_strategy_state(strategies)
+    advance_strategies(strategies, state, rows)
+    closed = close_positions(strategies, state, df_test.iloc[-1])
+    return summarize_sweep(strategies, closed)
+
+
+def aggregate_sweep(sweep, min_position_rate=0.15):
+    """
+    汇总参数扫描结果，供首页使用
+
+    口径与首页对 backtest_stat 的汇总一致：先求持仓率大于 min_position_rate 的策略收益均值，
+    再对收益高于该均值的策略求平均买入、卖出阈值和平均收益；另外给出收益最高的组合及其止损线。
+
+    Args:
+        sweep (dict): sweep_single_index 返回的结果矩阵
+        min_position_rate (float): 参与计算收益均值的最低持仓率
+
+    Returns:
+        dict: 首页条目中以 sweep_ 开头的字段
+    """
+    entry = {}
+    for mode in MODE_SUFFIX:
+        mask = sweep['mode'] == mode
+        rate = sweep['strategy_duration_rate'][mask].astype(float)
+        position_rate = sweep['position_rate'][mask]
+        # 阈值以float32保存，还原为步长精度的小数
+        buy_threshold = np.round(sweep['buy_threshold'][mask].astype(float), 6)
+        sell_threshold = np.round(sweep['sell_threshold'][mask].astype(float), 6)
+        stop_loss = np.round(sweep['stop_loss'][mask].astype(float), 6)
+
+        active = position_rate > min_position_rate
+        rate_mean = mean_with_default(rate[active])
+        high = rate > rate_mean
+
+        entry[f"sweep_{mode}_rate"] = float(mean_with_default(rate[high]))
+        entry[f"sweep_{mode}_buy_price"] = float(mean_with_default(buy_threshold[high]))
+        entry[f"sweep_{mode}_sell_price"] = float(mean_with_default(sell_threshold[high]))
+
+        if active.any():
+            best = np.flatnonzero(active)[np.argmax(rate[active])]
+            entry[f"sweep_{mode}_best_buy"] = float(buy_threshold[best])
+            entry[f"sweep_{mode}_best_sell"] = float(sell_threshold[best])
+            entry[f"sweep_{mode}_best_stop_loss"] = float(stop_loss[best])
+            entry[f"sweep_{mode}_best_rate"] = float(rate[best])
+        else:
+            entry[f"sweep_{mode}_best_buy"] = None
+            entry[f"sweep_{mode}_best_sell"] = None
+            entry[f"sweep_{mode}_best_stop_loss"] = None
+            entry[f"sweep_{mode}_best_rate"] = None
+    return entry
@@ -6,145 +6,418 @@
 该模块负责将处理后的数据导出为JSON格式，供前端使用。
 """
 
+import os
+import gzip
+import shutil
 import json
+import filecmp
+import hashlib
+import inspect
 import logging
 import pandas as pd
 import numpy as np
-import pickle
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:  # orjson 是可选依赖，未安装时使用标准库 json
+    orjson = None
 
-def mean_with_default(arr, default_value=0):
+try:
+    import brotli
+except ImportError:  # brotli 是可选依赖，只在配置了 "br" 时使用，未安装时只生成 gzip 压缩文件
+    brotli = None
+
+from modules.data_manager import index_data_digest
+
+
+# 导出代码的版本：本模块源码的哈希，修改导出格式后所有指数都会重新导出
+CODE_VERSION = hashlib.sha256(Path(__file__).read_bytes()).hexdigest()[:16]
+
+
+def code_version(*functions):
     """
-    计算数组均值，如果数组为空则返回默认值
-    
+    导出代码的版本：CODE_VERSION 加上调用方中同样决定导出内容的函数的源码
+
     Args:
-        arr: 输入数组
-        default_value: 默认值
-        
+        functions: 在本模块之外整理导出数据的函数
+
     Returns:
-        数组均值或默认值
+        str: 十六进制哈希值
     """
-    if len(arr) == 0:
-        return default_value
-    mean_value = np.mean(arr)
-    return mean_value if not np.isnan(mean_value) else default_value
+    digest = hashlib.sha256(CODE_VERSION.encode("utf-8"))
+    for function in functions:
+        digest.update(inspect.getsource(function).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+# 首屏加载的最近数据行数，约为一年的交易日
+RECENT_ROWS = 250
+
+# 导出数据的小数位数，未列出的数值列默认保留 DEFAULT_PRECISION 位
+DEFAULT_PRECISION = 4
+COLUMN_PRECISION = {
+    'volume': 0,
+    'amount': 0,
+    'change': 6,
+}
+
+
+# 预压缩文件的压缩级别：每次构建只压缩一次，使用最高级别换取最小的传输量
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# 导出时生成的预压缩格式，可以通过 configure_precompress 修改。
+# 前端只请求 .gz（DecompressionStream('gzip')），.br 只供自行配置的静态服务器使用，压缩很慢，默认不生成
+PRECOMPRESS = ("gz",)
+# 只为不小于这个大小（字节）的文件生成预压缩文件，如 home.json、companies.json 和历史数据。
+# 小文件由边缘节点按需压缩即可，不必让部署的文件数翻倍；前端找不到 .gz 时直接加载JSON
+PRECOMPRESS_MIN_BYTES = 128 * 1024
 
 
-def export_index_to_js(index_info, output_dir):
+def configure_precompress(formats, min_bytes=PRECOMPRESS_MIN_BYTES):
     """
-    将单个指数数据导出为JS格式
-    
+    设置导出时生成的预压缩格式
+
     Args:
-        index_info (dict): 包含指数信息的字典
-        output_dir (Path): 输出目录路径
+        formats (list): "gz"、"br" 的组合，空列表表示不生成压缩文件
+        min_bytes (int): 只为不小于这个大小（字节）的文件生成预压缩文件
     """
-    # 定义中文列名到英文列名的映射
-    column_mapping = {
-        '日期': 'date',
-        '开盘价': 'open',
-        '收盘价': 'close',
-        '最低价': 'low',
-        '最高价': 'high',
-        '成交量': 'volume',
-        '涨跌幅': 'change',
-        '成交额': 'amount',
-        '市盈率': 'pe_ttm',
-        '市净率': 'pb',
-        '股息率': 'dyr',
-        '股票代码': 'stockCode',
-        '5日均线': 'ma5',
-        '10日均线': 'ma10',
-        '20日均线': 'ma20',
-        '30日均线': 'ma30',
-        '60日均线': 'ma60',
-        '120日均线': 'ma120',
-        '250日均线': 'ma250',
-        '布林线中轨': 'bb_middle',
-        '布林线上轨': 'bb_upper',
-        '布林线下轨': 'bb_lower',
-        '布林线位置': 'bb_position',
-        '市盈率百分位': 'pe_percentile',
-        '市净率百分位': 'pb_percentile',
-        '股息率收益率': 'dyr_percentile',
-        '估值百分位': 'valuation_percentile'
+    global PRECOMPRESS, PRECOMPRESS_MIN_BYTES
+    PRECOMPRESS = tuple(formats)
+    PRECOMPRESS_MIN_BYTES = min_bytes
+    if "br" in PRECOMPRESS and brotli is None:
+        logging.warning("配置了 br 预压缩格式，但未安装 brotli，只生成 gzip 压缩文件")
+
+
+def _compress(data, fmt):
+    if fmt == "gz":
+        # mtime 固定为0，相同内容总是得到相同的压缩文件
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    return brotli.compress(data, quality=BROTLI_QUALITY)
+
+
+def precompressed_paths(path):
+    """
+    当前配置下已写入的 path 对应的预压缩文件路径
+
+    未安装 brotli 时不包含 .br；小于 PRECOMPRESS_MIN_BYTES 的文件没有预压缩文件。
+    """
+    if path.stat().st_size < PRECOMPRESS_MIN_BYTES:
+        return []
+    return [path.with_name(f"{path.name}.{fmt}") for fmt in PRECOMPRESS
+            if fmt != "br" or brotli is not None]
+
+
+def write_precompressed(path, force=False):
+    """
+    为 path 生成预压缩文件（<name>.gz，配置了 br 时还有 <name>.br），静态服务器可以直接返回，不需要每次请求时压缩
+
+    Args:
+        path (Path): 已写入的文件路径
+        force (bool): 为True时覆盖已有的压缩文件，否则只生成缺失的压缩文件
+    """
+    wanted = precompressed_paths(path)
+    # 文件变小或修改了配置后，删除不再需要的压缩文件，避免前端加载到过期的内容
+    for fmt in ("gz", "br"):
+        target = path.with_name(f"{path.name}.{fmt}")
+        if target not in wanted and target.exists():
+            target.unlink()
+    targets = [target for target in wanted if force or not target.exists()]
+    if not targets:
+        return
+    data = path.read_bytes()
+    for target in targets:
+        temp_path = target.with_name(target.name + ".tmp")
+        temp_path.write_bytes(_compress(data, target.suffix[1:]))
+        os.replace(temp_path, target)
+
+
+def dumps(data):
+    """序列化为紧凑的JSON字符串，安装了 orjson 时使用 orjson"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY).decode("utf-8")
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def _dump_column(values, precision):
+    """将数值列按固定小数位数序列化为JSON数组，NaN 输出为 null"""
+    rounded = np.round(values.to_numpy(dtype=float), precision)
+    missing = np.isnan(rounded)
+    if precision == 0:
+        if not missing.any():
+            return dumps(rounded.astype(np.int64) if orjson is not None else rounded.astype(np.int64).tolist())
+        return dumps([None if value != value else int(value) for value in rounded.tolist()])
+    if orjson is not None:
+        # orjson 将数组中的 NaN 输出为 null，不需要转换为Python列表
+        return dumps(rounded)
+    return dumps([None if value != value else value for value in rounded.tolist()])
+
+
+def write_columnar(f, df, constants=None):
+    """
+    将DataFrame以按列存储的紧凑格式写入文件，供 fund.html 加载
+
+    逐列序列化后直接写入文件，不构造整个文件的中间对象，内存占用与单列大小相当。
+
+    格式:
+        {
+            "format": "columnar",
+            "length": 行数,
+            "date": {"base": 首个日期, "offsets": 每行相对首个日期的天数},
+            "constants": {所有行取值相同的非数值列: 值},
+            "columns": {列名: 按行排列的值}
+        }
+
+    Args:
+        f: 以文本模式打开的文件
+        df (pandas.DataFrame): 列名已转换为英文、包含 date 列的数据
+        constants (dict): 不在数据中的常量列，如保存在元数据中的 stockCode
+    """
+    dates = pd.to_datetime(df['date']).to_numpy(dtype='datetime64[D]')
+    date = {
+        "base": str(dates[0]) if len(dates) else None,
+        "offsets": (dates - dates[0]).astype(np.int64).tolist() if len(dates) else [],
     }
+    f.write(f'{{"format":"columnar","length":{len(df)},"date":')
+    f.write(dumps(date))
 
-    # 创建一个副本以避免修改原始数据
-    df = index_info["dataframe"].copy()
+    constants = dict(constants or {})
+    columns = []
+    for column in df.columns:
+        if column == 'date':
+            continue
+        values = df[column]
+        if not pd.api.types.is_numeric_dtype(values) and len(values) and values.nunique(dropna=False) == 1:
+            # 如股票代码，每行都相同，只保存一次
+            constants[column] = values.iloc[0]
+        else:
+            columns.append(column)
+    f.write(',"constants":')
+    f.write(dumps(constants))
 
-    # 重命名列名为英文
-    df.rename(columns=column_mapping, inplace=True)
+    f.write(',"columns":{')
+    for position, column in enumerate(columns):
+        if position:
+            f.write(',')
+        values = df[column]
+        f.write(dumps(column))
+        f.write(':')
+        if pd.api.types.is_numeric_dtype(values):
+            f.write(_dump_column(values, COLUMN_PRECISION.get(column, DEFAULT_PRECISION)))
+        else:
+            f.write(dumps([None if pd.isna(value) else value for value in values]))
+    f.write('}}')
 
-    # 导出为JSON格式
-    index_info["dataframe"] = json.loads(df.to_json(orient="records", indent=4))
-    
-    with open(output_dir.joinpath(f"{index_info['stockCode']}.json"), "w", encoding="utf-8") as f:
-        json.dump(index_info, f, ensure_ascii=False, indent=4)
 
+def write_if_changed(path, write, compress=False):
+    """
+    先写入临时文件，内容与现有文件不同时才原子地替换，相同时保留原文件及其修改时间
 
-def export_home_data(index_list, data_dir, output_dir):
+    Args:
+        path (Path): 目标文件路径
+        write: 接收文本文件对象并写入内容的函数
+        compress (bool): 是否同时生成预压缩文件，见 write_precompressed
+
+    Returns:
+        bool: 文件是否被改写
     """
-    导出首页数据
-    
+    temp_path = path.with_name(path.name + ".tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        write(f)
+    changed = not (path.exists() and filecmp.cmp(temp_path, path, shallow=False))
+    if changed:
+        os.replace(temp_path, path)
+    else:
+        temp_path.unlink()
+    if compress:
+        write_precompressed(path, force=changed)
+    return changed
+
+
+def write_columnar_file(path, df, constants=None):
+    return write_if_changed(path, lambda f: write_columnar(f, df, constants), compress=True)
+
+
+def write_json(path, data):
+    """以紧凑格式（无缩进）写入JSON文件，内容未变化时不改写"""
+    return write_if_changed(path, lambda f: f.write(dumps(data)), compress=True)
+
+
+def export_digest(stockCode, data_dir, column_mapping, version=CODE_VERSION):
+    """
+    单个指数导出结果的哈希：由已保存的数据、导出代码版本和列名映射决定
+
     Args:
-        index_list (list): 指数列表
+        stockCode (str): 指数代码
         data_dir (Path): 数据目录路径
+        column_mapping (dict): 中文列名到英文列名的映射
+        version (str): 导出代码版本，调用方也整理导出数据时由 code_version 计算
+
+    Returns:
+        str: 十六进制哈希值
+    """
+    digest = hashlib.sha256(version.encode("utf-8"))
+    digest.update(json.dumps(column_mapping, ensure_ascii=False).encode("utf-8"))
+    digest.update(index_data_digest(stockCode, data_dir).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def index_outputs_exist(stockCode, output_dir):
+    """单个指数的元数据文件及其列出的所有分片文件（包括预压缩文件）是否都存在"""
+    meta_path = output_dir.joinpath(f"{stockCode}.json")
+    if not meta_path.exists():
+        return False
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            chunks = json.load(f).get("chunks")
+    except ValueError:
+        return False
+    if not chunks:
+        return False
+    paths = [meta_path] + [output_dir.joinpath(path) for path in [chunks["recent"], chunks["backtest"], *chunks["history"]]]
+    return all(path.exists() and all(target.exists() for target in precompressed_paths(path)) for path in paths)
+
+
+def load_export_manifest(path):
+    """
+    读取导出清单，记录上次导出时每个指数的导出哈希
+
+    Returns:
+        dict: stockCode -> 导出哈希；文件不存在或无法读取时为空字典
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        logging.warning(f"导出清单 {path} 无法读取，全部重新导出: {e}")
+        return {}
+    return manifest.get("indices", {})
+
+
+def save_export_manifest(path, digests, version=CODE_VERSION):
+    """
+    保存导出清单
+
+    Args:
+        path (Path): 清单文件路径
+        digests (dict): stockCode -> 导出哈希
+        version (str): 导出代码版本
+    """
+    write_if_changed(path, lambda f: json.dump({"code_version": version, "indices": digests},
+                                               f, ensure_ascii=False, indent=4, sort_keys=True))
+
+
+def write_index_files(index_info, df, output_dir, recent_rows=RECENT_ROWS):
+    """
+    将单个指数的导出数据拆分为多个文件，fund.html 先加载元数据和最近的数据，其余按需加载
+
+    - <code>.json: 指数元数据、成分股、跟踪基金，以及其余文件的清单（chunks）
+    - <code>/recent.json: 最近 recent_rows 行数据
+    - <code>/history.json: 最近窗口之前的全部历史数据，只在查看更早的数据时加载
+    - <code>/backtest.json: 回测日志和统计
+
+    静态托管对一次部署的文件数有上限（如 Cloudflare Pages 免费版为20000个），因此历史数据只保存为一个文件，
+    每个指数最多4个文件。每个文件都只在内容变化时才原子地改写，较大的文件另生成预压缩文件（见 write_precompressed）。
+
+    Args:
+        index_info (dict): 指数信息
+        df (pandas.DataFrame): 列名已转换为英文的数据
         output_dir (Path): 输出目录路径
+        recent_rows (int): 最近窗口的行数
     """
-    result = []
+    stockCode = index_info['stockCode']
+    chunk_dir = output_dir.joinpath(stockCode)
+    chunk_dir.mkdir(parents=True, exist_ok=True)
 
-    for index in index_list:
-        with open(data_dir.joinpath(f"{index['stockCode']}.pickle"), "rb") as f:
-            index_info = pickle.load(f)
+    # 股票代码不保存在数据中，导出时作为常量列写入每个分片
+    constants = {"stockCode": stockCode}
+    split = max(len(df) - recent_rows, 0)
+    written = {"recent.json", "backtest.json"}
+    history_files = []
+    if split > 0:
+        write_columnar_file(chunk_dir.joinpath("history.json"), df.iloc[:split], constants)
+        written.add("history.json")
+        history_files.append(f"{stockCode}/history.json")
 
-        df = index_info["dataframe"]
-        entry = df.to_dict('records')[-1]
+    write_columnar_file(chunk_dir.joinpath("recent.json"), df.iloc[split:], constants)
+    write_json(chunk_dir.joinpath("backtest.json"), {
+        "backtest_log": index_info.get("backtest_log", []),
+        "backtest_stat": index_info.get("backtest_stat", []),
+    })
 
-        entry["tracking_fund_count"] = len(index_info.get("tracking_fund", []))
-        entry["name"] = index_info["name"]
+    # 删除不再需要的旧分片、预压缩文件和中断时残留的临时文件
+    for path in chunk_dir.glob("*.json*"):
+        base = path.name[:path.name.index(".json") + len(".json")]
+        if path.suffix == ".tmp" or base not in written:
+            path.unlink()
+
+    meta = {key: value for key, value in index_info.items()
+            if key not in ("dataframe", "backtest_log", "backtest_stat")}
+    meta["chunks"] = {
+        "length": len(df),
+        "recent": f"{stockCode}/recent.json",
+        "history": history_files,
+        "backtest": f"{stockCode}/backtest.json",
+    }
+    write_json(output_dir.joinpath(f"{stockCode}.json"), meta)
 
-        # 安全地获取回测统计数据，如果不存在则使用空列表
-        backtest_stat = index_info.get("backtest_stat", [])
 
-        # 分类策略状态
-        fundamental_stat  = [stat for stat in backtest_stat if stat["mode"] == "fundamental"]
-        bollinger_stat = [stat for stat in backtest_stat if stat["mode"] == "bollinger"]
+def remove_stale_outputs(stockCodes, output_dir, shared=("home", "companies")):
+    """
+    删除不在 stockCodes 中的指数的导出文件（<code>.json*、<code>/），如周度筛选后被移除的指数
 
-        # 求2种估值的年化收益中位数，去掉持仓小于15%的。
-        fundamental_rate = [stat["strategy_duration_rate"] for stat in fundamental_stat if stat["position_rate"] > 0.15]
-        bollinger_rate = [stat["strategy_duration_rate"] for stat in bollinger_stat if stat["position_rate"] > 0.15]
-        fundamental_rate_median = mean_with_default(fundamental_rate)
-        bollinger_rate_median = mean_with_default(bollinger_rate)
+    output_dir 在持续集成中从缓存恢复，不会每次重新生成，不清理时已移除的指数会一直被部署。
 
-        # 过滤出收益大于中位数的策略
-        high_fundamental_stat = [stat for stat in fundamental_stat if stat["strategy_duration_rate"] > fundamental_rate_median]
-        high_bollinger_stat = [stat for stat in bollinger_stat if stat["strategy_duration_rate"] > bollinger_rate_median]
+    Args:
+        stockCodes (iterable): 本次导出的指数代码
+        output_dir (Path): 输出目录路径
+        shared (tuple): 所有指数共用的文件名（不含扩展名），不会被删除
 
-        # 求这些策略的平均买入、卖出价格
-        high_fundamental_buy_price = mean_with_default([stat["buy_threshold"] for stat in high_fundamental_stat])
-        high_fundamental_sell_price = mean_with_default([stat["sell_threshold"] for stat in high_fundamental_stat])
-        high_bollinger_buy_price = mean_with_default([stat["buy_threshold"] for stat in high_bollinger_stat])
-        high_bollinger_sell_price = mean_with_default([stat["sell_threshold"] for stat in high_bollinger_stat])
+    Returns:
+        int: 删除的指数个数
+    """
+    keep = set(stockCodes)
+    removed = set()
+    for path in output_dir.iterdir():
+        if path.is_dir():
+            stockCode = path.name
+        elif ".json" in path.name:
+            stockCode = path.name[:path.name.index(".json")]
+        else:
+            continue
+        if stockCode in keep or stockCode in shared:
+            continue
+        if path.is_dir():
+            shutil.rmtree(path)
+        else:
+            path.unlink()
+        removed.add(stockCode)
+    if removed:
+        logging.info(f"删除 {len(removed)} 个已不在指数列表中的指数的导出文件: {sorted(removed)}")
+    return len(removed)
 
-        # 平均收益率
-        high_fundamental_rate_mean = mean_with_default([stat["strategy_duration_rate"] for stat in high_fundamental_stat])
-        high_bollinger_rate_mean = mean_with_default([stat["strategy_duration_rate"] for stat in high_bollinger_stat])
 
-        entry["fundamental_rate"] = high_fundamental_rate_mean
-        entry["bollinger_rate"] = high_bollinger_rate_mean
-        entry["fundamental_buy_price"] = high_fundamental_buy_price
-        entry["fundamental_sell_price"] = high_fundamental_sell_price
-        entry["bollinger_buy_price"] = high_bollinger_buy_price
-        entry["bollinger_sell_price"] = high_bollinger_sell_price
+def write_company_table(index_list, company_index, output_dir):
+    """
+    导出成分股公司信息表 companies.json，各指数的成分股只保存 stockCode 和少量字段（默认为名称），其余字段由前端按 stockCode 关联
 
-        result.append(entry)
+    只导出被至少一个指数引用的公司。
 
-    # 处理NaN值，避免JSON序列化错误
-    for item in result:
-        for key, value in item.items():
-            if isinstance(value, float) and np.isnan(value):
-                item[key] = None
+    Args:
+        index_list (list): 指数列表
+        company_index (DictIndex): 按 stockCode 建立的公司信息索引，字段已按配置投影
+        output_dir (Path): 输出目录路径
 
-    with open(output_dir.joinpath("home.json"), "w", encoding="utf-8") as f:
-        json.dump(result, f, ensure_ascii=False, indent=4)
\ No newline at end of file
+    Returns:
+        bool: 文件是否被改写
+    """
+    stockCodes = sorted({item["stockCode"] for index in index_list
+                         for item in index.get("constituent_weightings", []) if item["stockCode"] in company_index})
+    table = {}
+    for stockCode in stockCodes:
+        company = company_index.get(stockCode)
+        company.pop("stockCode")
+        table[stockCode] = company
+    return write_json(output_dir.joinpath("companies.json"), table)
@@ -6,9 +6,119 @@
 该模块负责数据的保存和加载操作。
 """
 
+import os
 import json
+import pickle
+import hashlib
 import pathlib
 import logging
+import threading
+from collections import OrderedDict
+
+import pyarrow as pa
+import pyarrow.feather as feather
+
+try:
+    import ijson
+except ImportError:  # ijson 是可选依赖，未安装时 JSON 数组文件整体解析，JSONL 文件始终逐行读取
+    ijson = None
+
+# 运行期缓存的默认内存上限（字节）
+DEFAULT_CACHE_BUDGET = 512 * 2 ** 20
+# 解析后的记录列表占用的内存约为JSON文本大小的倍数，用于估算缓存占用
+RECORDS_MEMORY_FACTOR = 8
+
+
+class RunCache:
+    """
+    运行期内共享的 LRU 缓存，按估算的内存占用淘汰最久未使用的条目。
+
+    每个条目带有版本（通常是文件的修改时间和大小），读取时版本不一致视为未命中，
+    因此文件被其他进程改写后不会读到旧数据。可以在多个线程中使用。
+
+    缓存只在本进程内有效。指数数据（时间序列）只在 daily.py 以 --workers 1 在当前进程中执行各阶段时缓存；
+    进程池中执行时（包括默认的融合模式）每个进程只缓存记录列表（configure_cache 的 frames=False）。
+    融合模式下一个指数的抓取、计算、回测和导出本来就在同一个进程内传递同一个 DataFrame，不需要缓存。
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BUDGET):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        """返回缓存的值，未命中或版本不一致时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, value, size):
+        """
+        缓存一个值，超过内存上限时淘汰最久未使用的条目
+
+        Args:
+            key: 缓存键
+            version: 值的版本，get 时必须一致
+            value: 缓存的值，调用方不应再修改
+            size (int): 估算的内存占用（字节）
+        """
+        with self._lock:
+            self._discard(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (version, value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def resize(self, max_bytes):
+        """修改内存上限，0 表示不缓存"""
+        with self._lock:
+            self.max_bytes = max_bytes
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def log_stats(self, name="运行期缓存"):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total else 0
+        logging.info(f"{name}: 命中 {self.hits} 次，未命中 {self.misses} 次（命中率 {hit_rate:.1f}%），"
+                     f"淘汰 {self.evictions} 个条目，当前 {len(self._entries)} 个条目共 {self._bytes / 2 ** 20:.1f} MB")
+
+
+# 本进程共享的运行期缓存，保存已解析的记录列表和最近使用的指数数据
+RUN_CACHE = RunCache()
+# 是否缓存指数数据；各阶段在进程池中执行时，同一个指数不会在同一进程中再次读取，只需缓存记录列表，
+# 因此只有所有阶段都在当前进程中执行（--workers 1）时才缓存指数数据
+CACHE_FRAMES = True
+
+
+def configure_cache(max_bytes, frames=True):
+    """设置运行期缓存的内存上限（字节），0 表示不缓存；frames 为False时只缓存记录列表"""
+    global CACHE_FRAMES
+    RUN_CACHE.resize(max_bytes)
+    CACHE_FRAMES = frames
 
 
 def save_data_to_json(data, file_path, encoding="utf-8"):
@@ -48,4 +158,327 @@ def load_data_from_json(file_path, encoding="utf-8"):
         raise
     except Exception as e:
         logging.error(f"从 {file_path} 加载数据时出错: {e}")
-        raise
\ No newline at end of file
+        raise
+
+
+def records_path(file_path):
+    """
+    记录列表文件的实际路径：同名的 .jsonl 文件存在且不比 .json 文件旧时使用 .jsonl 文件
+
+    Args:
+        file_path: 文件路径，.json 或 .jsonl
+
+    Returns:
+        pathlib.Path: 实际读取的文件路径
+    """
+    file_path = pathlib.Path(file_path)
+    jsonl_path = file_path.with_suffix(".jsonl")
+    if file_path.suffix == ".json" and jsonl_path.exists():
+        if not file_path.exists() or jsonl_path.stat().st_mtime_ns >= file_path.stat().st_mtime_ns:
+            return jsonl_path
+    return file_path
+
+
+def iter_records(file_path, encoding="utf-8"):
+    """逐条读取记录列表文件（cn_index.json、cn_company.json 等）。
+
+    JSONL 文件逐行解析；JSON 数组文件在安装了 ijson 时流式解析，否则整体解析后逐条返回。
+
+    Args:
+        file_path: 文件路径，同名 .jsonl 文件较新时读取 .jsonl 文件
+        encoding: 文件编码，默认为utf-8
+
+    Yields:
+        dict: 单条记录
+    """
+    path = records_path(file_path)
+    if path.suffix == ".jsonl":
+        with open(path, "r", encoding=encoding) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif ijson is not None:
+        with open(path, "rb") as f:
+            # use_float 使数值解析为 float 而不是 Decimal，与 json.load 一致
+            yield from ijson.items(f, "item", use_float=True)
+    else:
+        with open(path, "r", encoding=encoding) as f:
+            yield from json.load(f)
+
+
+def load_records(file_path, encoding="utf-8"):
+    """读取记录列表文件，解析结果保存在运行期缓存中，文件未变化时不重复解析。
+
+    返回的列表和其中的字典都是新的浅拷贝，调用方可以添加字段（如 dataframe）而不影响缓存。
+
+    Args:
+        file_path: 文件路径，同名 .jsonl 文件较新时读取 .jsonl 文件
+        encoding: 文件编码，默认为utf-8
+
+    Returns:
+        list: 记录列表
+    """
+    path = records_path(file_path)
+    stat = path.stat()
+    key = ("records", str(path.resolve()))
+    version = (stat.st_mtime_ns, stat.st_size)
+    records = RUN_CACHE.get(key, version)
+    if records is None:
+        records = list(iter_records(path, encoding))
+        RUN_CACHE.put(key, version, records, stat.st_size * RECORDS_MEMORY_FACTOR)
+        logging.info(f"成功从 {path} 加载 {len(records)} 条记录")
+    return [dict(record) for record in records]
+
+
+def save_records(records, file_path, encoding="utf-8"):
+    """逐条写入记录列表文件，不在内存中构造整个文件的文本。
+
+    .jsonl 文件每行一条记录；.json 文件的内容与 save_data_to_json 相同（缩进4个空格的数组）。
+
+    Args:
+        records: 记录列表或逐条产生记录的迭代器
+        file_path: 文件路径，按扩展名决定格式
+        encoding: 文件编码，默认为utf-8
+
+    Returns:
+        int: 写入的记录数
+    """
+    file_path = pathlib.Path(file_path)
+    count = 0
+
+    def write(path):
+        nonlocal count
+        with open(path, "w", encoding=encoding) as f:
+            if file_path.suffix == ".jsonl":
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False))
+                    f.write("\n")
+                    count += 1
+                return
+            for record in records:
+                f.write(",\n" if count else "[\n")
+                text = json.dumps(record, indent=4, ensure_ascii=False)
+                f.write("\n".join("    " + line for line in text.split("\n")))
+                count += 1
+            f.write("\n]" if count else "[]")
+
+    _replace_atomically(file_path, write)
+    logging.info(f"{count} 条记录已成功保存到 {file_path}")
+    return count
+
+
+def index_data_path(data_dir, stockCode):
+    """指数时间序列文件路径（Feather 列式格式）"""
+    return pathlib.Path(data_dir).joinpath(f"{stockCode}.feather")
+
+
+def index_meta_path(data_dir, stockCode):
+    """指数元数据文件路径（成分股、跟踪基金、回测结果等）"""
+    return pathlib.Path(data_dir).joinpath(f"{stockCode}.meta.pickle")
+
+
+def legacy_pickle_path(data_dir, stockCode):
+    """旧版数据文件路径，DataFrame 与元数据保存在同一个 pickle 中"""
+    return pathlib.Path(data_dir).joinpath(f"{stockCode}.pickle")
+
+
+def _replace_atomically(path, write):
+    # 先写临时文件再替换，避免中途失败留下损坏的文件
+    temp_path = path.with_name(path.name + ".tmp")
+    write(temp_path)
+    os.replace(temp_path, path)
+
+
+def _index_cache_key(data_dir, stockCode):
+    return ("index", str(pathlib.Path(data_dir).resolve()), stockCode)
+
+
+def _index_version(data_dir, stockCode):
+    """列式数据文件和元数据文件的 (修改时间, 大小)，文件不存在时返回None"""
+    try:
+        data_stat = index_data_path(data_dir, stockCode).stat()
+        meta_stat = index_meta_path(data_dir, stockCode).stat()
+    except FileNotFoundError:
+        return None
+    return data_stat.st_mtime_ns, data_stat.st_size, meta_stat.st_mtime_ns, meta_stat.st_size
+
+
+def _cache_index(data_dir, stockCode, meta, df):
+    if not CACHE_FRAMES:
+        return
+    version = _index_version(data_dir, stockCode)
+    if version is None:
+        return
+    size = int(df.memory_usage(index=True, deep=True).sum()) + version[3]
+    RUN_CACHE.put(_index_cache_key(data_dir, stockCode), version, (meta, df), size)
+
+
+def _cached_index(data_dir, stockCode):
+    """运行期缓存中的 (元数据, 时间序列)，未命中时返回None"""
+    version = _index_version(data_dir, stockCode)
+    if version is None:
+        return None
+    return RUN_CACHE.get(_index_cache_key(data_dir, stockCode), version)
+
+
+def _select(df, columns=None, tail=None):
+    """从缓存的完整时间序列中取出需要的列和行，返回副本，调用方修改不影响缓存"""
+    if columns is not None:
+        df = df[columns]
+    if tail is not None:
+        df = df.iloc[-tail:].reset_index(drop=True)
+    return df.copy()
+
+
+def save_index_data(index_info, data_dir):
+    """保存单个指数的数据。
+
+    时间序列以不压缩的 Feather 格式保存，读取时可以内存映射并只读取需要的列；
+    其余字段作为元数据单独保存。
+
+    Args:
+        index_info (dict): 指数信息，dataframe 字段为时间序列
+        data_dir: 数据目录
+    """
+    stockCode = index_info["stockCode"]
+    df = index_info["dataframe"].reset_index(drop=True)
+    # dataframe 字段保留为None占位，读取时原位替换，保持字段顺序不变
+    meta = {key: (None if key == "dataframe" else value) for key, value in index_info.items()}
+
+    # 合并分块，使相同内容的数据总是写出相同的字节，便于用文件哈希判断数据是否变化
+    table = pa.Table.from_pandas(df).combine_chunks()
+    _replace_atomically(index_data_path(data_dir, stockCode),
+                        lambda path: feather.write_feather(table, path, compression="uncompressed"))
+
+    def write_meta(path):
+        with open(path, "wb") as f:
+            pickle.dump(meta, f)
+
+    _replace_atomically(index_meta_path(data_dir, stockCode), write_meta)
+
+    # 保存副本到运行期缓存，后续阶段读取同一个指数时不需要再读文件
+    if CACHE_FRAMES:
+        _cache_index(data_dir, stockCode, meta, df.copy())
+
+
+def load_index_meta(stockCode, data_dir):
+    """只读取单个指数的元数据。
+
+    Returns:
+        dict: 指数信息，dataframe 字段为None
+    """
+    with open(index_meta_path(data_dir, stockCode), "rb") as f:
+        return pickle.load(f)
+
+
+def load_index_frame(stockCode, data_dir, columns=None, tail=None):
+    """读取单个指数的时间序列。
+
+    Args:
+        stockCode (str): 指数代码
+        data_dir: 数据目录
+        columns (list): 只读取这些列，默认读取全部
+        tail (int): 只读取最后若干行，默认读取全部
+
+    Returns:
+        pandas.DataFrame: 时间序列
+    """
+    cached = _cached_index(data_dir, stockCode)
+    if cached is not None:
+        return _select(cached[1], columns, tail)
+    return _read_frame(stockCode, data_dir, columns, tail)
+
+
+def _read_frame(stockCode, data_dir, columns=None, tail=None):
+    table = feather.read_table(index_data_path(data_dir, stockCode), columns=columns, memory_map=True)
+    if tail is not None:
+        table = table.slice(max(table.num_rows - tail, 0))
+    return table.to_pandas()
+
+
+def load_index_data(stockCode, data_dir, columns=None, tail=None):
+    """读取单个指数的元数据和时间序列。
+
+    列式文件不存在但有旧版 pickle 时读取旧版文件，便于迁移前后共用同一个数据目录。
+
+    Args:
+        stockCode (str): 指数代码
+        data_dir: 数据目录
+        columns (list): 只读取这些列，默认读取全部
+        tail (int): 只读取最后若干行，默认读取全部
+
+    Returns:
+        dict: 指数信息，dataframe 字段为时间序列
+    """
+    if not index_data_path(data_dir, stockCode).exists() and legacy_pickle_path(data_dir, stockCode).exists():
+        with open(legacy_pickle_path(data_dir, stockCode), "rb") as f:
+            index_info = pickle.load(f)
+        df = index_info["dataframe"]
+        if columns is not None:
+            df = df[columns]
+        if tail is not None:
+            df = df.iloc[-tail:]
+        index_info["dataframe"] = df
+        return index_info
+
+    cached = _cached_index(data_dir, stockCode)
+    if cached is not None:
+        meta, df = cached
+        return {**meta, "dataframe": _select(df, columns, tail)}
+
+    index_info = load_index_meta(stockCode, data_dir)
+    index_info["dataframe"] = _read_frame(stockCode, data_dir, columns, tail)
+    # 只缓存完整读取的数据，读取部分列或部分行时直接从文件读取
+    if columns is None and tail is None:
+        _cache_index(data_dir, stockCode, {**index_info, "dataframe": None}, index_info["dataframe"].copy())
+    return index_info
+
+
+def index_data_digest(stockCode, data_dir):
+    """计算单个指数已保存数据的哈希，数据未变化时结果不变。
+
+    直接对数据文件的字节求哈希，不需要解析数据。
+
+    Args:
+        stockCode (str): 指数代码
+        data_dir: 数据目录
+
+    Returns:
+        str: 十六进制哈希值
+    """
+    digest = hashlib.sha256()
+    paths = [index_data_path(data_dir, stockCode), index_meta_path(data_dir, stockCode)]
+    if not paths[0].exists():
+        paths = [legacy_pickle_path(data_dir, stockCode)]
+    for path in paths:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def migrate_pickles(data_dir, remove=True):
+    """将数据目录中的旧版 pickle 转换为列式存储。
+
+    Args:
+        data_dir: 数据目录
+        remove (bool): 转换成功后是否删除旧版文件
+
+    Returns:
+        int: 转换的文件数
+    """
+    count = 0
+    for path in sorted(pathlib.Path(data_dir).glob("*.pickle")):
+        if path.name.endswith(".meta.pickle"):
+            continue
+        try:
+            with open(path, "rb") as f:
+                index_info = pickle.load(f)
+            save_index_data(index_info, data_dir)
+            if remove:
+                path.unlink()
+            count += 1
+        except Exception as e:
+            logging.error(f"转换 {path} 时出错: {e}")
+    logging.info(f"共转换 {count} 个数据文件")
+    return count
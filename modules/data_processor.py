@@ -12,8 +12,26 @@
 import logging
 import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from pathlib import Path
 
+# 滚动百分位按块计算时每块的行数，用于限制比较矩阵的内存占用
+ROLLING_RANK_CHUNK_ROWS = 1024
+
+# 指数数据的列类型：
+# - 日期为 datetime64，读取后不需要再解析字符串
+# - 股票代码每行都相同，不保存为列，指数代码保存在元数据 stockCode 中
+# - 原始行情和估值保持 float64
+# - 均线和布林线上下轨只用于展示，使用 float32
+# - 布林线位置和各百分位是回测信号，要与阈值比较，保持 float64，避免精度损失改变交易结果
+DATE_COLUMN = '日期'
+STOCK_CODE_COLUMN = '股票代码'
+RAW_COLUMNS = ['开盘价', '收盘价', '最高价', '最低价', '成交量', '涨跌幅', '成交额', '市盈率', '市净率', '股息率']
+INDICATOR_COLUMNS = ['5日均线', '10日均线', '20日均线', '30日均线', '60日均线', '120日均线', '250日均线',
+                     '布林线中轨', '布林线上轨', '布林线下轨']
+SIGNAL_COLUMNS = ['布林线位置', '市盈率百分位', '市净率百分位', '股息率收益率', '估值百分位']
+INDICATOR_DTYPE = np.float32
+
 
 def mean_with_default(arr, default_value=0):
     """
@@ -60,6 +78,102 @@ def filter_consecutive_missing_data(df):
     return df.iloc[first_valid_index:].copy()
 
 
+def conform_index_frame(df, stockCode=None):
+    """
+    将指数数据转换为紧凑的列类型并校验，见 DATE_COLUMN 等常量
+
+    已经是目标类型的列不会复制，对已转换的数据再次调用几乎没有开销。
+
+    Args:
+        df (pandas.DataFrame): 指数数据，日期可以是字符串
+        stockCode (str): 指数代码，数据中有股票代码列时校验后删除该列
+
+    Returns:
+        pandas.DataFrame: 转换后的数据
+
+    Raises:
+        ValueError: 日期无法解析、重复或未排序，股票代码与指数不一致，或数值列无法转换时抛出
+    """
+    columns = {}
+
+    if DATE_COLUMN in df.columns and not pd.api.types.is_datetime64_dtype(df[DATE_COLUMN]):
+        try:
+            columns[DATE_COLUMN] = pd.to_datetime(df[DATE_COLUMN], format="%Y-%m-%d")
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"{stockCode} 日期无法解析: {e}") from e
+    dates = columns.get(DATE_COLUMN, df.get(DATE_COLUMN))
+    if dates is not None:
+        if dates.isna().any():
+            raise ValueError(f"{stockCode} 日期存在空值")
+        if not dates.is_monotonic_increasing or dates.duplicated().any():
+            raise ValueError(f"{stockCode} 日期重复或未按顺序排列")
+
+    for column, dtype in [*((column, np.float64) for column in RAW_COLUMNS + SIGNAL_COLUMNS),
+                          *((column, INDICATOR_DTYPE) for column in INDICATOR_COLUMNS)]:
+        if column not in df.columns or df[column].dtype == dtype:
+            continue
+        try:
+            columns[column] = pd.to_numeric(df[column], errors="raise").astype(dtype)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"{stockCode} {column} 无法转换为数值: {e}") from e
+
+    if columns:
+        df = df.assign(**columns)
+
+    if STOCK_CODE_COLUMN in df.columns:
+        codes = df[STOCK_CODE_COLUMN].dropna().unique()
+        if stockCode is not None and any(code != stockCode for code in codes):
+            raise ValueError(f"{stockCode} 数据中的股票代码不一致: {list(codes)}")
+        df = df.drop(columns=STOCK_CODE_COLUMN)
+    return df
+
+
+def rolling_percentile_rank(series, window=500, min_periods=1):
+    """
+    计算滚动窗口内最后一个值的百分位排名
+
+    结果与 ``series.rolling(window, min_periods=min_periods).apply(
+    lambda x: x.rank(method='min', pct=True).iloc[-1])`` 一致：
+    排名为窗口内严格小于当前值的有效值个数加1，再除以窗口内有效值个数；
+    当前值为空或有效值个数不足 min_periods 时结果为空。
+
+    使用 sliding_window_view 按块计数，避免为每个窗口构造 pandas.Series。
+
+    Args:
+        series (pandas.Series): 输入序列
+        window (int): 窗口大小
+        min_periods (int): 窗口内最少有效值个数
+
+    Returns:
+        pandas.Series: 百分位排名，索引与输入一致
+    """
+    values = series.to_numpy(dtype=float)
+    n = len(values)
+    result = np.full(n, np.nan)
+    if n == 0:
+        return pd.Series(result, index=series.index)
+
+    # 在开头补 window-1 个空值，使前几行的窗口与 rolling 的不完整窗口一致
+    padded = np.concatenate([np.full(window - 1, np.nan), values])
+    windows = sliding_window_view(padded, window)
+
+    # 窗口内有效值个数通过累计和求得
+    valid_cumsum = np.concatenate([[0], np.cumsum(~np.isnan(padded))])
+    valid_count = valid_cumsum[window:] - valid_cumsum[:-window]
+
+    for start in range(0, n, ROLLING_RANK_CHUNK_ROWS):
+        stop = min(start + ROLLING_RANK_CHUNK_ROWS, n)
+        current = values[start:stop]
+        # 空值参与比较时结果为False，因此不会被计入
+        less_count = (windows[start:stop] < current[:, None]).sum(axis=1)
+        # 窗口内全为空值时除数为0，这些位置随后统一置空
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result[start:stop] = (less_count + 1) / valid_count[start:stop]
+
+    result[np.isnan(values) | (valid_count < min_periods)] = np.nan
+    return pd.Series(result, index=series.index)
+
+
 def calculate_technical_indicators(df):
     """
     计算技术指标
@@ -72,20 +186,23 @@ def calculate_technical_indicators(df):
     """
     df = df.copy()
     
-    # 计算移动平均线
+    # 计算移动平均线，以 float32 保存
     ma_periods = [5, 10, 20, 30, 60, 120, 250]
     for period in ma_periods:
-        df[f'{period}日均线'] = df['收盘价'].rolling(window=period).mean()
+        df[f'{period}日均线'] = df['收盘价'].rolling(window=period).mean().astype(INDICATOR_DTYPE)
 
-    # 计算布林带
+    # 计算布林带，布林线位置用 float64 的上下轨计算，上下轨以 float32 保存
     bb_period = 20
-    df['布林线中轨'] = df['收盘价'].rolling(window=bb_period).mean()
+    bb_middle = df['收盘价'].rolling(window=bb_period).mean()
     bb_std = df['收盘价'].rolling(window=bb_period).std()
-    df['布林线上轨'] = df['布林线中轨'] + 2 * bb_std
-    df['布林线下轨'] = df['布林线中轨'] - 2 * bb_std
+    bb_upper = bb_middle + 2 * bb_std
+    bb_lower = bb_middle - 2 * bb_std
+    df['布林线中轨'] = bb_middle.astype(INDICATOR_DTYPE)
+    df['布林线上轨'] = bb_upper.astype(INDICATOR_DTYPE)
+    df['布林线下轨'] = bb_lower.astype(INDICATOR_DTYPE)
 
     # 计算收盘价在布林线中的位置
-    df['布林线位置'] = (df['收盘价'] - df['布林线下轨']) / (df['布林线上轨'] - df['布林线下轨'])
+    df['布林线位置'] = (df['收盘价'] - bb_lower) / (bb_upper - bb_lower)
     
     return df
 
@@ -109,20 +226,14 @@ def calculate_valuation_percentiles(df):
         raise KeyError(f"缺少必要的列: {missing_columns}")
     
     # 计算市盈率百分位
-    df['市盈率百分位'] = df['市盈率'].rolling(window=500, min_periods=1).apply(
-        lambda x: x.rank(method='min', pct=True).iloc[-1]
-    )
-    
+    df['市盈率百分位'] = rolling_percentile_rank(df['市盈率'], window=500, min_periods=1)
+
     # 计算市净率百分位
-    df['市净率百分位'] = df['市净率'].rolling(window=500, min_periods=1).apply(
-        lambda x: x.rank(method='min', pct=True).iloc[-1]
-    )
-    
+    df['市净率百分位'] = rolling_percentile_rank(df['市净率'], window=500, min_periods=1)
+
     # 股息率需要反向处理，因为股息率越高表示估值越低
     # 为了与市盈率和市净率保持一致，需要1-排名百分位
-    df['股息率收益率'] = df['股息率'].rolling(window=500, min_periods=1).apply(
-        lambda x: 1 - x.rank(method='min', pct=True).iloc[-1]
-    )
+    df['股息率收益率'] = 1 - rolling_percentile_rank(df['股息率'], window=500, min_periods=1)
 
     # 估值百分位
     df['估值百分位'] = (df['市盈率百分位'] + df['市净率百分位'] + df['股息率收益率']) / 3
@@ -9,14 +9,15 @@
 3. 跟踪指数的基金信息
 """
 
-import json
+import asyncio
 import logging
 import time
 from datetime import datetime, timedelta
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from utils import retry, find_dict_by_field
-from utils import query_json
+from utils import retry, async_retry
+from utils import query_json, AsyncLixingerClient
+from modules.data_manager import load_records, save_records
 
 
 @retry(max_attempts=5, delay=5)
@@ -59,27 +60,30 @@ def fetch_cn_company():
     return company_info
 
 
-@retry(max_attempts=5, delay=5)
-def fetch_index_constituent(stockCode, cn_company):
-    """获取单个指数的成分股及其权重信息。
+def constituent_query(stockCode):
+    """构造查询指数近一年成分股权重的请求参数。"""
+    return {
+        "startDate": (datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d"),
+        "endDate": datetime.now().strftime("%Y-%m-%d"),
+        "stockCode": stockCode,
+        "limit": 1000
+    }
+
+
+def parse_constituent(stockCode, fetch, company_index):
+    """将成分股权重接口的返回结果与公司信息关联，按权重排序。
     
     Args:
         stockCode (str): 指数代码
-        cn_company (list): 所有A股公司信息列表
+        fetch (dict): 接口返回的JSON数据
+        company_index (DictIndex): 按 stockCode 建立的公司信息索引
         
     Returns:
         list: 按权重排序的成分股信息列表
         
     Raises:
-        Exception: 当API调用失败或返回非成功消息时抛出
+        Exception: 当接口返回非成功消息时抛出
     """
-    logging.debug(f"正在获取指数 {stockCode} 的成分股信息...")
-    fetch = query_json("cn/index/constituent-weightings", {
-        "startDate": (datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d"),
-        "endDate": datetime.now().strftime("%Y-%m-%d"),
-        "stockCode": stockCode,
-        "limit": 1000
-    })
     if fetch['message'] != "success":
         logging.error(f"获取指数 {stockCode} 成分股信息失败: {fetch.get('message', '未知错误')}")
         raise Exception(f"获取指数 {stockCode} 成分股信息失败")
@@ -95,7 +99,8 @@ def fetch_index_constituent(stockCode, cn_company):
     
     constituent_weightings_list = []
     for key, value in constituent_weightings_dict.items():
-        company = find_dict_by_field(cn_company, "stockCode", key)
+        # 索引返回副本，写入权重不会修改其他线程共享的公司信息
+        company = company_index.get(key)
         if company is not None:
             company["weighting"] = value
             constituent_weightings_list.append(company)
@@ -105,6 +110,64 @@ def fetch_index_constituent(stockCode, cn_company):
     return constituent_weightings_list
 
 
+def parse_tracking_fund(stockCode, fetch):
+    """检查跟踪基金接口的返回结果并取出基金列表。
+    
+    Args:
+        stockCode (str): 指数代码
+        fetch (dict): 接口返回的JSON数据
+        
+    Returns:
+        list: 跟踪该指数的基金信息列表
+        
+    Raises:
+        Exception: 当接口返回非成功消息时抛出
+    """
+    if fetch['message'] != "success":
+        logging.error(f"获取跟踪指数 {stockCode} 的基金信息失败: {fetch.get('message', '未知错误')}")
+        raise Exception(f"获取跟踪指数 {stockCode} 的基金信息失败")
+    
+    fund_data = fetch["data"]
+    logging.debug(f"成功获取跟踪指数 {stockCode} 的 {len(fund_data)} 条基金信息")
+    return fund_data
+
+
+@retry(max_attempts=5, delay=5)
+def fetch_index_constituent(stockCode, company_index):
+    """获取单个指数的成分股及其权重信息。
+    
+    Args:
+        stockCode (str): 指数代码
+        company_index (DictIndex): 按 stockCode 建立的公司信息索引
+        
+    Returns:
+        list: 按权重排序的成分股信息列表
+        
+    Raises:
+        Exception: 当API调用失败或返回非成功消息时抛出
+    """
+    logging.debug(f"正在获取指数 {stockCode} 的成分股信息...")
+    fetch = query_json("cn/index/constituent-weightings", constituent_query(stockCode))
+    return parse_constituent(stockCode, fetch, company_index)
+
+
+@async_retry(max_attempts=5, delay=5)
+async def fetch_index_constituent_async(client, stockCode, company_index):
+    """fetch_index_constituent 的异步版本，通过共享连接池的客户端发送请求。
+    
+    Args:
+        client (AsyncLixingerClient): 异步HTTP客户端
+        stockCode (str): 指数代码
+        company_index (DictIndex): 按 stockCode 建立的公司信息索引
+        
+    Returns:
+        list: 按权重排序的成分股信息列表
+    """
+    logging.debug(f"正在获取指数 {stockCode} 的成分股信息...")
+    fetch = await client.query_json("cn/index/constituent-weightings", constituent_query(stockCode))
+    return parse_constituent(stockCode, fetch, company_index)
+
+
 @retry(max_attempts=5, delay=5)
 def fetch_index_tracking_fund(stockCode):
     """获取跟踪特定指数的基金信息。
@@ -122,21 +185,33 @@ def fetch_index_tracking_fund(stockCode):
     fetch = query_json("cn/index/tracking-fund", {
         "stockCode": stockCode,
     })
-    if fetch['message'] != "success":
-        logging.error(f"获取跟踪指数 {stockCode} 的基金信息失败: {fetch.get('message', '未知错误')}")
-        raise Exception(f"获取跟踪指数 {stockCode} 的基金信息失败")
+    return parse_tracking_fund(stockCode, fetch)
+
+
+@async_retry(max_attempts=5, delay=5)
+async def fetch_index_tracking_fund_async(client, stockCode):
+    """fetch_index_tracking_fund 的异步版本。
     
-    fund_data = fetch["data"]
-    logging.debug(f"成功获取跟踪指数 {stockCode} 的 {len(fund_data)} 条基金信息")
-    return fund_data
+    Args:
+        client (AsyncLixingerClient): 异步HTTP客户端
+        stockCode (str): 指数代码
+        
+    Returns:
+        list: 跟踪该指数的基金信息列表
+    """
+    logging.debug(f"正在获取跟踪指数 {stockCode} 的基金信息...")
+    fetch = await client.query_json("cn/index/tracking-fund", {
+        "stockCode": stockCode,
+    })
+    return parse_tracking_fund(stockCode, fetch)
 
 
-def fetch_single_index_data(index, cn_company):
+def fetch_single_index_data(index, company_index):
     """获取单个指数的完整信息，包括成分股和跟踪基金。
     
     Args:
         index (dict): 指数基础信息
-        cn_company (list): 所有A股公司信息列表
+        company_index (DictIndex): 按 stockCode 建立的公司信息索引
         
     Returns:
         dict: 包含完整信息的指数数据
@@ -145,7 +220,7 @@ def fetch_single_index_data(index, cn_company):
     logging.info(f"正在处理指数 {stockCode} - {index['name']}...")
     
     try:
-        constituent_weightings = fetch_index_constituent(stockCode, cn_company)
+        constituent_weightings = fetch_index_constituent(stockCode, company_index)
         if len(constituent_weightings) > 30:
             constituent_weightings = constituent_weightings[:30]
         index["constituent_weightings"] = constituent_weightings
@@ -159,16 +234,44 @@ def fetch_single_index_data(index, cn_company):
         raise
 
 
-def update_index_info(cn_index_file, cn_company, max_workers=20):
+async def fetch_single_index_data_async(client, index, company_index):
+    """fetch_single_index_data 的异步版本，成分股和跟踪基金两个请求并发发送。
+    
+    Args:
+        client (AsyncLixingerClient): 异步HTTP客户端
+        index (dict): 指数基础信息
+        company_index (DictIndex): 按 stockCode 建立的公司信息索引
+        
+    Returns:
+        dict: 包含完整信息的指数数据
+    """
+    stockCode = index["stockCode"]
+    logging.info(f"正在处理指数 {stockCode} - {index['name']}...")
+    
+    try:
+        constituent_weightings, tracking_fund = await asyncio.gather(
+            fetch_index_constituent_async(client, stockCode, company_index),
+            fetch_index_tracking_fund_async(client, stockCode),
+        )
+        index["constituent_weightings"] = constituent_weightings[:30]
+        index["tracking_fund"] = tracking_fund
+        
+        logging.info(f"成功处理指数 {stockCode} - {index['name']}")
+        return index
+    except Exception as e:
+        logging.error(f"处理指数 {stockCode} - {index['name']} 时出错: {e}")
+        raise
+
+
+def update_index_info(cn_index_file, company_index, max_workers=20):
     """更新所有指数的完整信息。
     
     Args:
-        cn_index_file (pathlib.Path): 指数数据文件路径
-        cn_company (list): 所有A股公司信息列表
+        cn_index_file (pathlib.Path): 指数数据文件路径，.json 或 .jsonl
+        company_index (DictIndex): 按 stockCode 建立的公司信息索引
         max_workers (int): 最大并发线程数
     """
-    with open(cn_index_file, "r", encoding="utf-8") as f:
-        cn_index = json.load(f)
+    cn_index = load_records(cn_index_file)
     
     logging.info(f"开始更新 {len(cn_index)} 个指数的完整信息，最大并发数: {max_workers}")
     
@@ -181,7 +284,7 @@ def update_index_info(cn_index_file, cn_company, max_workers=20):
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
         # 提交所有任务
         future_to_index = {
-            executor.submit(fetch_single_index_data, index, cn_company): index 
+            executor.submit(fetch_single_index_data, index, company_index): index 
             for index in cn_index
         }
         
@@ -207,8 +310,53 @@ def update_index_info(cn_index_file, cn_company, max_workers=20):
                 logging.error(f"处理 {index['stockCode']} - {index['name']} 时出错: {e}")
     
     # 保存结果到文件
-    with open(cn_index_file, "w", encoding="utf-8") as f:
-        json.dump(results, f, indent=4, ensure_ascii=False)
+    save_records(results, cn_index_file)
+    
+    total_time = time.time() - start_time
+    logging.info(f"完成更新所有指数信息，总共处理 {len(results)} 个指数，耗时 {total_time:.2f} 秒")
+
+
+def update_index_info_async(cn_index_file, company_index, max_concurrency=64):
+    """update_index_info 的异步版本，所有请求共用一个连接池，并发数由信号量限制。
+    
+    Args:
+        cn_index_file (pathlib.Path): 指数数据文件路径，.json 或 .jsonl
+        company_index (DictIndex): 按 stockCode 建立的公司信息索引
+        max_concurrency (int): 同时在途的最大请求数
+    """
+    cn_index = load_records(cn_index_file)
+    
+    logging.info(f"开始更新 {len(cn_index)} 个指数的完整信息，最大并发请求数: {max_concurrency}")
+    
+    start_time = time.time()
+    total_count = len(cn_index)
+    
+    async def update_all():
+        async with AsyncLixingerClient(max_concurrency=max_concurrency) as client:
+            
+            async def update_one(index):
+                try:
+                    return index, await fetch_single_index_data_async(client, index, company_index), None
+                except Exception as e:
+                    return index, None, e
+            
+            results = []
+            completed_count = 0
+            for future in asyncio.as_completed([update_one(index) for index in cn_index]):
+                index, result, error = await future
+                completed_count += 1
+                if error is None:
+                    results.append(result)
+                    logging.info(f"进度: {completed_count}/{total_count} ({completed_count/total_count*100:.1f}%) "
+                                f"已完成 {index['stockCode']} - {index['name']}")
+                else:
+                    logging.error(f"处理 {index['stockCode']} - {index['name']} 时出错: {error}")
+            return results
+    
+    results = asyncio.run(update_all())
+    
+    # 保存结果到文件
+    save_records(results, cn_index_file)
     
     total_time = time.time() - start_time
-    logging.info(f"完成更新所有指数信息，总共处理 {len(results)} 个指数，耗时 {total_time:.2f} 秒")
\ No newline at end of file
+    logging.info(f"完成更新所有指数信息，总共处理 {len(results)} 个指数，耗时 {total_time:.2f} 秒")
@@ -23,15 +23,18 @@ def filter_indices_by_criteria(cn_index, min_years=3):
     3. 指数必须有跟踪基金
     
     Args:
-        cn_index (list): 包含所有指数数据的列表
+        cn_index (iterable): 包含所有指数数据的列表，或逐条产生指数数据的迭代器
         min_years (int): 指数成立的最小年数要求，默认为3年
         
     Returns:
         list: 筛选后的指数数据列表
     """
-    logging.info(f"开始筛选 {len(cn_index)} 个指数，最低成立年限: {min_years}年")
+    logging.info(f"开始筛选指数，最低成立年限: {min_years}年")
     
+    filtered_indices = []
+    total_count = 0
     for index in cn_index:
+        total_count += 1
         index["enable"] = True
         # 检查指数成立时间是否满足要求
         launch_date = datetime.fromisoformat(index["launchDate"])
@@ -49,8 +52,8 @@ def filter_indices_by_criteria(cn_index, min_years=3):
             index["enable"] = False
             continue
 
-    # 过滤掉不满足条件的指数
-    filtered_indices = [item for item in cn_index if item["enable"]]
+        # 只保留满足条件的指数，不满足条件的指数读取后即可释放
+        filtered_indices.append(index)
     
-    logging.info(f"筛选完成，剩余 {len(filtered_indices)} 个指数")
+    logging.info(f"筛选完成，{total_count} 个指数中剩余 {len(filtered_indices)} 个指数")
     return filtered_indices
\ No newline at end of file
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行清单模块
+
+该模块以 JSON 账本记录每日运行中每个指数、每个阶段的状态、输入输出哈希和耗时，
+运行中断后可以据此跳过已完成的工作，或只重新执行失败的指数。
+"""
+
+import os
+import json
+import time
+import pathlib
+import logging
+from datetime import datetime
+
+# 两次保存账本之间的最短间隔（秒），阶段结束时总会保存
+SAVE_INTERVAL = 5
+
+
+class RunManifest:
+    """
+    每日运行的清单，记录 指数 × 阶段 的执行结果
+
+    每条记录包含状态（done / failed）、执行前后已保存数据的哈希、耗时和错误信息。
+    阶段按执行顺序排列，后一个阶段的输入哈希等于前一个阶段的输出哈希时视为同一条处理链。
+    恢复运行时，某个阶段已完成、并且沿处理链到最后一个已完成阶段的输出哈希
+    与当前数据的哈希一致，说明之后数据没有被改动，该阶段可以跳过。
+    """
+
+    def __init__(self, path, stages=(), selection=None):
+        """
+        Args:
+            path: 账本文件路径
+            stages (tuple): 阶段名称，按执行顺序排列
+            selection (str): None 表示全部执行；"resume" 跳过已完成的工作；
+                "retry_failed" 只重新执行上次有阶段失败的指数，其中已完成的阶段同样跳过
+        """
+        self.path = pathlib.Path(path)
+        self.stages = tuple(stages)
+        self.selection = selection
+        self.run_id = datetime.now().isoformat(timespec="seconds")
+        self.started_at = self.run_id
+        self.finished_at = None
+        self.indices = {}
+        self.failed = set()
+        self._saved_at = 0.0
+
+    @classmethod
+    def load(cls, path, stages=(), selection=None):
+        """
+        读取上次运行的账本并在其基础上继续记录
+
+        文件不存在或无法读取、或者 resume 时上次运行已经完成，返回全部执行的新清单。
+        """
+        manifest = cls(path, stages, selection)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            logging.info(f"运行清单 {path} 不存在，全部重新执行")
+            manifest.selection = None
+            return manifest
+        except ValueError as e:
+            logging.warning(f"运行清单 {path} 无法读取，全部重新执行: {e}")
+            manifest.selection = None
+            return manifest
+
+        if selection == "resume" and data.get("finished_at"):
+            logging.info(f"上次运行 {data.get('run_id')} 已完成，开始新的运行")
+            manifest.selection = None
+            return manifest
+
+        manifest.run_id = data.get("run_id", manifest.run_id)
+        manifest.started_at = data.get("started_at", manifest.started_at)
+        manifest.indices = data.get("indices", {})
+        manifest.failed = {stockCode for stockCode, entries in manifest.indices.items()
+                           if any(entry["status"] == "failed" for entry in entries.values())}
+        logging.info(f"继续运行 {manifest.run_id}，上次有 {len(manifest.failed)} 个指数存在失败的阶段")
+        return manifest
+
+    def completed(self, stockCode, stage, digest):
+        """该阶段是否已完成且之后数据未被改动"""
+        entries = self.indices.get(stockCode, {})
+        entry = entries.get(stage)
+        if entry is None or entry["status"] != "done" or stage not in self.stages:
+            return False
+        output = entry["output"]
+        for later in self.stages[self.stages.index(stage) + 1:]:
+            later_entry = entries.get(later)
+            if later_entry is None or later_entry["status"] != "done" or later_entry["input"] != output:
+                break
+            output = later_entry["output"]
+        return output is not None and output == digest
+
+    def should_run(self, stockCode, stage, digest):
+        """
+        本次运行是否需要执行该指数的这个阶段
+
+        Args:
+            stockCode (str): 指数代码
+            stage (str): 阶段名称
+            digest (str): 当前已保存数据的哈希，没有数据时为None
+        """
+        if self.selection is None:
+            return True
+        if self.selection == "retry_failed" and stockCode not in self.failed:
+            return False
+        return not self.completed(stockCode, stage, digest)
+
+    def record(self, stockCode, stage, success, input_digest, output_digest, seconds, error=None):
+        """
+        记录一个指数在一个阶段的执行结果，按 SAVE_INTERVAL 限制保存频率
+
+        Args:
+            stockCode (str): 指数代码
+            stage (str): 阶段名称
+            success (bool): 是否成功
+            input_digest (str): 执行前已保存数据的哈希
+            output_digest (str): 执行后已保存数据的哈希
+            seconds (float): 耗时（秒），无法得知时为None
+            error (str): 错误信息
+        """
+        self.indices.setdefault(stockCode, {})[stage] = {
+            "status": "done" if success else "failed",
+            "input": input_digest,
+            "output": output_digest,
+            "seconds": None if seconds is None else round(seconds, 3),
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+            "error": error,
+        }
+        if time.monotonic() - self._saved_at >= SAVE_INTERVAL:
+            self.save()
+
+    def save(self):
+        """原子地写入账本"""
+        data = {
+            "run_id": self.run_id,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "stages": list(self.stages),
+            "indices": self.indices,
+        }
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=4, sort_keys=True)
+        os.replace(temp_path, self.path)
+        self._saved_at = time.monotonic()
+
+    def finish(self):
+        """标记运行结束，保存账本并输出每个阶段的汇总"""
+        self.finished_at = datetime.now().isoformat(timespec="seconds")
+        self.save()
+        for stage in self.stages:
+            entries = [entries[stage] for entries in self.indices.values() if stage in entries]
+            done = sum(entry["status"] == "done" for entry in entries)
+            seconds = sum(entry["seconds"] or 0 for entry in entries)
+            slowest = max(self.indices, key=lambda code: (self.indices[code].get(stage) or {}).get("seconds") or 0,
+                          default=None)
+            message = f"运行清单 {stage}: 完成 {done} 个，失败 {len(entries) - done} 个，累计耗时 {seconds:.1f} 秒"
+            if slowest is not None and stage in self.indices[slowest]:
+                message += f"，最慢 {slowest} {self.indices[slowest][stage]['seconds'] or 0:.1f} 秒"
+            logging.info(message)
@@ -34,10 +34,15 @@ logging.basicConfig(
 from modules.index_data_fetcher import (
     fetch_cn_index,
     fetch_cn_company,
-    update_index_info
+    update_index_info,
+    update_index_info_async
 )
-from modules.data_manager import save_data_to_json, load_data_from_json
+from modules.data_manager import save_records
 from modules.config_manager import load_config
+from utils import configure_rate_limit, DEFAULT_RATE_LIMIT, DEFAULT_RATE_BURST, DEFAULT_LATENCY_TARGET
+from utils import configure_http_session
+from utils import DictIndex
+from utils import configure_response_cache, log_response_cache_stats, DEFAULT_RESPONSE_CACHE_BYTES
 
 
 BASE_DIR = pathlib.Path(__file__).parent
@@ -45,25 +50,49 @@ BASE_DIR = pathlib.Path(__file__).parent
 # 加载配置文件，如果不存在则使用空字典
 config = load_config(BASE_DIR.joinpath("config.json"), {})
 
+# 配置 jsonl 为 true 时以 JSON Lines 格式（每行一条记录）保存，读取时可以逐行解析
+RECORDS_SUFFIX = ".jsonl" if config.get("jsonl", False) else ".json"
+
 
 def main():
     """主函数，执行月度数据更新任务。"""
     logging.info("开始执行月度数据更新任务")
+    configure_rate_limit(config.get("rate_limit", DEFAULT_RATE_LIMIT),
+                         config.get("rate_burst", DEFAULT_RATE_BURST),
+                         20,
+                         config.get("latency_target", DEFAULT_LATENCY_TARGET))
+    # 抓取成分股和跟踪基金的20个线程共用一个连接池
+    configure_http_session(20)
+    # 当天重复运行（调试）时从响应缓存读取，不再重复请求；offline 为 true 时只从缓存读取
+    offline = config.get("offline", False)
+    configure_response_cache(BASE_DIR.joinpath("data", "http_cache") if offline or config.get("response_cache", True)
+                             else None,
+                             int(config.get("response_cache_mb", DEFAULT_RESPONSE_CACHE_BYTES / 2 ** 20) * 2 ** 20),
+                             offline)
     
     try:
         # 获取所有A股指数基础信息并保存
         cn_index = fetch_cn_index()
-        cn_index_file = BASE_DIR.joinpath("cn_index.json")
-        save_data_to_json(cn_index, cn_index_file)
+        cn_index_file = BASE_DIR.joinpath("cn_index" + RECORDS_SUFFIX)
+        save_records(cn_index, cn_index_file)
 
         # 获取所有A股公司基础信息并保存
         cn_company = fetch_cn_company()
-        cn_company_file = BASE_DIR.joinpath("cn_company.json")
-        save_data_to_json(cn_company, cn_company_file)
+        cn_company_file = BASE_DIR.joinpath("cn_company" + RECORDS_SUFFIX)
+        save_records(cn_company, cn_company_file)
+
+        # 按 stockCode 建立只读索引，所有线程共享，查找成分股公司信息为 O(1)。
+        # 成分股只保存 constituent_fields 中的公司字段（默认只保留名称），完整的公司信息在 daily.py 导出时单独输出一次；
+        # 保留名称使公司信息表缺失或过期时成分股表格仍能显示名称
+        company_index = DictIndex(cn_company, "stockCode", config.get("constituent_fields", ["name"]))
 
         # 更新所有指数的完整信息（成分股和跟踪基金）
-        update_index_info(cn_index_file, cn_company)
+        if config.get("async_fetch", False):
+            update_index_info_async(cn_index_file, company_index, config.get("max_concurrency", 64))
+        else:
+            update_index_info(cn_index_file, company_index)
         
+        log_response_cache_stats()
         logging.info("月度数据更新任务执行完成")
     except Exception as e:
         logging.error(f"执行月度数据更新任务时出错: {e}")
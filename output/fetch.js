@@ -0,0 +1,32 @@
+// index.html 和 fund.html 共用的JSON加载函数。
+// 导出时为每个JSON文件生成了 .gz 预压缩文件，浏览器支持 DecompressionStream 时优先加载并在本地解压，
+// 传输量比边缘节点的默认压缩更小；URL 参数 compressed=0 时直接加载JSON。
+// 服务器可能已按 Content-Encoding 解压，因此按 gzip 文件头判断是否需要解压。
+const usePrecompressed = 'DecompressionStream' in window
+    && new URLSearchParams(window.location.search).get('compressed') !== '0';
+
+function fetchPrecompressed(path) {
+    return fetch(`${path}.gz`).then(response => {
+        if (!response.ok) {
+            throw new Error(`${path}.gz ${response.status}`);
+        }
+        return response.arrayBuffer();
+    }).then(buffer => {
+        const bytes = new Uint8Array(buffer);
+        if (bytes[0] !== 0x1f || bytes[1] !== 0x8b) {
+            return JSON.parse(new TextDecoder().decode(bytes));
+        }
+        const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('gzip'));
+        return new Response(stream).json();
+    });
+}
+
+// 文件不存在时返回 null
+function fetchPlainJson(path) {
+    return fetch(path).then(response => response.ok ? response.json() : null);
+}
+
+// 预压缩文件不存在或解压失败时回退到JSON文件
+function fetchJson(path) {
+    return usePrecompressed ? fetchPrecompressed(path).catch(() => fetchPlainJson(path)) : fetchPlainJson(path);
+}
@@ -1,36 +1,129 @@
 import time
+import gzip
+import random
+import asyncio
+import hashlib
 import logging
+import pathlib
+import shutil
+import threading
 import traceback
-from datetime import timedelta
+import importlib.util
+from collections import OrderedDict
+from types import MappingProxyType
+from datetime import datetime, timedelta, timezone
 from functools import wraps
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable
 import json
 import os
 
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 
 BASEURL = "https://open.lixinger.com/api/"
 
+# 默认的请求速率（每秒请求数）和突发容量，可通过 configure_rate_limit 修改
+DEFAULT_RATE_LIMIT = 15
+DEFAULT_RATE_BURST = 30
+# 默认的最大并发请求数和延迟目标（秒），超过延迟目标视为服务端开始拥塞
+DEFAULT_MAX_CONCURRENCY = 12
+DEFAULT_LATENCY_TARGET = 5.0
+# 重试退避的最长等待时间（秒）
+MAX_RETRY_DELAY = 60
+# 默认的连接超时和读取超时（秒），每个 HTTP 请求都设置，避免服务端无响应时请求永远挂起
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 30
+# 响应缓存的默认大小上限（字节）
+DEFAULT_RESPONSE_CACHE_BYTES = 256 * 2 ** 20
+# 结束日期早于今天这么多天的日期区间视为已封闭，历史数据不再修订，缓存永不过期
+CLOSED_WINDOW_DAYS = 30
+# 理杏仁数据的日期按北京时间计算
+SHANGHAI_TZ = timezone(timedelta(hours=8))
+
 logging.basicConfig(level=logging.INFO)
 
 
-def retry(max_attempts=3, delay=1):
+def backoff_delay(attempts, delay, max_delay=MAX_RETRY_DELAY):
+    """
+    计算第 attempts 次失败后的等待时间：指数退避加全抖动
+
+    等待时间在 0 到 min(max_delay, delay * 2 ** (attempts - 1)) 之间随机取值，
+    避免大量请求在服务端限流后同时重试。
     """
-    装饰器：在函数执行失败时自动重试。
+    return random.uniform(0, min(max_delay, delay * 2 ** (attempts - 1)))
+
+
+class DeadlineExceeded(Exception):
+    """超过 set_deadline 设置的截止时间，不再发出新的请求，也不再重试"""
+
+
+class OfflineCacheMiss(Exception):
+    """离线模式下响应缓存中没有该请求，不发出请求，也不再重试"""
+
+
+# 截止时间（time.time() 的时间戳），None 表示没有截止时间。使用系统时间，工作进程中设置同一个值即可
+_deadline = None
+
+
+def set_deadline(deadline):
+    """
+    设置本进程所有请求的截止时间
+
+    截止时间之后 query_json 不再发出请求，直接抛出 DeadlineExceeded；
+    截止时间之前发出的请求，读取超时不超过剩余的时间。
+
+    :param deadline: time.time() 的时间戳，None 表示取消截止时间
+    """
+    global _deadline
+    _deadline = deadline
+
+
+def deadline_remaining():
+    """距离截止时间的秒数，没有截止时间时返回None"""
+    if _deadline is None:
+        return None
+    return _deadline - time.time()
+
+
+def check_deadline():
+    """已超过截止时间时抛出 DeadlineExceeded"""
+    remaining = deadline_remaining()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded("已超过抓取截止时间")
+
+
+def _retry_wait(attempts, delay, max_delay):
+    # 退避等待不超过剩余时间，超过截止时间后立即放弃
+    wait = backoff_delay(attempts, delay, max_delay)
+    remaining = deadline_remaining()
+    if remaining is not None:
+        wait = max(min(wait, remaining), 0)
+    return wait
+
+
+def retry(max_attempts=3, delay=1, max_delay=MAX_RETRY_DELAY):
+    """
+    装饰器：在函数执行失败时自动重试。超过截止时间（DeadlineExceeded）或离线缓存未命中时不重试。
 
     :param max_attempts: 最大重试次数
-    :param delay: 每次重试之间的延迟（秒）
+    :param delay: 退避的基准延迟（秒），每次失败后翻倍并加随机抖动
+    :param max_delay: 单次等待的最长时间（秒）
     """
 
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
             attempts = 0
+            last_exception = None
             while attempts < max_attempts:
                 try:
                     return func(*args, **kwargs)
+                except (DeadlineExceeded, OfflineCacheMiss):
+                    raise
                 except Exception as e:
                     attempts += 1
+                    last_exception = e
                     # 获取详细的异常信息，包括堆栈跟踪
                     tb_str = traceback.format_exc()
                     # 记录函数名和参数
@@ -39,9 +132,46 @@ def retry(max_attempts=3, delay=1):
                     params_str = ', '.join(filter(None, [args_str, kwargs_str]))
                     logging.error(f"第 {attempts} 次尝试失败: {func.__name__}({params_str}) 错误信息: {tb_str}")
                     if attempts < max_attempts:
-                        time.sleep(delay)
+                        time.sleep(_retry_wait(attempts, delay, max_delay))
+            logging.error(f"所有 {max_attempts} 次尝试均失败，抛出最后的异常。")
+            raise last_exception  # 抛出最后一次异常
+
+        return wrapper
+
+    return decorator
+
+
+def async_retry(max_attempts=3, delay=1, max_delay=MAX_RETRY_DELAY):
+    """
+    装饰器：异步函数执行失败时自动重试，参数与 retry 相同。
+
+    :param max_attempts: 最大重试次数
+    :param delay: 退避的基准延迟（秒），每次失败后翻倍并加随机抖动
+    :param max_delay: 单次等待的最长时间（秒）
+    """
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            attempts = 0
+            last_exception = None
+            while attempts < max_attempts:
+                try:
+                    return await func(*args, **kwargs)
+                except (DeadlineExceeded, OfflineCacheMiss):
+                    raise
+                except Exception as e:
+                    attempts += 1
+                    last_exception = e
+                    tb_str = traceback.format_exc()
+                    args_str = ', '.join([repr(arg) for arg in args])
+                    kwargs_str = ', '.join([f"{k}={repr(v)}" for k, v in kwargs.items()])
+                    params_str = ', '.join(filter(None, [args_str, kwargs_str]))
+                    logging.error(f"第 {attempts} 次尝试失败: {func.__name__}({params_str}) 错误信息: {tb_str}")
+                    if attempts < max_attempts:
+                        await asyncio.sleep(_retry_wait(attempts, delay, max_delay))
             logging.error(f"所有 {max_attempts} 次尝试均失败，抛出最后的异常。")
-            raise e  # 抛出最后一次异常
+            raise last_exception  # 抛出最后一次异常
 
         return wrapper
 
@@ -85,6 +215,46 @@ def find_dict_by_field(
     return None
 
 
+class DictIndex:
+    """
+    按指定字段为字典列表建立的只读哈希索引，查找为 O(1)。
+
+    与 find_dict_by_field 一样，字段值重复时保留第一个匹配的字典。索引建立后不可修改，
+    get 返回记录的副本，调用方可以随意修改，多个线程可以共享同一个索引。
+    指定 fields 时每条记录只保留索引字段和这些字段。
+    """
+
+    def __init__(self, dict_list: Iterable[Dict[str, Any]], field_name: str, fields: Optional[List[str]] = None):
+        """
+        Args:
+            dict_list: 包含字典的列表或逐条产生字典的迭代器，每个字典代表一个数据记录
+            field_name: 作为索引键的字段名称
+            fields: 记录中保留的字段，默认保留全部字段
+        """
+        if isinstance(dict_list, (dict, str)) or not isinstance(dict_list, Iterable):
+            raise TypeError(f"Expected iterable of dicts, got {type(dict_list).__name__}")
+
+        records = {}
+        for item in dict_list:
+            if isinstance(item, dict) and field_name in item and item[field_name] not in records:
+                if fields is not None:
+                    item = {key: value for key, value in item.items() if key == field_name or key in fields}
+                records[item[field_name]] = MappingProxyType(dict(item))
+        self.field_name = field_name
+        self._records = MappingProxyType(records)
+
+    def get(self, field_value: Any) -> Optional[Dict[str, Any]]:
+        """返回字段值为 field_value 的记录的副本，没有找到则返回None"""
+        record = self._records.get(field_value)
+        return dict(record) if record is not None else None
+
+    def __contains__(self, field_value: Any) -> bool:
+        return field_value in self._records
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+
 def get_dates_ranges(launch_datetime, end_datetime, years=7):
     """
     根据开始日期和发射日期计算日期范围列表。
@@ -115,6 +285,428 @@ def get_dates_ranges(launch_datetime, end_datetime, years=7):
 
     return date_ranges
 
+class TokenBucket:
+    """
+    令牌桶限速器，线程安全
+
+    令牌以 rate 个/秒的速度补充，最多积累 capacity 个。每个请求消耗一个令牌，
+    令牌不足时预约下一个令牌并等待到它生成，因此并发的调用者按先后顺序均匀放行。
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        :param rate: 每秒补充的令牌数，即长期平均的请求速率
+        :param capacity: 令牌桶容量，即允许的突发请求数
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """预约一个令牌，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD 自适应并发限制，线程安全
+
+    请求成功且延迟不超过 latency_target 时，并发上限加法增长（每个成功请求增加 1/limit，
+    约等于每轮加一）；请求失败、被限流或延迟超标时，并发上限乘法减小。
+    """
+
+    def __init__(self, maximum, minimum=1, latency_target=DEFAULT_LATENCY_TARGET, decrease_factor=0.5):
+        """
+        :param maximum: 并发上限的最大值
+        :param minimum: 并发上限的最小值
+        :param latency_target: 延迟目标（秒）
+        :param decrease_factor: 拥塞时并发上限的缩小比例
+        """
+        self.maximum = maximum
+        self.minimum = minimum
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        # 从一半开始，在没有拥塞信号时逐步增长到最大值
+        self.limit = float(max(minimum, maximum // 2))
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def try_acquire(self):
+        with self._condition:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    async def acquire_async(self):
+        while not self.try_acquire():
+            await asyncio.sleep(0.05)
+
+    def release(self, success, latency):
+        """
+        归还并发名额，并根据请求结果调整并发上限
+
+        :param success: 请求是否成功（未被限流、未出错）
+        :param latency: 请求耗时（秒）
+        """
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if success and latency <= self.latency_target:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            elif now - self._last_decrease > self.latency_target:
+                # 同一轮拥塞中在途请求会陆续失败，只减小一次
+                self._last_decrease = now
+                self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                reason = "请求失败" if not success else f"延迟 {latency:.1f} 秒"
+                logging.warning(f"{reason}，并发上限降低至 {int(self.limit)}")
+            self._condition.notify_all()
+
+
+# 所有 query_json 调用共用的限速器和并发限制
+RATE_LIMITER = TokenBucket(DEFAULT_RATE_LIMIT, DEFAULT_RATE_BURST)
+CONCURRENCY_LIMITER = AdaptiveConcurrency(DEFAULT_MAX_CONCURRENCY)
+
+
+# 所有 query_json 调用的 (连接超时, 读取超时)
+REQUEST_TIMEOUT = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+
+
+def configure_timeouts(connect=DEFAULT_CONNECT_TIMEOUT, read=DEFAULT_READ_TIMEOUT):
+    """
+    设置 query_json 和 AsyncLixingerClient 默认的连接超时和读取超时
+
+    :param connect: 建立连接的超时时间（秒）
+    :param read: 等待服务端响应数据的超时时间（秒）
+    """
+    global REQUEST_TIMEOUT
+    REQUEST_TIMEOUT = (connect, read)
+
+
+def request_timeout(timeout=None):
+    """
+    本次请求的 (连接超时, 读取超时)：读取超时不超过距离截止时间的剩余秒数
+
+    :param timeout: (连接超时, 读取超时) 或同时用于两者的秒数，默认为 REQUEST_TIMEOUT
+    """
+    timeout = timeout or REQUEST_TIMEOUT
+    if isinstance(timeout, (int, float)):
+        timeout = (timeout, timeout)
+    connect, read = timeout
+    remaining = deadline_remaining()
+    if remaining is not None:
+        read = max(min(read, remaining), 0.1)
+    return connect, read
+
+
+# query_json 共用的 requests 会话，连接池中的连接保持长连接并在线程间复用
+HTTP_SESSION = None
+_session_lock = threading.Lock()
+
+
+def _new_http_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Content-Type": "application/json"})
+    return session
+
+
+def configure_http_session(pool_size=DEFAULT_MAX_CONCURRENCY):
+    """
+    重新创建 query_json 共用的 requests 会话，需在发出请求之前调用
+
+    fork 出的工作进程应重新创建会话，不与父进程共用连接。
+
+    :param pool_size: 连接池大小，不小于同时发出请求的线程数
+    """
+    global HTTP_SESSION
+    with _session_lock:
+        previous, HTTP_SESSION = HTTP_SESSION, _new_http_session(pool_size)
+    if previous is not None:
+        previous.close()
+
+
+def http_session():
+    """query_json 共用的 requests 会话，第一次使用时按默认的连接池大小创建"""
+    global HTTP_SESSION
+    with _session_lock:
+        if HTTP_SESSION is None:
+            HTTP_SESSION = _new_http_session(DEFAULT_MAX_CONCURRENCY)
+        return HTTP_SESSION
+
+
+def configure_rate_limit(rate=DEFAULT_RATE_LIMIT, burst=DEFAULT_RATE_BURST,
+                         max_concurrency=DEFAULT_MAX_CONCURRENCY, latency_target=DEFAULT_LATENCY_TARGET):
+    """
+    重新设置共用的限速器和并发限制，需在发出请求之前调用
+
+    :param rate: 每秒请求数
+    :param burst: 允许的突发请求数
+    :param max_concurrency: 最大并发请求数
+    :param latency_target: 延迟目标（秒）
+    """
+    global RATE_LIMITER, CONCURRENCY_LIMITER
+    RATE_LIMITER = TokenBucket(rate, max(1, burst))
+    CONCURRENCY_LIMITER = AdaptiveConcurrency(max_concurrency, latency_target=latency_target)
+
+
+class ResponseCache:
+    """
+    理杏仁接口响应的磁盘缓存，线程安全
+
+    以接口路径和规范化后的请求参数（不含token）为键，每个响应 gzip 压缩后保存为一个文件。
+    按请求的日期区间分为两类，分别保存在两个子目录中：
+    - closed/: 结束日期早于今天 closed_days 天以上的历史区间，数据不再变化，永不过期
+    - open/<日期>/: 包含最近日期或没有日期的请求（如 cn/company），只在抓取当天有效。
+      每日增量请求的结束日期是当天，第二天不会再用到，第一次使用缓存时删除以前各天的目录
+    总大小超过 max_bytes 时先淘汰 open 的文件，再按最近使用时间淘汰 closed 的文件。
+    离线模式下只从缓存读取，open 的请求没有当天的缓存时使用最近一天的缓存，不删除任何文件。
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_RESPONSE_CACHE_BYTES, offline=False,
+                 closed_days=CLOSED_WINDOW_DAYS):
+        """
+        :param directory: 缓存目录
+        :param max_bytes: 缓存文件总大小上限（字节）
+        :param offline: 是否只从缓存读取
+        :param closed_days: 结束日期早于今天多少天的区间视为已封闭
+        """
+        self.directory = pathlib.Path(directory)
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.closed_days = closed_days
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        # 相对路径 -> 大小，按最近使用排序，第一次使用时扫描目录建立
+        self._open = None
+        self._closed = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(url_suffix, query_params):
+        """规范化的请求：去掉token，参数按键排序"""
+        params = {key: value for key, value in (query_params or {}).items() if key != "token"}
+        return json.dumps([url_suffix, params], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+    @staticmethod
+    def _today():
+        return datetime.now(SHANGHAI_TZ).date().isoformat()
+
+    def ttl_class(self, query_params):
+        """请求的过期类别：closed 或 open"""
+        end_date = (query_params or {}).get("endDate")
+        if not end_date:
+            return "open"
+        today = datetime.now(SHANGHAI_TZ).date()
+        if datetime.strptime(end_date[:10], "%Y-%m-%d").date() < today - timedelta(days=self.closed_days):
+            return "closed"
+        return "open"
+
+    def _name(self, url_suffix, query_params):
+        digest = hashlib.sha256(self.normalize(url_suffix, query_params).encode("utf-8")).hexdigest()
+        return f"{digest}.json.gz"
+
+    def _relative_path(self, url_suffix, query_params, day=None):
+        name = self._name(url_suffix, query_params)
+        if self.ttl_class(query_params) == "closed":
+            return f"closed/{name}"
+        return f"open/{day or self._today()}/{name}"
+
+    def _candidates(self, url_suffix, query_params):
+        """可以使用的缓存文件，按优先顺序排列"""
+        relative_path = self._relative_path(url_suffix, query_params)
+        if not self.offline or relative_path.startswith("closed/"):
+            return [relative_path]
+        # 离线模式下没有当天的缓存时依次使用之前各天的缓存
+        name = self._name(url_suffix, query_params)
+        days = sorted((entry.name for entry in os.scandir(self.directory.joinpath("open")) if entry.is_dir()),
+                      reverse=True)
+        return [relative_path] + [f"open/{day}/{name}" for day in days]
+
+    def _load_entries(self):
+        if self._closed is not None:
+            return
+        today = self._today()
+        open_dir = self.directory.joinpath("open")
+        self.directory.joinpath("closed").mkdir(parents=True, exist_ok=True)
+        open_dir.joinpath(today).mkdir(parents=True, exist_ok=True)
+        if not self.offline:
+            # 以前各天的 open 缓存已经过期，其中的请求（结束日期为当天）也不会再出现
+            for entry in os.scandir(open_dir):
+                if entry.name != today:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+
+        def scan(relative_dir):
+            files = []
+            for entry in os.scandir(self.directory.joinpath(relative_dir)):
+                if entry.name.endswith(".json.gz"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, f"{relative_dir}/{entry.name}", stat.st_size))
+            return OrderedDict((path, size) for _, path, size in sorted(files))
+
+        self._closed = scan("closed")
+        self._open = OrderedDict()
+        for entry in sorted(os.scandir(open_dir), key=lambda entry: entry.name):
+            if entry.is_dir():
+                self._open.update(scan(f"open/{entry.name}"))
+        self._bytes = sum(self._closed.values()) + sum(self._open.values())
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and (self._open or self._closed):
+            entries = self._open if self._open else self._closed
+            relative_path, size = entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                self.directory.joinpath(relative_path).unlink()
+            except FileNotFoundError:
+                pass
+
+    def get(self, url_suffix, query_params):
+        """返回缓存的响应，未命中或已过期时返回None"""
+        with self._lock:
+            self._load_entries()
+        entry = None
+        for relative_path in self._candidates(url_suffix, query_params):
+            path = self.directory.joinpath(relative_path)
+            try:
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    entry = json.load(f)
+                break
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError) as e:
+                logging.warning(f"响应缓存 {relative_path} 无法读取，重新请求: {e}")
+                break
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entries = self._closed if relative_path.startswith("closed/") else self._open
+            if relative_path in entries:
+                entries.move_to_end(relative_path)
+        if relative_path.startswith("closed/"):
+            # 更新修改时间，下次扫描目录时按最近使用排序
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return entry["response"]
+
+    def put(self, url_suffix, query_params, response):
+        """保存响应，超过大小上限时先淘汰 open 的文件，再淘汰最久未使用的 closed 文件"""
+        relative_path = self._relative_path(url_suffix, query_params)
+        entry = {"request": self.normalize(url_suffix, query_params), "response": response}
+        data = gzip.compress(json.dumps(entry, ensure_ascii=False).encode("utf-8"), mtime=0)
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            self._load_entries()
+            path = self.directory.joinpath(relative_path)
+            # 运行期间跨过零点时当天的目录还不存在
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # 先写临时文件再替换，其他进程不会读到写了一半的文件
+            temp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            temp_path.write_bytes(data)
+            os.replace(temp_path, path)
+            entries = self._closed if relative_path.startswith("closed/") else self._open
+            self._bytes += len(data) - entries.pop(relative_path, 0)
+            entries[relative_path] = len(data)
+            self._evict()
+
+    def log_stats(self, name="响应缓存"):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total else 0
+        logging.info(f"{name}: 命中 {self.hits} 次，未命中 {self.misses} 次（命中率 {hit_rate:.1f}%），"
+                     f"淘汰 {self.evictions} 个文件")
+
+
+# query_json 和 AsyncLixingerClient 共用的响应缓存，None 表示不缓存
+RESPONSE_CACHE = None
+
+
+def configure_response_cache(directory, max_bytes=DEFAULT_RESPONSE_CACHE_BYTES, offline=False):
+    """
+    设置共用的响应缓存
+
+    :param directory: 缓存目录，None 表示不缓存
+    :param max_bytes: 缓存文件总大小上限（字节）
+    :param offline: 只从缓存读取，缓存中没有的请求抛出 OfflineCacheMiss
+    """
+    global RESPONSE_CACHE
+    RESPONSE_CACHE = ResponseCache(directory, max_bytes, offline) if directory is not None else None
+    return RESPONSE_CACHE
+
+
+def log_response_cache_stats():
+    """输出本进程响应缓存的命中统计"""
+    if RESPONSE_CACHE is not None:
+        RESPONSE_CACHE.log_stats()
+
+
+def cached_response(url_suffix, query_params, refresh=False):
+    """
+    从共用的响应缓存读取，离线模式下未命中时抛出 OfflineCacheMiss
+
+    refresh 为 True 时不读取缓存（离线模式除外），重新请求后的响应覆盖缓存中的旧响应
+    """
+    cache = RESPONSE_CACHE
+    if cache is None or (refresh and not cache.offline):
+        return None
+    response = cache.get(url_suffix, query_params)
+    if response is None and cache.offline:
+        raise OfflineCacheMiss(f"离线模式下响应缓存中没有 {cache.normalize(url_suffix, query_params)}")
+    return response
+
+
+def cache_response(url_suffix, query_params, response):
+    """只缓存成功的响应"""
+    cache = RESPONSE_CACHE
+    if cache is not None and isinstance(response, dict) and response.get("message") == "success":
+        cache.put(url_suffix, query_params, response)
+
+
+def is_throttled(status_code):
+    """服务端限流（429）或服务端错误（5xx）"""
+    return status_code == 429 or status_code >= 500
+
+
 def get_token():
     """
     获取token
@@ -132,13 +724,108 @@ def get_full_url(url_suffix):
     return BASEURL + url_suffix
 
 
-def query_json(url_suffix, query_params=None):
-    if query_params is None:
-        query_params = dict()
+def query_json(url_suffix, query_params=None, refresh=False):
+    """
+    请求理杏仁接口
+
+    :param url_suffix: 接口路径
+    :param query_params: 请求参数，不含token
+    :param refresh: 不使用缓存的响应，重新请求并更新缓存（如检测到历史数据被修订时）
+    """
+    # 复制参数再加入token，调用方的参数（可能出现在重试日志中）不包含token
+    query_params = dict(query_params or {})
+    cached = cached_response(url_suffix, query_params, refresh)
+    if cached is not None:
+        return cached
     if get_token() is None:
         raise Exception("token未设置")
     query_params["token"] = get_token()
 
-    headers = {"Content-Type": "application/json"}
-    response = requests.post(url=get_full_url(url_suffix), data=json.dumps(query_params), headers=headers)
-    return response.json()
+    session = http_session()
+    check_deadline()
+    RATE_LIMITER.acquire()
+    limiter = CONCURRENCY_LIMITER
+    limiter.acquire()
+    start = time.monotonic()
+    success = False
+    try:
+        # 排队等待限速期间可能已超过截止时间
+        check_deadline()
+        response = session.post(url=get_full_url(url_suffix), data=json.dumps(query_params),
+                                timeout=request_timeout())
+        success = not is_throttled(response.status_code)
+    finally:
+        limiter.release(success, time.monotonic() - start)
+    if not success:
+        raise Exception(f"请求 {url_suffix} 被限流或服务端出错: HTTP {response.status_code}")
+    result = response.json()
+    cache_response(url_suffix, query_params, result)
+    return result
+
+
+class AsyncLixingerClient:
+    """
+    理杏仁接口的异步客户端
+
+    所有请求共用一个 httpx.AsyncClient 连接池并保持长连接，安装了 h2 时使用 HTTP/2；
+    请求速率受共用的 RATE_LIMITER 限制，同时在途的请求数由 AdaptiveConcurrency 根据
+    失败和延迟自动调整，最多 max_concurrency 个。需要在 async with 中使用，以便退出时关闭连接。
+
+    用法:
+        async with AsyncLixingerClient(max_concurrency=64) as client:
+            fetch = await client.query_json("cn/index/candlestick", {...})
+    """
+
+    def __init__(self, max_concurrency=64, timeout=None, latency_target=DEFAULT_LATENCY_TARGET):
+        """
+        :param max_concurrency: 同时在途的最大请求数，也是连接池的大小
+        :param timeout: (连接超时, 读取超时)（秒），默认为 REQUEST_TIMEOUT
+        :param latency_target: 自适应并发的延迟目标（秒）
+        """
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.latency_target = latency_target
+        self._client = None
+        self._limiter = None
+
+    async def __aenter__(self):
+        limits = httpx.Limits(max_connections=self.max_concurrency,
+                              max_keepalive_connections=self.max_concurrency)
+        self._client = httpx.AsyncClient(
+            http2=importlib.util.find_spec("h2") is not None,
+            limits=limits,
+            headers={"Content-Type": "application/json"},
+        )
+        self._limiter = AdaptiveConcurrency(self.max_concurrency, latency_target=self.latency_target)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._client.aclose()
+
+    async def query_json(self, url_suffix, query_params=None, refresh=False):
+        """异步版本的 query_json"""
+        query_params = dict(query_params or {})
+        cached = cached_response(url_suffix, query_params, refresh)
+        if cached is not None:
+            return cached
+        query_params["token"] = get_token()
+
+        check_deadline()
+        await RATE_LIMITER.acquire_async()
+        await self._limiter.acquire_async()
+        start = time.monotonic()
+        success = False
+        try:
+            check_deadline()
+            connect, read = request_timeout(self.timeout)
+            # 连接池等待与写入也使用连接超时，读取超时限制等待响应的时间
+            response = await self._client.post(get_full_url(url_suffix), content=json.dumps(query_params),
+                                               timeout=httpx.Timeout(connect, read=read))
+            success = not is_throttled(response.status_code)
+        finally:
+            self._limiter.release(success, time.monotonic() - start)
+        if not success:
+            raise Exception(f"请求 {url_suffix} 被限流或服务端出错: HTTP {response.status_code}")
+        result = response.json()
+        cache_response(url_suffix, query_params, result)
+        return result
@@ -29,7 +29,7 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-from modules.data_manager import load_data_from_json, save_data_to_json
+from modules.data_manager import iter_records, records_path, save_records
 from modules.config_manager import load_config
 from modules.index_filter import filter_indices_by_criteria
 
@@ -38,25 +38,24 @@ BASE_DIR = pathlib.Path(__file__).parent
 # 加载配置文件，如果不存在则使用空字典
 config = load_config(BASE_DIR.joinpath("config.json"), {})
 
+# 配置 jsonl 为 true 时以 JSON Lines 格式（每行一条记录）保存，读取时可以逐行解析
+RECORDS_SUFFIX = ".jsonl" if config.get("jsonl", False) else ".json"
+
 
 def main():
     """主函数，执行周度数据筛选任务。"""
     logging.info("开始执行周度数据筛选任务")
     
     try:
-        # 加载指数数据
+        # 逐条读取并筛选指数数据，只保留通过筛选的指数
         cn_index_file = BASE_DIR.joinpath("cn_index.json")
-        logging.info(f"正在加载指数数据文件: {cn_index_file}")
-        cn_index = load_data_from_json(cn_index_file)
-        logging.info(f"成功加载 {len(cn_index)} 个指数数据")
-        
-        # 筛选指数
-        filtered_indices = filter_indices_by_criteria(cn_index)
+        logging.info(f"正在加载指数数据文件: {records_path(cn_index_file)}")
+        filtered_indices = filter_indices_by_criteria(iter_records(cn_index_file))
         
         # 保存筛选结果
-        output_file = BASE_DIR.joinpath("cn_index_filtered.json")
+        output_file = BASE_DIR.joinpath("cn_index_filtered" + RECORDS_SUFFIX)
         logging.info(f"正在保存筛选结果到: {output_file}")
-        save_data_to_json(filtered_indices, output_file)
+        save_records(filtered_indices, output_file)
         logging.info("筛选结果保存成功")
         
         logging.info("周度数据筛选任务执行完成")